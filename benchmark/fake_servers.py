@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the Telemeter (Prometheus HTTP API), UHC cluster search
+and SSO token endpoints, for benchmarking telemeter-reporter without access to
+the real services. Can be imported (see FakeServer) or run on its own, e.g.
+
+    $ python benchmark/fake_servers.py --clusters 1000 --latency 0.05 --port 18080
+"""
+import base64
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def unsigned_jwt(claims: dict) -> str:
+    """
+    Build an unsigned JSON Web Token
+
+    :param claims: (dict) the payload of the token
+    :returns: (str) the token
+    """
+    return encode_segment({"alg": "none", "typ": "JWT"}) + "." + encode_segment(claims) + "."
+
+
+def encode_segment(obj: dict) -> str:
+    """
+    Encode a JSON Web Token header or payload
+
+    :param obj: (dict) the header or payload
+    :returns: (str) its unpadded base64url-encoded JSON
+    """
+    return base64.urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b"=").decode()
+
+
+class FakeServer(object):
+    """
+    A single HTTP server answering Telemeter queries, UHC cluster searches and
+    SSO token requests for a fleet of made-up clusters
+    """
+
+    def __init__(self, clusters: int, latency: float = 0, error_rate: float = 0,
+                 young_ratio: float = 0.02, port: int = 0, seed: int = 0):
+        """
+        Instantiate a FakeServer object. The server isn't started until start()
+        is called
+
+        :param clusters: (int) the number of clusters in the fleet
+        :param latency: (float) the mean number of seconds each Telemeter query
+            takes to answer (exponentially distributed)
+        :param error_rate: (float) the proportion of Telemeter queries that are
+            answered with a 503
+        :param young_ratio: (float) the proportion of clusters that were created
+            recently (so that their query durations have to be adjusted)
+        :param port: (int) the port to listen on. Default: any free port
+        :param seed: (int) seeds the random number generator, so fleets and
+            errors are reproducible
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.stats = {"query": 0, "query_range": 0, "errors": 0, "uhc": 0, "token": 0}
+        self.stats_lock = threading.Lock()
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.clusters = []
+        for i in range(clusters):
+            age = datetime.timedelta(days=3) if self.random.random() < young_ratio else \
+                datetime.timedelta(days=self.random.randint(60, 720))
+            self.clusters.append({
+                "kind": "Cluster", "id": "1{:031x}".format(i), "name": "cluster-{:05d}".format(i),
+                "external_id": "{:08x}-0000-4000-8000-{:012x}".format(i, i),
+                "creation_timestamp": (now - age).strftime("%Y-%m-%dT%H:%M:%S.%f123Z")})
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self.__handler())
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        self.thread = None
+
+    def offline_token(self) -> str:
+        """
+        Build an (unsigned) UHC offline token pointing at this server's SSO endpoint
+
+        :returns: (str) a JSON Web Token
+        """
+        return unsigned_jwt({"iss": self.url, "aud": "cloud-services", "typ": "Offline"})
+
+    def start(self) -> "FakeServer":
+        """
+        Start serving requests in a background thread
+
+        :returns: (FakeServer) self
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving requests
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, key: str):
+        """
+        Count a request in self.stats
+        """
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def sli(self, external_id: str, query: str) -> float:
+        """
+        Make up a stable SLI for a cluster and query
+        """
+        digest = hashlib.md5((external_id + query).encode()).digest()
+        return 1 - digest[0] / 25500.0 if digest[1] else 0.98
+
+    def value(self, external_id: str, query: str) -> float:
+        """
+        Make up the result of a query for a cluster. Queries are expected to
+        return an SLI, except for the numerators of additive rules (a bare
+        sum_over_time() of a 10-minute subquery), which count the samples in
+        which the cluster was up
+        """
+        numerator = re.fullmatch(r"\s*sum_over_time\([^/]*\[(\d+)d:10m\]\s*\)\s*", query)
+        if not numerator:
+            return self.sli(external_id, query)
+        # Every window (and batch) of a cluster shares its SLI, so that they add up to a
+        # consistent total
+        rule = re.sub(r"_id=~?'[^']*'|\[\d+d:10m\]", "", query)
+        return round(self.sli(external_id, rule) * int(numerator.group(1)) * 144)
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, which would otherwise be held up by
+            # delayed ACKs
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, obj: dict, code: int = 200):
+                body = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.count("token")
+                self.send({"access_token": unsigned_jwt({"exp": int(time.time()) + 900}),
+                           "expires_in": 900})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if url.path == "/api/clusters_mgmt/v1/clusters":
+                    server.count("uhc")
+                    # Only the creation_timestamp filter of incremental syncs is understood
+                    since = re.search(r"creation_timestamp >= '([^']*)'", params.get("search", ""))
+                    clusters = [c for c in server.clusters if c["creation_timestamp"] >=
+                                since.group(1)] if since else server.clusters
+                    page, size = int(params.get("page", 1)), int(params.get("size", 100))
+                    items = clusters[(page - 1) * size:page * size]
+                    return self.send({"kind": "ClusterList", "page": page, "size": len(items),
+                                      "total": len(clusters), "items": items})
+                if url.path not in ("/api/v1/query", "/api/v1/query_range"):
+                    # E.g. the certificate check of SLIReporter
+                    return self.send({})
+
+                server.count(url.path.rsplit("/", 1)[1])
+                with server.random_lock:
+                    delay = server.random.expovariate(1 / server.latency) if server.latency else 0
+                    failed = server.random.random() < server.error_rate
+                time.sleep(delay)
+                if failed:
+                    server.count("errors")
+                    return self.send({"status": "error", "error": "overloaded"}, 503)
+                self.send({"status": "success", "data": self.evaluate(params)})
+
+            def evaluate(self, params: dict) -> dict:
+                # Only the _id selector matters: every matched cluster gets a made-up SLI
+                query = params.get("query", "")
+                batched = re.search(r"_id=~'([^']*)'", query)
+                single = re.search(r"_id='([^']*)'", query)
+                ids = batched.group(1).split("|") if batched else [single.group(1)] if single \
+                    else []
+                result = [{"metric": {"_id": i},
+                           "value": [time.time(), str(server.value(i, query))]} for i in ids]
+                if "query_range" in self.path:
+                    start, end, step = (float(params[k]) for k in ("start", "end", "step"))
+                    result = [{"metric": r["metric"],
+                               "values": [[start + k * step, r["value"][1]] for k in
+                                          range(int((end - start) // step) + 1)]} for r in result]
+                    return {"resultType": "matrix", "result": result}
+                return {"resultType": "vector", "result": result}
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Serve fake Telemeter, UHC and SSO endpoints")
+    parser.add_argument("--clusters", type=int, default=1000, help="Fleet size. Default: 1000")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="Mean latency of Telemeter queries in seconds. Default: 0")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Proportion of Telemeter queries failing with a 503. Default: 0")
+    parser.add_argument("--port", type=int, default=18080, help="Default: 18080")
+    args = parser.parse_args()
+
+    fake = FakeServer(args.clusters, args.latency, args.error_rate, port=args.port)
+    print("Serving {} clusters on {}\nUHC offline token: {}".format(args.clusters, fake.url,
+                                                                    fake.offline_token()))
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(fake.stats))
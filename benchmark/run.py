@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Benchmark telemeter-reporter end to end against local fake Telemeter and UHC
+servers (see fake_servers.py). Every scenario runs the real SLIReporter in a
+fresh process: it searches UHC for the fleet, generates the report (or, in the
+backfill scenario, a series of daily reports from range queries) and formats
+it. Wall time, request counts and peak memory are printed and saved to
+benchmark/results/<commit>.json, so that commits can be compared, e.g.
+
+    $ python benchmark/run.py
+    $ git checkout my-branch
+    $ python benchmark/run.py --compare benchmark/results/<base commit>.json
+"""
+import datetime
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import yaml
+from tabulate import tabulate
+
+from fake_servers import FakeServer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Lower is better for all of these
+MEASUREMENTS = ["wall_seconds", "report_seconds", "format_seconds", "telemeter_requests",
+                "uhc_requests", "peak_rss_mib"]
+
+
+def worker(settings_path: str):
+    """
+    Run a single scenario (in a fresh process, so that its peak memory usage
+    isn't affected by earlier scenarios) and print its measurements as JSON
+
+    :param settings_path: (str) a JSON file holding the config and options
+    """
+    with open(settings_path) as f:
+        settings = json.load(f)
+    sys.path.insert(0, settings["package"])
+    from telemeter_reporter import SLIReporter
+
+    # Logging every query would slow the run down (and bury the results)
+    logging.basicConfig(level=logging.ERROR)
+
+    start = time.perf_counter()
+    sli_rep = SLIReporter(settings["config"])
+    clusters = (cluster for query in settings["config"]["clusters"] for cluster in
+                sli_rep.get_clusters(query))
+    options = {"batch": True} if settings["batch"] else {}
+    if settings["backfill"]:
+        end_time = datetime.datetime.now(datetime.timezone.utc)
+        raw_reports = list(sli_rep.generate_backfill(
+            clusters, end_time - datetime.timedelta(days=settings["backfill"] - 1), end_time,
+            datetime.timedelta(days=1), **options).values())
+    else:
+        raw_reports = [sli_rep.generate_report(clusters, **options)]
+    report_end = time.perf_counter()
+    for raw_report in raw_reports:
+        for fmt in settings["formats"]:
+            headers = sli_rep.generate_headers(html_tooltips=(fmt == "html"))
+            sli_rep.format_report(headers, raw_report, fmt, color=(fmt == "html"),
+                                  title="Benchmark", footer="")
+    end = time.perf_counter()
+
+    print(json.dumps({"clusters": len(raw_reports[0]), "wall_seconds": end - start,
+                      "report_seconds": report_end - start, "format_seconds": end - report_end,
+                      "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def run_scenario(scenario: str, size: int, args) -> dict:
+    """
+    Benchmark a report on a fleet of the given size
+
+    :param scenario: (str) "report" for a single report, or "backfill" for a
+        series of daily reports (see --backfill)
+    :param size: (int) the number of clusters
+    :param args: the parsed command line arguments
+    :returns: (dict) the measurements
+    """
+    fake = FakeServer(size, latency=args.latency, error_rate=args.error_rate).start()
+    try:
+        with open(os.path.join(REPO_DIR, "reporter_conf.yml.tmpl")) as f:
+            config = yaml.safe_load(f)
+        config["api"]["telemeter"].update({"url": fake.url, "token": "benchmark",
+                                           "concurrency": args.concurrency})
+        config["api"]["uhc"] = {"url": fake.url, "token": fake.offline_token()}
+        config["cache"] = None
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump({"config": config, "package": args.package, "batch": args.batch,
+                       "formats": args.formats,
+                       "backfill": args.backfill if scenario == "backfill" else 0}, f)
+        try:
+            output = subprocess.run([sys.executable, __file__, "--worker", f.name],
+                                    stdout=subprocess.PIPE, check=True, timeout=args.timeout)
+        finally:
+            os.remove(f.name)
+    finally:
+        fake.stop()
+
+    result = json.loads(output.stdout.decode().strip().splitlines()[-1])
+    result.update({"scenario": scenario, "size": size, "telemeter_requests": fake.stats["query"] +
+                   fake.stats["query_range"], "telemeter_errors": fake.stats["errors"],
+                   "uhc_requests": fake.stats["uhc"] + fake.stats["token"]})
+    return result
+
+
+def commit_id(path: str) -> str:
+    """
+    Identify the commit of the benchmarked code
+
+    :param path: (str) a directory inside the git repository
+    :returns: (str) the abbreviated commit hash, with "-dirty" appended if there
+        are uncommitted changes
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=path, check=True,
+                                stdout=subprocess.PIPE).stdout.decode().strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=path,
+                               check=True, stdout=subprocess.PIPE).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def compare(results: dict, base: dict) -> str:
+    """
+    Tabulate the change of every measurement between two benchmark runs
+
+    :param results: (dict) the new results
+    :param base: (dict) the results to compare against
+    :returns: (str) a table
+    """
+    # Results from before the backfill scenario was added are all single reports
+    base_by_scenario = {(r.get("scenario", "report"), r["size"]): r for r in base["results"]}
+    rows = []
+    for result in results["results"]:
+        before = base_by_scenario.get((result["scenario"], result["size"]))
+        if before is None:
+            continue
+        for measurement in MEASUREMENTS:
+            old, new = before.get(measurement), result.get(measurement)
+            if old is None or new is None:
+                continue
+            change = "{:+.1f}%".format((new - old) / old * 100) if old else "n/a"
+            rows.append([result["scenario"], result["size"], measurement, old, new, change])
+    return tabulate(rows, ["Scenario", "Clusters", "Measurement", base["commit"],
+                           results["commit"], "Change"], floatfmt=".2f")
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark telemeter-reporter against fake servers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], metavar="N",
+                        help="Fleet sizes to benchmark. Default: 10 1000 10000")
+    parser.add_argument("--latency", type=float, default=0, metavar="SECONDS",
+                        help="Mean latency of Telemeter queries. Default: 0")
+    parser.add_argument("--error-rate", type=float, default=0, metavar="RATIO",
+                        help="Proportion of Telemeter queries failing with a 503. Default: 0")
+    parser.add_argument("--concurrency", type=int, default=16, metavar="N",
+                        help="Maximum number of concurrent Telemeter queries. Default: 16")
+    parser.add_argument("--batch", action="store_true",
+                        help="Batch queries of rules marked with 'batch: true'")
+    parser.add_argument("--backfill", type=int, default=7, metavar="DAYS",
+                        help="Also benchmark backfilling this many daily reports for each fleet "
+                             "size, which resolves every rule with range queries. 0 to skip. "
+                             "Default: 7")
+    parser.add_argument("--formats", nargs="+", default=["simple", "html", "csv"], metavar="FMT",
+                        help="Report formats to produce. Default: simple html csv")
+    parser.add_argument("--package", default=REPO_DIR, metavar="DIR",
+                        help="Benchmark the telemeter_reporter package in this directory, e.g. a "
+                             "git worktree of another commit. Default: this repository")
+    parser.add_argument("--results-dir", default=os.path.join(BENCHMARK_DIR, "results"),
+                        metavar="DIR", help="Where to save results. Default: benchmark/results")
+    parser.add_argument("--compare", metavar="RESULTS",
+                        help="Compare against the results of an earlier run (a JSON file)")
+    parser.add_argument("--timeout", type=int, default=3600, metavar="SECONDS",
+                        help="Give up on a scenario after this long. Default: 3600")
+    parser.add_argument("--worker", help="(internal) run a single scenario")
+    args = parser.parse_args()
+    if args.worker:
+        return worker(args.worker)
+    args.package = os.path.abspath(args.package)
+
+    results = {"commit": commit_id(args.package), "time": time.time(),
+               "python": sys.version.split()[0],
+               "settings": {k: getattr(args, k) for k in ("latency", "error_rate", "concurrency",
+                                                          "batch", "backfill", "formats")},
+               "results": []}
+    scenarios = ["report", "backfill"] if args.backfill > 0 else ["report"]
+    for scenario in scenarios:
+        for size in args.sizes:
+            print("Benchmarking {} ({} clusters)...".format(scenario, size), file=sys.stderr)
+            results["results"].append(run_scenario(scenario, size, args))
+
+    print(tabulate([[r["scenario"], r["size"], r["wall_seconds"], r["report_seconds"],
+                     r["format_seconds"], r["telemeter_requests"], r["uhc_requests"],
+                     r["peak_rss_mib"]] for r in results["results"]],
+                   ["Scenario", "Clusters", "Wall (s)", "Report (s)", "Format (s)",
+                    "Telemeter requests", "UHC requests", "Peak RSS (MiB)"], floatfmt=".2f"))
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, "{}.json".format(results["commit"]))
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print("\nSaved results to {}".format(path))
+
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n" + compare(results, json.load(f)))
+
+
+if __name__ == "__main__":
+    main()
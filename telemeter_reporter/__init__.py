@@ -1,2 +1,6 @@
 from .uhc import UnifiedHybridClient
-from .reporter import SLIReporter
\ No newline at end of file
+from .journal import ReportJournal
+from .metrics import Metrics
+from .report import SLIReport
+from .reporter import SLIReporter
+from .server import ReportServer
\ No newline at end of file
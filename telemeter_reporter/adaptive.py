@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Union
+
+import requests
+
+from .metrics import Metrics
+from .telemeter import QueryError, TelemeterClient
+
+
+class AIMDLimit(object):
+    """
+    Concurrency limit that adapts to the load a server can take, like TCP
+    congestion control: it grows by about one slot per round of successful
+    requests (additive increase) and is halved when the server reports that it's
+    overloaded (multiplicative decrease)
+    """
+    logger = logging.getLogger("AIMDLimit")
+
+    def __init__(self, limit: int, minimum: int = 1, decrease_factor: float = 0.5,
+                 cooldown: float = 1.0):
+        """
+        Instantiate an AIMDLimit object
+
+        :param limit: (int) the initial (and maximum) number of concurrent requests
+        :param minimum: (int) the limit never drops below this
+        :param decrease_factor: (float) the limit is multiplied by this on overload
+        :param cooldown: (float) the minimum number of seconds between decreases,
+            so that a burst of failures from one overload only counts once
+        """
+        self.maximum = max(int(limit), 1)
+        self.minimum = min(max(int(minimum), 1), self.maximum)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self.__last_decrease = 0
+        self.__condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait until a request may be sent, and take its slot
+        """
+        with self.__condition:
+            while self.in_flight >= int(self.limit):
+                self.__condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self) -> bool:
+        """
+        Take a slot for a request if one is free right now
+
+        :returns: (bool) True if a slot was taken
+        """
+        with self.__condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, overloaded: bool = False):
+        """
+        Give back the slot of a finished request, and adapt the limit
+
+        :param overloaded: (bool) True if the server reported that it's overloaded
+            (or the request timed out)
+        """
+        with self.__condition:
+            self.in_flight -= 1
+            if overloaded:
+                now = time.monotonic()
+                if now - self.__last_decrease >= self.cooldown:
+                    self.__last_decrease = now
+                    self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+                    self.logger.warning("Telemeter is overloaded, reducing concurrency to "
+                                        "{}".format(int(self.limit)))
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.__condition.notify_all()
+
+
+class AdaptiveTelemeterClient(object):
+    """
+    Wraps a TelemeterClient with retries (with jittered exponential backoff), an
+    adaptive (AIMD) concurrency limit, and optional hedging of slow requests.
+    Offers the same query methods as TelemeterClient
+    """
+    logger = logging.getLogger("AdaptiveTelemeterClient")
+
+    # Errors worth retrying, and those that mean the server is overloaded
+    retryable_status_codes = {429, 500, 502, 503, 504}
+    overload_status_codes = {429, 502, 503, 504}
+
+    # Recent latencies kept for choosing when to hedge, and how many are needed to start
+    latency_window = 200
+    min_latency_samples = 20
+
+    def __init__(self, client: TelemeterClient, concurrency: int, retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 30, adaptive: bool = True,
+                 hedge_percentile: float = None, metrics: Metrics = None):
+        """
+        Instantiate an AdaptiveTelemeterClient object
+
+        :param client: (TelemeterClient) the client to send queries with
+        :param concurrency: (int) the maximum number of queries to send at once
+        :param retries: (int) how many times to retry a query that failed with a
+            timeout, connection error, 429 or 5xx
+        :param backoff: (float) the base delay (in seconds) before retrying. The
+            n-th retry waits a random time of up to backoff * 2^n seconds (or as
+            long as the server asked for with Retry-After)
+        :param max_backoff: (float) the upper limit of the delay before a retry
+        :param adaptive: (bool) if True, the number of concurrent queries is
+            reduced while Telemeter is overloaded and grows back afterwards
+        :param hedge_percentile: (float) if set, a query that has been running
+            longer than this percentile (e.g. 95) of recent query latencies is
+            sent a second time (if there's spare concurrency), and whichever copy
+            answers first is used
+        :param metrics: (Metrics) records how long every request takes, and how
+            long queries spend waiting for a slot and backing off before retries
+        """
+        self.client = client
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.hedge_percentile = hedge_percentile
+        self.metrics = metrics or Metrics()
+        self.limit = AIMDLimit(concurrency if adaptive else 2 ** 31 - 1)
+        self.hedges = 0
+        self.retried = 0
+        self.__latencies = collections.deque(maxlen=self.latency_window)
+        # Guards the latencies and the counters above, which are updated by every worker thread
+        self.__lock = threading.Lock()
+
+    def custom_query(self, query: str, params: dict = None, rule: str = None) -> list:
+        """
+        Evaluate a PromQL instant query (see TelemeterClient.custom_query())
+
+        :param query: (str) the PromQL query to run
+        :param params: (dict) optional extra GET parameters, such as "time"
+        :param rule: (str) the name of the rule the query belongs to, for metrics
+        :returns: (list) the "result" section of the API's response
+        """
+        return self.__call(self.client.custom_query, query, params, rule=rule)
+
+    def custom_query_range(self, query: str, start_time: int, end_time: int, step: int,
+                           params: dict = None, rule: str = None) -> list:
+        """
+        Evaluate a PromQL range query (see TelemeterClient.custom_query_range())
+
+        :param query: (str) the PromQL query to run
+        :param start_time: (int) the first evaluation time (epoch seconds)
+        :param end_time: (int) the last possible evaluation time (epoch seconds)
+        :param step: (int) the time between evaluations, in seconds
+        :param params: (dict) optional extra GET parameters
+        :param rule: (str) the name of the rule the query belongs to, for metrics
+        :returns: (list) the "result" section of the API's response (a matrix)
+        """
+        return self.__call(self.client.custom_query_range, query, start_time, end_time, step,
+                           params, rule=rule)
+
+    def __call(self, func: Callable, *args, rule: str = None) -> list:
+        """
+        Run a query, retrying it if it fails with a transient error
+
+        :param func: (callable) the TelemeterClient method to call
+        :param args: the arguments of the method
+        :param rule: (str) the name of the rule the query belongs to, for metrics
+        :returns: (list) the result of the query
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self.__attempt(func, *args, rule=rule)
+            except Exception as ex:
+                if attempt == self.retries or not self.__retryable(ex):
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if isinstance(ex, QueryError) and ex.retry_after:
+                    delay = max(delay, min(self.max_backoff, ex.retry_after))
+                with self.__lock:
+                    self.retried += 1
+                self.logger.warning("Query failed ({}), retrying in {:.1f}s ({} of {})".format(
+                    repr(ex), delay, attempt + 1, self.retries))
+                self.metrics.inc("query_backoff_seconds_total", delay, rule=rule)
+                time.sleep(delay)
+
+    def __attempt(self, func: Callable, *args, rule: str = None) -> list:
+        """
+        Send a query once, hedging it if it takes unusually long
+
+        :param func: (callable) the TelemeterClient method to call
+        :param args: the arguments of the method
+        :param rule: (str) the name of the rule the query belongs to, for metrics
+        :returns: (list) the result of the query
+        """
+        hedge_after = self.__hedge_delay()
+        if hedge_after is None:
+            return self.__send(func, *args, rule=rule)
+
+        primary = self.__spawn(func, *args, rule=rule)
+        if wait([primary], timeout=hedge_after).done or not self.limit.try_acquire():
+            return primary.result()
+
+        with self.__lock:
+            self.hedges += 1
+        self.logger.debug("Hedging a query that has been running for {:.1f}s".format(hedge_after))
+        hedge = self.__spawn(func, *args, acquired=True, rule=rule)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        first = done.pop()
+        if first.exception() is not None:
+            # Give the other copy a chance before giving up
+            return (hedge if first is primary else primary).result()
+        return first.result()
+
+    def __spawn(self, func: Callable, *args, acquired: bool = False, rule: str = None) -> Future:
+        """
+        Send a copy of a hedged query (see __send()) in a thread of its own. The
+        thread is a daemon, so the losing copy of a query can't hold up the exit
+        of the interpreter while it waits for Telemeter (for up to the timeout of
+        the request) after the report has been written
+
+        :param func: (callable) the TelemeterClient method to call
+        :param args: the arguments of the method
+        :param acquired: (bool) see __send()
+        :param rule: (str) the name of the rule the query belongs to, for metrics
+        :returns: (Future) the result of the query
+        """
+        future = Future()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(self.__send(func, *args, acquired=acquired, rule=rule))
+            except BaseException as ex:
+                future.set_exception(ex)
+
+        threading.Thread(target=run, name="hedge", daemon=True).start()
+        return future
+
+    def __send(self, func: Callable, *args, acquired: bool = False, rule: str = None) -> list:
+        """
+        Send a query within the concurrency limit, and record how it went
+
+        :param func: (callable) the TelemeterClient method to call
+        :param args: the arguments of the method
+        :param acquired: (bool) True if a slot of the limit was already taken
+        :param rule: (str) the name of the rule the query belongs to, for metrics
+        :returns: (list) the result of the query
+        """
+        if not acquired:
+            with self.metrics.time("query_queue_seconds", rule=rule):
+                self.limit.acquire()
+        overloaded = False
+        start = time.monotonic()
+        try:
+            result = func(*args)
+            with self.__lock:
+                self.__latencies.append(time.monotonic() - start)
+            return result
+        except Exception as ex:
+            overloaded = self.__overloaded(ex)
+            raise
+        finally:
+            # Only the request itself, not the time spent waiting for a slot or before a retry
+            self.metrics.observe("query_duration_seconds", time.monotonic() - start, rule=rule)
+            self.limit.release(overloaded)
+
+    def __hedge_delay(self) -> Union[float, None]:
+        """
+        Decide how long a query may run before it's hedged
+
+        :returns: (float or None) the delay in seconds, or None to not hedge
+        """
+        if not self.hedge_percentile:
+            return None
+        with self.__lock:
+            latencies = sorted(self.__latencies)
+        if len(latencies) < self.min_latency_samples:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100.0))
+        return latencies[index]
+
+    @classmethod
+    def __retryable(cls, ex: Exception) -> bool:
+        """
+        Check whether a failed query is worth retrying
+
+        :param ex: (Exception) the error the query failed with
+        :returns: (bool) True for timeouts, connection errors, 429 and 5xx
+        """
+        if isinstance(ex, QueryError):
+            return ex.status_code in cls.retryable_status_codes
+        return isinstance(ex, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+    @classmethod
+    def __overloaded(cls, ex: Exception) -> bool:
+        """
+        Check whether a failed query means that Telemeter is overloaded
+
+        :param ex: (Exception) the error the query failed with
+        :returns: (bool) True for timeouts, 429 and 502-504
+        """
+        if isinstance(ex, QueryError):
+            return ex.status_code in cls.overload_status_codes
+        return isinstance(ex, requests.exceptions.Timeout)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from typing import Callable, Dict, List, Tuple, Union
+
+# A time window, as (end of the window in epoch seconds, length of the window in days)
+Window = Tuple[int, int]
+
+# Identifies one partial query of an additive rule: ("numerator" or "denominator", window)
+Part = Tuple[str, Window]
+
+
+class AdditiveSLI(object):
+    """
+    Computes the SLI of an "additive" rule (one of the form sum(numerator) /
+    sum(denominator)) for one cluster from partial sums over several
+    consecutive time windows
+    """
+    logger = logging.getLogger("AdditiveSLI")
+
+    def __init__(self, place: Callable[[Union[float, None]], None], windows: List[Window],
+                 denominator: Union[float, None] = None,
+                 maximum: float = None, known: Dict[Window, Tuple[float, float]] = None,
+                 store: Callable[[Window, float, float], None] = None,
+                 min_exclusive: float = None):
+        """
+        Instantiate an AdditiveSLI object. If every window's partial sums are
+        already known, the SLI is computed immediately
+
+        :param place: (callable) called with the SLI (as a percentage, or None if
+            it couldn't be computed) once every window has been resolved
+        :param windows: (list) the windows that together make up the duration of
+            the report
+        :param denominator: (float) the denominator of a single day, if it's a
+            constant. If None, denominators are resolved by queries, just like
+            numerators
+        :param maximum: (float) optional upper limit for the SLI (before it's
+            converted to a percentage)
+        :param known: (dict) partial sums that are already known (e.g. from a
+            PartialStore), as (numerator, denominator) tuples keyed by window. A
+            numerator of None means that the window contained no samples
+        :param store: (callable) called with (window, numerator, denominator) for
+            every newly resolved window once the SLI is complete
+        :param min_exclusive: (float) if set, an SLI (before it's limited by
+            maximum) that isn't greater than this counts as no result, like a
+            "> 0" filter at the end of the rule's query
+        """
+        self.place = place
+        self.windows = list(windows)
+        self.denominator = denominator
+        self.maximum = maximum
+        self.min_exclusive = min_exclusive
+        self.store = store
+        self.failed = False
+
+        self.__values = {}
+        self.__new_windows = []
+        self.__lock = threading.Lock()
+        for window in self.windows:
+            if known and window in known:
+                self.__values[("numerator", window)] = known[window][0]
+                self.__values[("denominator", window)] = known[window][1]
+            else:
+                self.__new_windows.append(window)
+                if self.denominator is not None:
+                    self.__values[("denominator", window)] = self.denominator * window[1]
+
+        self.missing_parts = [(kind, window) for window in self.__new_windows for kind in
+                              ("numerator", "denominator") if (kind, window) not in self.__values]
+        self.__remaining = len(self.missing_parts)
+        if not self.__remaining:
+            self.__finish()
+
+    def add(self, part: Part, value: Union[float, None]):
+        """
+        Record the result of a partial query
+
+        :param part: (tuple) which part of the SLI the value belongs to
+        :param value: (float) the (raw) result of the query, or None if the query
+            returned no samples
+        """
+        with self.__lock:
+            self.__values[part] = value
+            self.__remaining -= 1
+            done = self.__remaining == 0
+        if done:
+            self.__finish()
+
+    def fail(self, part: Part):
+        """
+        Record that a partial query failed. The SLI will be None
+
+        :param part: (tuple) which part of the SLI couldn't be resolved
+        """
+        with self.__lock:
+            self.failed = True
+            self.__remaining -= 1
+            done = self.__remaining == 0
+        if done:
+            self.__finish()
+
+    def __finish(self):
+        """
+        Combine the partial sums into the final SLI, place it into the report and
+        hand any new partial sums to the store
+        """
+        if self.failed or not self.windows:
+            self.place(None)
+            return
+
+        numerators = [self.__values[("numerator", w)] for w in self.windows]
+        denominator = sum(self.__values[("denominator", w)] or 0 for w in self.windows)
+        if all(n is None for n in numerators) or not denominator:
+            # No samples at all (or nothing to divide by), so there's no meaningful SLI
+            self.place(None)
+        else:
+            sli = sum(n or 0 for n in numerators) / denominator
+            if self.min_exclusive is not None and sli <= self.min_exclusive:
+                self.place(None)
+            else:
+                if self.maximum is not None:
+                    sli = min(sli, self.maximum)
+                self.place(sli * 100)
+
+        if self.store:
+            for window in self.__new_windows:
+                self.store(window, self.__values[("numerator", window)],
+                           self.__values[("denominator", window)])
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+def fingerprint(*args) -> str:
+    """
+    Build a fingerprint of anything that affects stored results (e.g. the
+    definition of a rule, or the settings of a run), so that results computed
+    differently are never mixed up
+
+    :param args: anything JSON-serializable
+    :returns: (str) a fixed-length fingerprint
+    """
+    return hashlib.sha256(json.dumps(args, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SQLiteStore(object):
+    """
+    Base class of the SQLite databases kept in the cache directory. The
+    connection is shared by every thread, and all access to it is serialized
+    with self._lock
+    """
+    default_dir = "~/.cache/telemeter-reporter"
+
+    # The name of the database file in the cache directory (see path_from_config())
+    filename = None
+
+    fingerprint = staticmethod(fingerprint)
+
+    def __init__(self, path: str, *schema: str):
+        """
+        Open (or create) the database
+
+        :param path: (str) the path of the SQLite database file. Parent
+            directories are created if necessary
+        :param schema: (str) statements creating the tables (and indexes) of the
+            database if they don't exist yet
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in schema:
+            self._db.execute(statement)
+        self._db.commit()
+
+    @classmethod
+    def path_from_config(cls, cache_config: dict) -> str:
+        """
+        Find the database in the cache directory described by the "cache" section
+        of a config file
+
+        :param cache_config: (dict) with the (optional) key "dir"
+        :returns: (str) the path of the database file
+        """
+        cache_dir = cache_config.get("dir") or cls.default_dir
+        return os.path.join(os.path.expanduser(cache_dir), cls.filename)
+
+    def close(self):
+        """
+        Close the underlying database
+        """
+        with self._lock:
+            self._db.close()
+
+
+class QueryCache(SQLiteStore):
+    """
+    Persistent cache of Telemeter query results, keyed by the rendered PromQL
+    query and its evaluation time. Backed by a SQLite database
+    """
+    logger = logging.getLogger("QueryCache")
+
+    filename = "queries.sqlite"
+    default_ttl = 90
+    default_max_entries = 100000
+
+    def __init__(self, path: str, ttl: float = None, max_entries: int = None):
+        """
+        Open (or create) a query cache
+
+        :param path: (str) the path of the SQLite database file. Parent
+            directories are created if necessary
+        :param ttl: (float) the number of days to keep each entry. Default: 90
+        :param max_entries: (int) the maximum number of entries to keep. The least
+            recently used entries are evicted first. Default: 100000
+        """
+        self.ttl = float(ttl or self.default_ttl) * 24 * 60 * 60
+        self.max_entries = int(max_entries or self.default_max_entries)
+        self.hits = 0
+        self.misses = 0
+        super().__init__(path, "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, "
+                               "created REAL NOT NULL, accessed REAL NOT NULL, "
+                               "result TEXT NOT NULL)")
+        self.evict()
+        self.logger.info("Using query cache at {}".format(self.path))
+
+    @classmethod
+    def from_config(cls, cache_config: dict) -> "QueryCache":
+        """
+        Open the query cache described by the "cache" section of a config file
+
+        :param cache_config: (dict) with the (optional) keys "dir", "ttl" and
+            "max_entries"
+        :returns: (QueryCache) the opened cache
+        """
+        return cls(cls.path_from_config(cache_config), ttl=cache_config.get("ttl"),
+                   max_entries=cache_config.get("max_entries"))
+
+    @staticmethod
+    def __key(query: str, query_time: int) -> str:
+        """
+        Build the cache key for a query
+
+        :param query: (str) the rendered PromQL query
+        :param query_time: (int) the evaluation time of the query (epoch seconds)
+        :returns: (str) a fixed-length key
+        """
+        return hashlib.sha256("{}\0{}".format(query_time, query).encode()).hexdigest()
+
+    def get(self, query: str, query_time: int) -> Optional[list]:
+        """
+        Look up the result of a query
+
+        :param query: (str) the rendered PromQL query
+        :param query_time: (int) the evaluation time of the query (epoch seconds)
+        :returns: (list or None) the cached result, or None on a cache miss
+        """
+        key = self.__key(query, query_time)
+        with self._lock:
+            row = self._db.execute("SELECT result FROM results WHERE key = ? AND created > ?",
+                                   (key, time.time() - self.ttl)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, query: str, query_time: int, result: list):
+        """
+        Store the result of a query
+
+        :param query: (str) the rendered PromQL query
+        :param query_time: (int) the evaluation time of the query (epoch seconds)
+        :param result: (list) the result returned by Telemeter
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                             (self.__key(query, query_time), now, now, json.dumps(result)))
+            self._db.commit()
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used entries if the cache
+        holds more than max_entries
+        """
+        with self._lock:
+            expired = self._db.execute("DELETE FROM results WHERE created <= ?",
+                                       (time.time() - self.ttl,)).rowcount
+            overflow = self._db.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed DESC "
+                "LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+            self._db.commit()
+        if expired or overflow:
+            self.logger.info("Evicted {} expired and {} excess entries from the query cache".format(
+                expired, overflow))
+
+
+class PartialStore(SQLiteStore):
+    """
+    Persistent store of the per-window partial sums of additive rules, keyed by
+    cluster, rule fingerprint and window. Backed by a SQLite database
+    """
+    logger = logging.getLogger("PartialStore")
+
+    filename = "partials.sqlite"
+    default_ttl = 90
+
+    # How often expired partial sums are evicted by a long-running process (e.g.
+    # "telemeter-reporter serve"), in seconds
+    evict_interval = 24 * 60 * 60
+
+    def __init__(self, path: str, ttl: float = None):
+        """
+        Open (or create) a partial sum store
+
+        :param path: (str) the path of the SQLite database file. Parent
+            directories are created if necessary
+        :param ttl: (float) the number of days to keep the partial sums of each
+            window, counting from the end of the window. Default: 90
+        """
+        self.ttl = float(ttl or self.default_ttl) * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self.__last_evict = 0
+        super().__init__(path, "CREATE TABLE IF NOT EXISTS partials (external_id TEXT NOT NULL, "
+                               "fingerprint TEXT NOT NULL, window_end INTEGER NOT NULL, "
+                               "window_days INTEGER NOT NULL, numerator REAL, denominator REAL, "
+                               "PRIMARY KEY (external_id, fingerprint, window_end, window_days))")
+        self.evict()
+        self.logger.info("Using partial sum store at {}".format(self.path))
+
+    @classmethod
+    def from_config(cls, cache_config: dict) -> "PartialStore":
+        """
+        Open the partial sum store that lives next to the query cache described
+        by the "cache" section of a config file
+
+        :param cache_config: (dict) with the (optional) keys "dir" and
+            "partials_ttl"
+        :returns: (PartialStore) the opened store
+        """
+        return cls(cls.path_from_config(cache_config), ttl=cache_config.get("partials_ttl"))
+
+    def get(self, external_id: str, fingerprint: str, windows: list) -> dict:
+        """
+        Look up the stored partial sums for a cluster's windows
+
+        :param external_id: (str) the external_id of the cluster
+        :param fingerprint: (str) the fingerprint of the rule
+        :param windows: (list) (window_end, window_days) tuples to look up
+        :returns: (dict) (numerator, denominator) tuples keyed by window, for
+            those windows that are stored
+        """
+        if not windows:
+            return {}
+        ends = [window[0] for window in windows]
+        with self._lock:
+            rows = self._db.execute("SELECT window_end, window_days, numerator, denominator "
+                                    "FROM partials WHERE external_id = ? AND fingerprint = ? AND "
+                                    "window_end >= ? AND window_end <= ?",
+                                    (external_id, fingerprint, min(ends), max(ends))).fetchall()
+        stored = {(row[0], row[1]): (row[2], row[3]) for row in rows}
+        known = {window: stored[window] for window in windows if window in stored}
+        self.hits += len(known)
+        self.misses += len(windows) - len(known)
+        return known
+
+    def put(self, external_id: str, fingerprint: str, window: tuple, numerator: float,
+            denominator: float):
+        """
+        Store the partial sums of a window
+
+        :param external_id: (str) the external_id of the cluster
+        :param fingerprint: (str) the fingerprint of the rule
+        :param window: (tuple) the (window_end, window_days) of the partial sums
+        :param numerator: (float) the numerator, or None if there were no samples
+        :param denominator: (float) the denominator
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO partials VALUES (?, ?, ?, ?, ?, ?)",
+                             (external_id, fingerprint, window[0], window[1], numerator,
+                              denominator))
+            self._db.commit()
+        if time.monotonic() - self.__last_evict > self.evict_interval:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the partial sums of windows that ended more than ttl days ago.
+        Called when the store is opened, and then at most every evict_interval
+        seconds by put()
+        """
+        self.__last_evict = time.monotonic()
+        with self._lock, self._db:
+            expired = self._db.execute("DELETE FROM partials WHERE window_end <= ?",
+                                       (time.time() - self.ttl,)).rowcount
+        if expired:
+            self.logger.info("Evicted {} expired windows from the partial sum store".format(
+                expired))
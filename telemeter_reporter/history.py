@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Dict, Tuple
+
+from .cache import SQLiteStore
+from .report import SLIReport
+
+
+class SLIHistory(SQLiteStore):
+    """
+    Persistent record of the SLIs of past reports, keyed by cluster, rule and
+    evaluation time, so that a report can show how its SLIs changed without
+    querying Telemeter for earlier points in time. Backed by a SQLite database
+    """
+    logger = logging.getLogger("SLIHistory")
+
+    filename = "history.sqlite"
+    default_ttl = 400
+    default_resolution = 24
+
+    # How often expired SLIs are evicted by a long-running process (e.g. "telemeter-reporter
+    # serve"), in seconds
+    evict_interval = 24 * 60 * 60
+
+    # Evaluations this close to a report's own time are treated as part of the same run (e.g. the
+    # shards of a sharded run started without --time) rather than as an earlier report
+    same_run_window = 10 * 60
+
+    def __init__(self, path: str, ttl: float = None, resolution: float = None):
+        """
+        Open (or create) an SLI history
+
+        :param path: (str) the path of the SQLite database file. Parent
+            directories are created if necessary
+        :param ttl: (float) the number of days to keep each SLI, counting from
+            its evaluation time. Default: 400
+        :param resolution: (float) the number of hours per snapshot. Of the
+            reports evaluated within the same period (e.g. the same UTC day), only
+            the SLIs of the latest are kept. Default: 24
+        """
+        self.ttl = float(ttl or self.default_ttl) * 24 * 60 * 60
+        self.resolution = max(int(float(resolution or self.default_resolution) * 60 * 60), 1)
+        self.__last_evict = 0
+        # Lookups are per rule, over a range of time, for every cluster
+        super().__init__(path, "CREATE TABLE IF NOT EXISTS slis (rule TEXT NOT NULL, "
+                               "fingerprint TEXT NOT NULL, external_id TEXT NOT NULL, "
+                               "time INTEGER NOT NULL, sli REAL NOT NULL, "
+                               "PRIMARY KEY (rule, fingerprint, external_id, time)) WITHOUT ROWID")
+        self.evict()
+        self.logger.info("Using SLI history at {}".format(self.path))
+
+    @classmethod
+    def from_config(cls, cache_config: dict) -> "SLIHistory":
+        """
+        Open the SLI history that lives next to the query cache described by the
+        "cache" section of a config file
+
+        :param cache_config: (dict) with the (optional) keys "dir", "history_ttl"
+            and "history_resolution"
+        :returns: (SLIHistory) the opened history
+        """
+        return cls(cls.path_from_config(cache_config), ttl=cache_config.get("history_ttl"),
+                   resolution=cache_config.get("history_resolution"))
+
+    def record(self, report: SLIReport, fingerprints: Dict[str, str], eval_time: datetime):
+        """
+        Store the known SLIs of a report. SLIs recorded for the same cluster and
+        rule at an earlier time in the same period (see resolution) are
+        replaced; if a later report of the period was recorded already, the SLIs
+        are not stored at all
+
+        :param report: (SLIReport) the report to store
+        :param fingerprints: (dict) the fingerprint of each rule's definition, by
+            rule name. SLIs are only compared to earlier ones with the same
+            fingerprint
+        :param eval_time: (datetime) the evaluation time of the report
+        """
+        timestamp = int(eval_time.timestamp())
+        period_start = timestamp - timestamp % self.resolution
+        period_end = period_start + self.resolution
+        width = len(report.rules)
+        rows = [(rule, fingerprints[rule], external_id, timestamp, report.sli[index * width + i])
+                for index, external_id in enumerate(report.external_ids) if external_id
+                for i, rule in enumerate(report.rules)
+                if not math.isnan(report.sli[index * width + i])]
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM slis WHERE rule = ? AND fingerprint = ? AND external_id = ? AND "
+                "time >= ? AND time < ?",
+                [row[:3] + (period_start, timestamp) for row in rows])
+            self._db.executemany(
+                "INSERT OR REPLACE INTO slis SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM "
+                "slis WHERE rule = ? AND fingerprint = ? AND external_id = ? AND time > ? AND "
+                "time < ?)", [row + row[:4] + (period_end,) for row in rows])
+        self.logger.info("Recorded {} SLIs evaluated at {} in the SLI history".format(
+            len(rows), eval_time))
+        if time.monotonic() - self.__last_evict > self.evict_interval:
+            self.evict()
+
+    def trend(self, report: SLIReport, fingerprints: Dict[str, str], eval_time: datetime,
+              days: int) -> Tuple[SLIReport, SLIReport]:
+        """
+        Look up how the SLIs of a report compare to earlier reports
+
+        :param report: (SLIReport) the report to look up
+        :param fingerprints: (dict) see record()
+        :param eval_time: (datetime) the evaluation time of the report
+        :param days: (int) how far back to look, in days
+        :returns: (tuple) two SLIReports with the same clusters and rules as
+            report: the SLIs of the most recent earlier report within the last
+            days (None if there is none), and the lowest SLI over the last days
+            (including report itself)
+        """
+        end = int(eval_time.timestamp())
+        start = end - days * 24 * 60 * 60
+        previous = SLIReport(report.rules, report.goals)
+        minimum = SLIReport(report.rules, report.goals)
+        for index, name in enumerate(report.clusters):
+            previous.add_cluster(name, report.external_ids[index])
+            minimum.add_cluster(name, report.external_ids[index])
+
+        for i, rule in enumerate(report.rules):
+            with self._lock:
+                # SQLite takes the bare sli column from the row with the latest time
+                earlier = self._db.execute(
+                    "SELECT external_id, sli, MAX(time) FROM slis WHERE rule = ? AND "
+                    "fingerprint = ? AND time >= ? AND time < ? GROUP BY external_id",
+                    (rule, fingerprints[rule], start, end - self.same_run_window)).fetchall()
+                lowest = self._db.execute(
+                    "SELECT external_id, MIN(sli) FROM slis WHERE rule = ? AND fingerprint = ? "
+                    "AND time >= ? AND time <= ? GROUP BY external_id",
+                    (rule, fingerprints[rule], start, end)).fetchall()
+            for external_id, sli, _ in earlier:
+                if external_id in previous:
+                    previous.set(external_id, rule, sli)
+            lowest = dict(lowest)
+            for index, name in enumerate(report.clusters):
+                values = [v for v in (lowest.get(report.external_ids[index]),
+                                      report.sli[index * len(report.rules) + i])
+                          if v is not None and not math.isnan(v)]
+                minimum.set(SLIReport.key(name, report.external_ids[index]), rule,
+                            min(values) if values else None)
+        return previous, minimum
+
+    def evict(self):
+        """
+        Remove SLIs that were evaluated more than ttl days ago. Called when the
+        history is opened, and then at most every evict_interval seconds by
+        record()
+        """
+        self.__last_evict = time.monotonic()
+        with self._lock, self._db:
+            expired = self._db.execute("DELETE FROM slis WHERE time <= ?",
+                                       (time.time() - self.ttl,)).rowcount
+        if expired:
+            self.logger.info("Evicted {} expired SLIs from the SLI history".format(expired))
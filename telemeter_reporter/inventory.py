@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Iterator
+
+from .cache import SQLiteStore
+from .uhc import Cluster, UnifiedHybridClient
+
+
+class ClusterIndex(SQLiteStore):
+    """
+    Persistent local copy of the clusters matching UHC search queries, so that
+    later runs only have to ask UHC for clusters created since the previous
+    one. Backed by a SQLite database.
+
+    New clusters are fetched incrementally (by creation_timestamp). Clusters
+    that were deleted, renamed or stopped matching a query are only noticed by a
+    full sync, which happens every full_sync_interval hours
+    """
+    logger = logging.getLogger("ClusterIndex")
+
+    filename = "clusters.sqlite"
+    default_full_sync_interval = 24
+
+    # Incremental syncs also re-fetch clusters created this long before the previous sync, since
+    # clusters are only given an external_id once they're installed
+    sync_lookback = 24 * 60 * 60
+
+    def __init__(self, path: str, full_sync_interval: float = None):
+        """
+        Open (or create) a cluster index
+
+        :param path: (str) the path of the SQLite database file. Parent
+            directories are created if necessary
+        :param full_sync_interval: (float) the number of hours after which the
+            clusters matching a query are downloaded from scratch. Default: 24
+        """
+        self.full_sync_interval = float(
+            full_sync_interval or self.default_full_sync_interval) * 60 * 60
+        super().__init__(path,
+                         "CREATE TABLE IF NOT EXISTS clusters (id TEXT PRIMARY KEY, "
+                         "name TEXT NOT NULL, external_id TEXT NOT NULL, "
+                         "creation_timestamp REAL NOT NULL)",
+                         "CREATE TABLE IF NOT EXISTS matches (query TEXT NOT NULL, "
+                         "id TEXT NOT NULL, PRIMARY KEY (query, id))",
+                         "CREATE TABLE IF NOT EXISTS syncs (query TEXT PRIMARY KEY, "
+                         "last_sync REAL NOT NULL, last_full_sync REAL NOT NULL)")
+        self.logger.info("Using cluster index at {}".format(self.path))
+
+    @classmethod
+    def from_config(cls, cache_config: dict, full_sync_interval: float = None) -> "ClusterIndex":
+        """
+        Open the cluster index that lives next to the query cache described by
+        the "cache" section of a config file
+
+        :param cache_config: (dict) with the (optional) key "dir"
+        :param full_sync_interval: (float) see __init__()
+        :returns: (ClusterIndex) the opened index
+        """
+        return cls(cls.path_from_config(cache_config), full_sync_interval=full_sync_interval)
+
+    def search(self, uhc: UnifiedHybridClient, query: str,
+               created_before: datetime = None) -> Iterator[Cluster]:
+        """
+        Get the clusters matching a UHC search query (that have an external_id),
+        syncing the index with UHC first
+
+        :param uhc: (UnifiedHybridClient) the client to sync with
+        :param query: (str) a UHC search string (see UHC API docs)
+        :param created_before: (datetime) if provided, only return clusters that
+            were created before this point in time
+        :returns: (generator) the matching Clusters
+        """
+        with self._lock:
+            state = self._db.execute("SELECT last_sync, last_full_sync FROM syncs WHERE query = ?",
+                                     (query,)).fetchone()
+        sync_time = time.time()
+        if state is None or sync_time - state[1] >= self.full_sync_interval:
+            # Clusters are passed on as they arrive, so the report can start while the rest of the
+            # fleet is still downloading
+            self.logger.info("Full sync of the clusters matching \"{}\"".format(query))
+            found = []
+            for cluster in uhc.search_clusters(query):
+                if cluster.external_id:
+                    found.append(cluster)
+                    if created_before is None or cluster.creation_timestamp < created_before:
+                        yield cluster
+            self.__store(query, found, sync_time, full=True)
+            return
+
+        since = datetime.fromtimestamp(state[0] - self.sync_lookback, timezone.utc)
+        new = [cluster for cluster in uhc.search_clusters(
+            "({}) and creation_timestamp >= '{}'".format(query, since.strftime(
+                "%Y-%m-%dT%H:%M:%SZ"))) if cluster.external_id]
+        self.__store(query, new, sync_time, full=False)
+        self.logger.info("Incremental sync of the clusters matching \"{}\": {} new or recent "
+                         "clusters".format(query, len(new)))
+
+        sql = "SELECT c.id, c.name, c.external_id, c.creation_timestamp FROM matches m JOIN " \
+              "clusters c ON c.id = m.id WHERE m.query = ?"
+        params = (query,)
+        if created_before is not None:
+            sql += " AND c.creation_timestamp < ?"
+            params += (created_before.timestamp(),)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY c.creation_timestamp", params).fetchall()
+        for row in rows:
+            yield Cluster(row[0], row[1], row[2], datetime.fromtimestamp(row[3], timezone.utc))
+
+    def __store(self, query: str, clusters: list, sync_time: float, full: bool):
+        """
+        Record the result of a sync
+
+        :param query: (str) the UHC search string that was synced
+        :param clusters: (list) the Clusters returned by UHC
+        :param sync_time: (float) the time at which the sync started (epoch seconds)
+        :param full: (bool) True if clusters is everything matching the query, in
+            which case clusters that aren't in it are removed from the query's
+            matches
+        """
+        with self._lock, self._db:
+            if full:
+                self._db.execute("DELETE FROM matches WHERE query = ?", (query,))
+            self._db.executemany("INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?)",
+                                 [(c.id, c.name, c.external_id, c.creation_timestamp.timestamp())
+                                  for c in clusters])
+            self._db.executemany("INSERT OR IGNORE INTO matches VALUES (?, ?)",
+                                 [(query, c.id) for c in clusters])
+            if full:
+                self._db.execute("INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)",
+                                 (query, sync_time, sync_time))
+            else:
+                self._db.execute("UPDATE syncs SET last_sync = ? WHERE query = ?",
+                                 (sync_time, query))
+            # Forget clusters that no longer match any query
+            self._db.execute("DELETE FROM clusters WHERE id NOT IN (SELECT id FROM matches)")
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Tuple, Union
+
+from .cache import fingerprint
+
+
+class ReportJournal(object):
+    """
+    Append-only checkpoint of the SLIs resolved so far by a report run, so that
+    an interrupted run can be resumed without repeating completed queries.
+
+    The journal is a JSON-lines file. The first line identifies the run (its
+    query time and a fingerprint of its settings); every further line records
+    one (cluster, rule) result
+    """
+    logger = logging.getLogger("ReportJournal")
+
+    default_flush_interval = 5
+
+    def __init__(self, path: str, resume: bool = False, flush_interval: float = None):
+        """
+        Instantiate a ReportJournal object. Nothing is read or written until
+        begin() is called
+
+        :param path: (str) the path of the journal file. Parent directories are
+            created if necessary
+        :param resume: (bool) if True, pick up the results recorded in an existing
+            journal (if its run matches). Otherwise any existing journal is
+            discarded
+        :param flush_interval: (float) the maximum number of seconds that recorded
+            results are buffered in memory before they're written to disk.
+            Default: 5
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.resume = resume
+        self.flush_interval = float(flush_interval or self.default_flush_interval)
+        self.completed = {}
+        self.__file = None
+        self.__last_flush = 0
+        # Reentrant, so the journal can still be closed if a signal interrupts a record() call
+        self.__lock = threading.RLock()
+
+    # Identifies the settings of a report run, so that a journal is only resumed by a run that
+    # would produce the same results
+    fingerprint = staticmethod(fingerprint)
+
+    def begin(self, query_time: Union[datetime, None], fingerprint: str) -> datetime:
+        """
+        Start journaling a run. If resuming, the results of a matching earlier
+        run are loaded into self.completed
+
+        :param query_time: (datetime) the requested query time of the run, or
+            None for "now"
+        :param fingerprint: (str) the fingerprint of the run's settings
+        :returns: (datetime) the query time to use. When resuming, this is the
+            query time of the original run, so that both halves of the report
+            are evaluated at the same point in time
+        """
+        header = self.__read() if self.resume else None
+        if header is not None:
+            start_time = datetime.fromtimestamp(header['time'], timezone.utc)
+            if header['fingerprint'] != fingerprint:
+                self.logger.warning("Not resuming from {}: the journal was written with different "
+                                    "settings".format(self.path))
+            elif query_time is not None and query_time.timestamp() != header['time']:
+                self.logger.warning("Not resuming from {}: the journal was written for {}, not "
+                                    "{}".format(self.path, start_time, query_time))
+            else:
+                self.logger.info("Resuming the run started at {} from {} ({} results)".format(
+                    start_time, self.path, len(self.completed)))
+                self.__file = open(self.path, 'a')
+                # Terminate a line that was cut off when the earlier run was killed
+                self.__file.write("\n")
+                return start_time
+
+        self.completed = {}
+        query_time = query_time or datetime.now(timezone.utc)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.__file = open(self.path, 'w')
+        self.__file.write(json.dumps({'time': query_time.timestamp(),
+                                      'fingerprint': fingerprint}) + "\n")
+        self.flush()
+        return query_time
+
+    def __read(self) -> Union[dict, None]:
+        """
+        Load an existing journal into self.completed
+
+        :returns: (dict or None) the header of the journal, or None if there's no
+            (readable) journal
+        """
+        try:
+            with open(self.path, 'r') as infile:
+                header = json.loads(infile.readline())
+                for line in infile:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line may be incomplete if an earlier run was killed mid-write
+                        continue
+                    self.completed[(entry['e'], entry['r'])] = entry['v']
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError):
+            self.logger.warning("Ignoring unreadable journal {}".format(self.path))
+            return None
+        return header
+
+    def get(self, external_id: str, rule_name: str) -> Tuple[bool, Union[float, None]]:
+        """
+        Look up a result recorded by the run being resumed. SLIs that couldn't be
+        computed (e.g. because Telemeter was overloaded) aren't known, so that
+        resuming retries them
+
+        :param external_id: (str) the external_id of the cluster
+        :param rule_name: (str) the name of the rule
+        :returns: (tuple) whether the result is known, and the SLI
+        """
+        sli = self.completed.get((external_id, rule_name))
+        return sli is not None, sli
+
+    def record(self, external_id: str, rule_name: str, sli: Union[float, None]):
+        """
+        Record a result. Results are buffered and written out at most every
+        flush_interval seconds
+
+        :param external_id: (str) the external_id of the cluster
+        :param rule_name: (str) the name of the rule
+        :param sli: (float or None) the SLI, or None if it couldn't be computed
+        """
+        key = (external_id, rule_name)
+        line = json.dumps({'e': external_id, 'r': rule_name, 'v': sli}) + "\n"
+        with self.__lock:
+            if self.__file is None or (key in self.completed and self.completed[key] == sli):
+                return
+            self.completed[key] = sli
+            self.__file.write(line)
+            if time.monotonic() - self.__last_flush > self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        """
+        Write buffered results to disk
+        """
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.flush()
+                os.fsync(self.__file.fileno())
+            self.__last_flush = time.monotonic()
+
+    def close(self):
+        """
+        Flush and close the journal. It stays on disk, so the run can be resumed
+        """
+        with self.__lock:
+            if self.__file is not None:
+                self.flush()
+                self.__file.close()
+                self.__file = None
+
+    def remove(self):
+        """
+        Close and delete the journal, e.g. once the report has been written
+        """
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+import bisect
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+import requests
+from tabulate import tabulate
+
+
+class Metrics(object):
+    """
+    Minimal, thread-safe registry of counters, gauges and histograms describing
+    a report run. Can be rendered in the Prometheus text exposition format,
+    written to a node_exporter textfile or pushed to a Pushgateway
+    """
+    logger = logging.getLogger("Metrics")
+
+    prefix = "telemeter_reporter_"
+
+    latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    size_buckets = (1, 4, 16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+    # Pushes are given up on after this many seconds, so an unreachable Pushgateway can't hold up
+    # the end of a run
+    default_push_timeout = 30
+
+    # Every metric that can be recorded: name -> (type, help, histogram buckets)
+    definitions = {
+        "query_duration_seconds": (
+            "histogram", "Duration of Telemeter requests (every attempt, retry or hedge of a "
+            "query), by rule", latency_buckets),
+        "query_queue_seconds": (
+            "histogram", "Time Telemeter requests spent waiting for the concurrency limit, by rule",
+            latency_buckets),
+        "query_backoff_seconds_total": (
+            "counter", "Time spent backing off before retrying Telemeter queries, by rule", None),
+        "query_response_series": (
+            "histogram", "Number of series returned by Telemeter queries, by rule", size_buckets),
+        "query_response_bytes": (
+            "histogram", "Size of the bodies of Telemeter responses", size_buckets),
+        "query_failures_total": (
+            "counter", "Telemeter queries that didn't produce an SLI, by rule and reason", None),
+        "query_retries_total": ("counter", "Telemeter queries that were retried", None),
+        "query_hedges_total": ("counter", "Telemeter queries that were hedged", None),
+        "query_concurrency_limit": (
+            "gauge", "Adaptive limit on concurrent Telemeter queries at the end of the run", None),
+        "cache_requests_total": ("counter", "Query cache lookups, by result", None),
+        "partial_sum_days_total": (
+            "counter", "Days of additive rules looked up in the partial sum store, by result",
+            None),
+        "uhc_request_duration_seconds": (
+            "histogram", "Time spent waiting for the UHC API, by endpoint", latency_buckets),
+        "phase_seconds_total": (
+            "counter", "Time spent generating reports, by phase (streamed rows are formatted while "
+            "querying, so phases can overlap)", None),
+        "clusters": ("gauge", "Number of clusters in the report", None),
+        "last_run_timestamp_seconds": (
+            "gauge", "Time at which the last report run finished", None),
+    }
+
+    def __init__(self):
+        """
+        Instantiate an empty Metrics object
+        """
+        self.__lock = threading.Lock()
+        # name -> {sorted label tuple: value}. Histogram values are [bucket counts, sum, max]
+        self.__values = {name: {} for name in self.definitions}
+
+    @staticmethod
+    def __key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """
+        Increase a counter
+
+        :param name: (str) the name of the counter (without prefix)
+        :param amount: (float) how much to add
+        :param labels: the labels of the series
+        """
+        key = self.__key(labels)
+        with self.__lock:
+            series = self.__values[name]
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        """
+        Set a gauge
+
+        :param name: (str) the name of the gauge (without prefix)
+        :param value: (float) the new value
+        :param labels: the labels of the series
+        """
+        key = self.__key(labels)
+        with self.__lock:
+            self.__values[name][key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Record an observation in a histogram
+
+        :param name: (str) the name of the histogram (without prefix)
+        :param value: (float) the observed value
+        :param labels: the labels of the series
+        """
+        buckets = self.definitions[name][2]
+        key = self.__key(labels)
+        index = bisect.bisect_left(buckets, value)
+        with self.__lock:
+            series = self.__values[name]
+            if key not in series:
+                series[key] = [[0] * (len(buckets) + 1), 0.0, 0.0]
+            histogram = series[key]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] = max(histogram[2], value)
+
+    @contextmanager
+    def time(self, name: str, **labels) -> Iterator[None]:
+        """
+        Observe how long a block of code takes (even if it raises)
+
+        :param name: (str) the name of a histogram, or of a counter to add to
+        :param labels: the labels of the series
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.definitions[name][0] == "histogram":
+                self.observe(name, elapsed, **labels)
+            else:
+                self.inc(name, elapsed, **labels)
+
+    def render(self) -> str:
+        """
+        Render every recorded metric in the Prometheus text exposition format
+
+        :returns: (str) the metrics, ready to be scraped or pushed
+        """
+        lines = []
+        with self.__lock:
+            for name, (kind, description, buckets) in self.definitions.items():
+                series = self.__values[name]
+                if not series:
+                    continue
+                full_name = self.prefix + name
+                lines.append("# HELP {} {}".format(full_name, description))
+                lines.append("# TYPE {} {}".format(full_name, kind))
+                for key, value in sorted(series.items()):
+                    if kind != "histogram":
+                        lines.append("{}{} {}".format(full_name, self.__labels(key), value))
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + [math.inf], value[0]):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(float(bound))
+                        lines.append("{}_bucket{} {}".format(
+                            full_name, self.__labels(key + (("le", le),)), cumulative))
+                    lines.append("{}_sum{} {}".format(full_name, self.__labels(key), value[1]))
+                    lines.append("{}_count{} {}".format(full_name, self.__labels(key), cumulative))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def __labels(key: Tuple[Tuple[str, str], ...]) -> str:
+        if not key:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')
+                                              .replace("\n", "\\n")) for k, v in key) + "}"
+
+    def write_textfile(self, path: str):
+        """
+        Write the metrics to a file for node_exporter's textfile collector. The
+        file is replaced atomically, so the collector never sees a partial file
+
+        :param path: (str) the path of the file (should end in ".prom")
+        """
+        path = os.path.abspath(os.path.expanduser(path))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".metrics")
+        try:
+            with os.fdopen(fd, 'w') as outfile:
+                outfile.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def push(self, url: str, job: str = "telemeter-reporter", session: requests.Session = None,
+             timeout: float = None):
+        """
+        Push the metrics to a Prometheus Pushgateway, replacing any metrics
+        previously pushed for the same job
+
+        :param url: (str) the base URL of the Pushgateway
+        :param job: (str) the job label to push the metrics under
+        :param session: (requests.Session) a (possibly shared) HTTP session to send
+            the request through. A new one is created if not provided
+        :param timeout: (float) the number of seconds to wait for the Pushgateway.
+            Default: 30
+        """
+        session = session or requests.Session()
+        response = session.put("{}/metrics/job/{}".format(url.rstrip("/"), job),
+                               data=self.render().encode(),
+                               headers={"Content-Type": "text/plain; version=0.0.4"},
+                               timeout=timeout or self.default_push_timeout)
+        if response.status_code not in (200, 202):
+            raise Exception("HTTP Status Code {} ({})".format(response.status_code,
+                                                              response.content))
+
+    def __histogram_quantile(self, name: str, key: tuple, q: float) -> float:
+        """
+        Estimate a quantile of a histogram like PromQL's histogram_quantile()
+        """
+        buckets = self.definitions[name][2]
+        counts, _, maximum = self.__values[name][key]
+        rank = q * sum(counts)
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = buckets[i - 1] if i > 0 else 0
+                upper = buckets[i] if i < len(buckets) else maximum
+                return min(maximum, lower + (upper - lower) * (rank - cumulative) / count)
+            cumulative += count
+        return maximum
+
+    def profile(self) -> str:
+        """
+        Summarize where the time of the run went, e.g. to find the rules that
+        dominate its runtime
+
+        :returns: (str) human-readable tables
+        """
+        with self.__lock:
+            failures = {}
+            for key, value in self.__values["query_failures_total"].items():
+                rule = dict(key).get("rule")
+                failures[rule] = failures.get(rule, 0) + value
+            queued = {dict(key).get("rule"): value[1] for key, value in
+                      self.__values["query_queue_seconds"].items()}
+            backoff = {dict(key).get("rule"): value for key, value in
+                       self.__values["query_backoff_seconds_total"].items()}
+
+            rows = []
+            for key, (counts, total, maximum) in self.__values["query_duration_seconds"].items():
+                count = sum(counts)
+                rule = dict(key).get("rule")
+                rows.append([rule, count, failures.get(rule, 0), total,
+                             total / count if count else 0,
+                             self.__histogram_quantile("query_duration_seconds", key, 0.95),
+                             maximum, queued.get(rule, 0.0), backoff.get(rule, 0.0)])
+            rows.sort(key=lambda row: row[3], reverse=True)
+            queries = tabulate(rows, ["Rule", "Requests", "Failures", "Total (s)", "Mean (s)",
+                                      "p95 (s)", "Max (s)", "Queued (s)", "Backoff (s)"],
+                               floatfmt=".3f")
+
+            other = [["Phase: {}".format(dict(k)["phase"]), "{:.3f}s".format(v)] for k, v in
+                     self.__values["phase_seconds_total"].items()]
+            for key, (counts, total, _) in self.__values["uhc_request_duration_seconds"].items():
+                other.append(["UHC: {}".format(dict(key)["endpoint"]),
+                              "{:.3f}s in {} requests".format(total, sum(counts))])
+            for name, label in (("query_retries_total", "Retried queries"),
+                                ("query_hedges_total", "Hedged queries")):
+                for value in self.__values[name].values():
+                    other.append([label, int(value)])
+            for key, value in self.__values["cache_requests_total"].items():
+                other.append(["Cache {}".format(dict(key)["result"]), int(value)])
+            for key, value in self.__values["partial_sum_days_total"].items():
+                other.append(["Partial sum days {}".format(dict(key)["result"]), int(value)])
+        other = tabulate(other, tablefmt="plain")
+        return queries + "\n\n" + other if rows else other
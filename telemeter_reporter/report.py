@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+from array import array
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Union
+
+
+class SLIReport(Mapping):
+    """
+    Compact, array-backed table of SLI values, with clusters as rows and rules
+    as columns. Missing values (e.g. failed queries) are stored as NaN. Rows are
+    identified by the external_id of their cluster, since cluster names aren't
+    unique (see key())
+
+    For backward compatibility, an SLIReport also behaves like the nested
+    dictionary that generate_report() used to return, i.e.
+    report[key][rule_name] == {'goal': ..., 'sli': ...}
+    """
+    # Compliance classes, as returned by status()
+    UNKNOWN = 0
+    DANGER = 1
+    CAUTION = 2
+    SUCCESS = 3
+
+    def __init__(self, rules: Sequence[str], goals: Sequence[float],
+                 on_complete: Callable[["SLIReport", int], None] = None,
+                 on_set: Callable[["SLIReport", int, str, Union[float, None]], None] = None):
+        """
+        Instantiate an empty SLIReport object
+
+        :param rules: (list) the names of the rules (columns) of the report
+        :param goals: (list) the goal of each rule, as a percentage
+        :param on_complete: (callable) called with (report, row number) as soon as
+            every SLI of a cluster has been set (even if some were set to None).
+            May be called from several threads at once
+        :param on_set: (callable) called with (report, row number, rule name, SLI)
+            whenever an SLI is set. May be called from several threads at once
+        """
+        self.rules = list(rules)
+        self.goals = array('d', goals)
+        self.clusters = []
+        self.external_ids = []
+        self.sli = array('d')
+        self.on_complete = on_complete
+        self.on_set = on_set
+        # The point in time the report was evaluated at, if known
+        self.time = None
+        # Identifies the settings the report was generated with, if known
+        self.fingerprint = None
+        # The (0-based index, count) of the shard of a sharded run that the report covers, if any
+        self.shard = None
+        self.__rule_index = {rule: i for i, rule in enumerate(self.rules)}
+        self.__cluster_index = {}
+        # Which SLIs have been set, and how many are still unset in each row
+        self.__set = bytearray()
+        self.__pending = array('L')
+        self.__lock = threading.Lock()
+        # Derived data is computed on first use and thrown away whenever a value changes
+        self.__status = None
+        self.__rounded = None
+
+    @staticmethod
+    def key(name: str, external_id: str = None) -> str:
+        """
+        Identify the row of a cluster
+
+        :param name: (str) the name of the cluster
+        :param external_id: (str) the external_id of the cluster, if known
+        :returns: (str) the external_id, or the name if the external_id isn't
+            known (e.g. in a report built by from_dict())
+        """
+        return external_id or name
+
+    @classmethod
+    def from_dict(cls, raw_report: Dict[str, Dict[str, Dict[str, float]]]) -> "SLIReport":
+        """
+        Build an SLIReport from a legacy nested-dictionary report
+
+        :param raw_report: (dict) a report in the format of to_dict()
+        :returns: (SLIReport) the equivalent SLIReport
+        """
+        if isinstance(raw_report, SLIReport):
+            return raw_report
+        first = next(iter(raw_report.values()), {})
+        report = cls(list(first.keys()), [scores['goal'] for scores in first.values()])
+        for cluster_name, rules in raw_report.items():
+            report.add_cluster(cluster_name)
+            for rule_name, scores in rules.items():
+                report.set(cluster_name, rule_name, scores['sli'])
+        return report
+
+    def to_dict(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Convert this report into a legacy nested-dictionary report. Clusters whose
+        name is already taken by an earlier row are listed as "name (external_id)"
+
+        :returns: (dict) {cluster name: {rule name: {'goal': float, 'sli': float or None}}}
+        """
+        raw_report = {}
+        for name, external_id in zip(self.clusters, self.external_ids):
+            label = name if name not in raw_report else "{} ({})".format(name, external_id)
+            raw_report[label] = self[self.key(name, external_id)]
+        return raw_report
+
+    def to_json(self) -> dict:
+        """
+        Convert this report into a JSON-serializable dictionary, e.g. to store a
+        partial report that will be merged with others
+
+        :returns: (dict) the rules, goals, clusters and SLIs of the report, and
+            what's known about the run that generated it
+        """
+        return {'time': self.time.timestamp() if self.time else None,
+                'fingerprint': self.fingerprint,
+                'shard': self.shard[0] if self.shard else None,
+                'shards': self.shard[1] if self.shard else None,
+                'rules': self.rules, 'goals': list(self.goals),
+                'clusters': self.clusters, 'external_ids': self.external_ids,
+                'sli': [None if math.isnan(v) else v for v in self.sli]}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "SLIReport":
+        """
+        Build an SLIReport from the output of to_json()
+
+        :param data: (dict) a report in the format of to_json()
+        :returns: (SLIReport) the equivalent SLIReport
+        """
+        report = cls(data['rules'], data['goals'])
+        if data.get('time') is not None:
+            report.time = datetime.fromtimestamp(data['time'], timezone.utc)
+        report.fingerprint = data.get('fingerprint')
+        if data.get('shards') is not None:
+            report.shard = (data['shard'], data['shards'])
+        width = len(report.rules)
+        for index, (name, external_id) in enumerate(zip(data['clusters'], data['external_ids'])):
+            report.add_cluster(name, external_id)
+            for rule_name, sli in zip(report.rules, data['sli'][index * width:(index + 1) * width]):
+                report.set(cls.key(name, external_id), rule_name, sli)
+        return report
+
+    @classmethod
+    def merge(cls, reports: Iterable["SLIReport"]) -> "SLIReport":
+        """
+        Combine reports on different clusters (e.g. the shards of a report) into
+        one. The reports must have the same rules and goals
+
+        :param reports: (iterable) the SLIReports to combine
+        :returns: (SLIReport) a report with the clusters of every report, in order,
+            and the latest time of any of them
+        """
+        merged = None
+        for report in reports:
+            if merged is None:
+                merged = cls(report.rules, report.goals)
+                merged.time = report.time
+            elif report.rules != merged.rules or report.goals != merged.goals:
+                raise Exception("Can't merge reports with different rules or goals")
+            # Shards started without a fixed time are evaluated at slightly different times
+            if report.time and (merged.time is None or report.time > merged.time):
+                merged.time = report.time
+            for index, name in enumerate(report.clusters):
+                merged.add_cluster(name, report.external_ids[index])
+                for rule_name, sli in zip(report.rules, report.row(index)):
+                    merged.set(cls.key(name, report.external_ids[index]), rule_name, sli)
+        if merged is None:
+            raise Exception("No reports to merge")
+        return merged
+
+    @classmethod
+    def merge_shards(cls, reports: Sequence["SLIReport"]) -> "SLIReport":
+        """
+        Combine the shards of a sharded run into one report (see merge()), making
+        sure that together they cover every cluster
+
+        :param reports: (list) one SLIReport for each shard
+        :returns: (SLIReport) the combined report
+        :raises: (Exception) unless there's exactly one report for each of the
+            shards 0 to N-1 of a run, all evaluated at the same time with the same
+            settings
+        """
+        if not reports:
+            raise Exception("No reports to merge")
+        if any(report.shard is None for report in reports):
+            raise Exception("Only the shards of a sharded run can be merged, but some reports "
+                            "don't belong to a shard")
+        counts = sorted({report.shard[1] for report in reports})
+        if len(counts) > 1:
+            raise Exception("The reports are shards of runs split {} ways".format(
+                " and ".join(str(count) for count in counts)))
+        indexes = [report.shard[0] for report in reports]
+        missing = [i for i in range(counts[0]) if i not in indexes]
+        repeated = sorted({i for i in indexes if indexes.count(i) > 1})
+        if missing or repeated:
+            raise Exception("Expected each of the shards 0 to {} once, but got {}{}".format(
+                counts[0] - 1, "no shard {}".format(missing) if missing else "",
+                "{}shard {} more than once".format(" and " if missing else "", repeated)
+                if repeated else ""))
+        if len({report.time for report in reports}) > 1:
+            raise Exception("The shards were evaluated at different times")
+        if len({report.fingerprint for report in reports}) > 1:
+            raise Exception("The shards were generated with different rules or settings")
+        merged = cls.merge(reports)
+        merged.fingerprint = reports[0].fingerprint
+        return merged
+
+    def add_cluster(self, name: str, external_id: str = None) -> int:
+        """
+        Add an (empty) row to the report. Adding a cluster that already exists
+        (i.e. with the same key()) has no effect, but clusters that only share
+        their name get a row each
+
+        :param name: (str) the name of the cluster, as shown in the report
+        :param external_id: (str) the external_id of the cluster, if known
+        :returns: (int) the row number of the cluster
+        """
+        key = self.key(name, external_id)
+        with self.__lock:
+            if key in self.__cluster_index:
+                return self.__cluster_index[key]
+            index = self.__cluster_index[key] = len(self.clusters)
+            self.clusters.append(name)
+            self.external_ids.append(external_id)
+            self.sli.extend([math.nan] * len(self.rules))
+            self.__set.extend(bytes(len(self.rules)))
+            self.__pending.append(len(self.rules))
+            self.__status = self.__rounded = None
+        return index
+
+    def set(self, cluster: str, rule_name: str, sli: Union[float, None]):
+        """
+        Set an SLI value
+
+        :param cluster: (str) the key() of the cluster, i.e. its external_id
+        :param rule_name: (str) the name of the rule
+        :param sli: (float or None) the SLI (as a percentage), or None if unknown
+        """
+        offset = self.__offset(cluster, rule_name)
+        complete = False
+        with self.__lock:
+            self.sli[offset] = math.nan if sli is None else sli
+            self.__status = self.__rounded = None
+            if not self.__set[offset]:
+                self.__set[offset] = 1
+                index = offset // len(self.rules)
+                self.__pending[index] -= 1
+                complete = self.__pending[index] == 0
+        if self.on_set:
+            self.on_set(self, offset // len(self.rules), rule_name, sli)
+        if complete and self.on_complete:
+            self.on_complete(self, index)
+
+    def get_sli(self, cluster: str, rule_name: str) -> Union[float, None]:
+        """
+        Get an SLI value
+
+        :param cluster: (str) the key() of the cluster, i.e. its external_id
+        :param rule_name: (str) the name of the rule
+        :returns: (float or None) the SLI (as a percentage), or None if unknown
+        """
+        value = self.sli[self.__offset(cluster, rule_name)]
+        return None if math.isnan(value) else value
+
+    def __offset(self, cluster: str, rule_name: str) -> int:
+        """
+        Find the position of a value in the flat SLI array
+
+        :param cluster: (str) the key() of the cluster
+        :param rule_name: (str) the name of the rule
+        :returns: (int) the index into self.sli
+        """
+        return self.__cluster_index[cluster] * len(self.rules) + self.__rule_index[rule_name]
+
+    def row(self, index: int) -> List[Union[float, None]]:
+        """
+        Get every SLI of a cluster
+
+        :param index: (int) the row number of the cluster
+        :returns: (list) the SLIs of the cluster, in rule order (None if unknown)
+        """
+        width = len(self.rules)
+        return [None if math.isnan(v) else v for v in self.sli[index * width:(index + 1) * width]]
+
+    def column(self, rule_name: str) -> List[float]:
+        """
+        Get every known SLI of a rule
+
+        :param rule_name: (str) the name of the rule
+        :returns: (list) the SLIs of the rule, skipping unknown values
+        """
+        values = self.sli[self.__rule_index[rule_name]::len(self.rules)] if self.rules else []
+        return [v for v in values if not math.isnan(v)]
+
+    def status(self, caution_threshold: float) -> array:
+        """
+        Classify every SLI against the goal of its rule. The result is computed
+        once and reused until the report changes
+
+        :param caution_threshold: (float) SLIs that beat their goal by less than
+            this (in percentage points) are classified as CAUTION
+        :returns: (array) one of UNKNOWN, DANGER, CAUTION or SUCCESS for each SLI,
+            in the same (row-major) order as self.sli
+        """
+        if self.__status is None or self.__status[0] != caution_threshold:
+            status = array('b', (self.__classify(i, caution_threshold)
+                                 for i in range(len(self.sli))))
+            self.__status = (caution_threshold, status)
+        return self.__status[1]
+
+    def row_status(self, index: int, caution_threshold: float) -> List[int]:
+        """
+        Classify the SLIs of a single cluster (see status()). Unlike status(),
+        nothing is cached, so this is cheap while the report is still changing
+
+        :param index: (int) the row number of the cluster
+        :param caution_threshold: (float) see status()
+        :returns: (list) the compliance class of each SLI of the cluster
+        """
+        width = len(self.rules)
+        return [self.__classify(i, caution_threshold)
+                for i in range(index * width, (index + 1) * width)]
+
+    def __classify(self, offset: int, caution_threshold: float) -> int:
+        """
+        Classify a single SLI against the goal of its rule
+
+        :param offset: (int) the index of the SLI in self.sli
+        :param caution_threshold: (float) see status()
+        :returns: (int) one of UNKNOWN, DANGER, CAUTION or SUCCESS
+        """
+        value = self.sli[offset]
+        if math.isnan(value):
+            return self.UNKNOWN
+        margin = value - self.goals[offset % len(self.rules)]
+        if margin < 0:
+            return self.DANGER
+        elif margin < caution_threshold:
+            return self.CAUTION
+        return self.SUCCESS
+
+    def rounded(self) -> List[str]:
+        """
+        Round every SLI for display. The result is computed once and reused until
+        the report changes
+
+        :returns: (list) a short string for each SLI, in the same (row-major)
+            order as self.sli. Unknown values are shown as zero
+        """
+        if self.__rounded is None:
+            self.__rounded = [self.__round(v) for v in self.sli]
+        return self.__rounded
+
+    def row_rounded(self, index: int) -> List[str]:
+        """
+        Round the SLIs of a single cluster for display (see rounded()), without
+        caching anything
+
+        :param index: (int) the row number of the cluster
+        :returns: (list) a short string for each SLI of the cluster
+        """
+        width = len(self.rules)
+        return [self.__round(v) for v in self.sli[index * width:(index + 1) * width]]
+
+    @staticmethod
+    def __round(value: float) -> str:
+        """
+        Round an SLI for display
+
+        :param value: (float) the SLI, or NaN if unknown
+        :returns: (str) the SLI with (at most) 3 decimals and 6 characters
+        """
+        return '{:0.3f}'.format(0 if math.isnan(value) else value)[:6]
+
+    def summary(self, percentiles: Sequence[float] = (50, 90, 99)) -> Dict[str, Dict[str, float]]:
+        """
+        Compute fleet-wide aggregates for every rule
+
+        :param percentiles: (list) which percentiles of the SLIs to compute
+        :returns: (dict) for each rule name, a dict with the keys "clusters" (the
+            number of known SLIs), "missing", "min", "p<N>" for each percentile,
+            and "compliant" (the percentage of known SLIs that meet the goal)
+        """
+        summary = {}
+        for rule_index, rule_name in enumerate(self.rules):
+            values = sorted(self.column(rule_name))
+            goal = self.goals[rule_index]
+            stats = {"clusters": len(values), "missing": len(self.clusters) - len(values),
+                     "min": values[0] if values else None}
+            for p in percentiles:
+                stats["p{:g}".format(p)] = self.__percentile(values, p)
+            stats["compliant"] = (100.0 * sum(1 for v in values if v >= goal) / len(values)
+                                  if values else None)
+            summary[rule_name] = stats
+        return summary
+
+    @staticmethod
+    def __percentile(values: List[float], p: float) -> Union[float, None]:
+        """
+        Compute a percentile by linear interpolation between the closest ranks
+
+        :param values: (list) sorted values
+        :param p: (float) the percentile to compute, between 0 and 100
+        :returns: (float or None) the percentile, or None if there are no values
+        """
+        if not values:
+            return None
+        rank = (len(values) - 1) * p / 100.0
+        low = math.floor(rank)
+        high = min(low + 1, len(values) - 1)
+        return values[low] + (values[high] - values[low]) * (rank - low)
+
+    def __getitem__(self, cluster: str) -> Dict[str, Dict[str, float]]:
+        index = self.__cluster_index[cluster]
+        return {rule_name: {'goal': self.goals[i], 'sli': sli} for i, (rule_name, sli) in
+                enumerate(zip(self.rules, self.row(index)))}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__cluster_index)
+
+    def __len__(self) -> int:
+        return len(self.clusters)
@@ -1,18 +1,48 @@
 # -*- coding: utf-8 -*-
 import csv
+import functools
+import hashlib
 import io
+import json
 import logging
+import math
 import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from string import Template
-from typing import Dict, List, Union
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, TextIO, Union
 
 import certifi
-import prometheus_api_client
 import requests
 from tabulate import tabulate
 
+from .adaptive import AdaptiveTelemeterClient
+from .additive import AdditiveSLI, Part
+from .cache import PartialStore, QueryCache
+from .history import SLIHistory
+from .inventory import ClusterIndex
+from .journal import ReportJournal
+from .metrics import Metrics
+from .report import SLIReport
+from .session import session_from_config
+from .telemeter import QueryError, TelemeterClient
 from .uhc import Cluster, UnifiedHybridClient
+from .writers import CSVReportWriter, HTMLReportWriter, ReportWriter
+
+
+class PlannedQuery(NamedTuple):
+    rule: str
+    query: str
+    # external_id -> cluster name (as shown in the report)
+    clusters: Dict[str, str]
+    batched: bool
+    # Evaluation time of the query, if it differs from the report's query time
+    time: datetime = None
+    # For partial queries of additive rules: the AdditiveSLI of each cluster (by external_id),
+    # and which part of it the query resolves
+    sums: Dict[str, AdditiveSLI] = None
+    part: Part = None
 
 
 class SLIReporter(object):
@@ -22,6 +52,27 @@ class SLIReporter(object):
     logger = logging.getLogger("SLIReporter")
 
     caution_threshold = 0.01
+    default_batch_selector_length = 4096
+    default_batch_size = 100
+    default_concurrency = 1
+
+    # Telemeter queries are given up on after this many seconds, and retried this many times
+    default_timeout = 300
+    default_retries = 3
+    default_backoff = 0.5
+
+    # Telemeter data is only treated as final (and therefore cacheable) once it's this old
+    cache_settle_time = timedelta(hours=1)
+
+    # Partial queries of additive rules are evaluated this many seconds before the end of their
+    # window. Range selectors (and subqueries) include the sample at both ends of their range, so
+    # a window ending on a step-aligned boundary (e.g. midnight) would share its last sample with
+    # the first sample of the next window, and adjacent windows would count it twice
+    partial_eval_offset = 1
+
+    # Formats that can be written row by row (see report_writer())
+    streamable_formats = ['csv', 'html']
+
     default_css = """<style>
             .danger {color: red; font-weight: bold;}
             .caution {color: darkorange; font-weight: bold;}
@@ -45,36 +96,64 @@ class SLIReporter(object):
             </body>
         </html>"""
 
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, connect: bool = True):
         """
         Instantiate a SLIReporter object
 
         :param config: (dict) the "settings" for this class, including URLs
             and rules. Usually originates from a YAML file.
+        :param connect: (bool) if False, don't connect to Telemeter or UHC (or
+            open the query cache). Such an SLIReporter can only format reports,
+            e.g. ones loaded with SLIReport.from_json()
         """
         self.config = config
 
-        # Connect to Telemeter-LTS
-        if not self.__check_ssl_certs(self.config["api"]["telemeter"]["url"]):
-            self.logger.error(
-                "Couldn't securely connect to {}.".format(self.config["api"]["telemeter"]["url"]))
-            raise Exception("Can't connect to Telemeter-LTS")
-        self.pc = prometheus_api_client.prometheus_connect.PrometheusConnect(
-            url=self.config["api"]["telemeter"]["url"],
-            headers={"Authorization": "bearer " + self.config["api"]["telemeter"]["token"]},
-            disable_ssl=False, )
-        self.logger.info("Connected to Telemeter-LTS")
+        # Maximum number of Telemeter queries in flight at once
+        try:
+            self.concurrency = int(self.config["api"]["telemeter"]["concurrency"])
+        except KeyError:
+            self.concurrency = self.default_concurrency
 
-        # Connect to UHC
+        # Batched queries are split up so their selectors stay under this many characters,
+        # keeping the request URL within the limits of Telemeter and any proxies in between
         try:
-            self.uhc = UnifiedHybridClient(config["api"]["uhc"]["url"],
-                                           config["api"]["uhc"]["token"],
-                                           config["api"]["uhc"]["public_key"])
-            self.logger.info("Connected to UHC API")
+            self.batch_selector_length = int(
+                self.config["api"]["telemeter"]["batch_selector_length"])
         except KeyError:
-            self.uhc = UnifiedHybridClient(config["api"]["uhc"]["url"],
-                                           config["api"]["uhc"]["token"])
-            self.logger.info("Connected to UHC API (unverified)")
+            self.batch_selector_length = self.default_batch_selector_length
+
+        # Batched queries are sent as soon as they cover this many clusters, rather than when the
+        # cluster list runs out, so they can run while later pages of clusters are downloading
+        try:
+            self.batch_size = max(int(self.config["api"]["telemeter"]["batch_size"]), 1)
+        except KeyError:
+            self.batch_size = self.default_batch_size
+
+        # Timings, sizes and failures of queries and report generation (see Metrics)
+        self.metrics = Metrics()
+
+        # Clients for Telemeter and UHC, and the query cache. These are left unset when only
+        # formatting (e.g. merging) pre-generated reports
+        self.session = None
+        self.pc = None
+        self.uhc = None
+        self.cache = None
+        self.partials = None
+        self.cluster_index = None
+        if connect:
+            self.__connect()
+
+        # The SLIs of earlier reports (see SLIHistory). Unlike the query cache, this is also used
+        # when only formatting reports, for their trend columns
+        self.history = None
+        try:
+            if self.config['cache'] is not None:
+                self.history = SLIHistory.from_config(self.config['cache'])
+        except KeyError:
+            pass
+        except (OSError, sqlite3.Error) as ex:
+            self.logger.warning("Unable to open SLI history, continuing without it: {}".format(
+                repr(ex)))
 
         # Setup CSS
         try:
@@ -88,22 +167,123 @@ class SLIReporter(object):
         except KeyError:
             self.html = self.default_html
 
-    def get_clusters(self, search_query: str, query_time: datetime = None) -> List[Cluster]:
+    def __connect(self):
+        """
+        Connect to Telemeter-LTS and UHC, and open the query cache
+        """
+        # Every HTTP request (Telemeter, UHC and SSO) goes through this one connection pool. A
+        # hedged query has two copies in flight, so hedging needs twice the connections
+        hedging = self.config["api"]["telemeter"].get("hedge_percentile")
+        self.session = session_from_config(self.config,
+                                           self.concurrency * (2 if hedging else 1))
+
+        # Connect to Telemeter-LTS
+        if not self.__check_ssl_certs(self.config["api"]["telemeter"]["url"], self.session):
+            self.logger.error(
+                "Couldn't securely connect to {}.".format(self.config["api"]["telemeter"]["url"]))
+            raise Exception("Can't connect to Telemeter-LTS")
+        # Queries are retried on transient errors, and their concurrency backs off while Telemeter
+        # is overloaded
+        telemeter_config = self.config["api"]["telemeter"]
+        client = TelemeterClient(url=telemeter_config["url"], token=telemeter_config["token"],
+                                 session=self.session,
+                                 timeout=telemeter_config.get("timeout", self.default_timeout),
+                                 metrics=self.metrics, )
+        self.pc = AdaptiveTelemeterClient(
+            client, self.concurrency, retries=telemeter_config.get("retries", self.default_retries),
+            backoff=telemeter_config.get("backoff", self.default_backoff),
+            adaptive=telemeter_config.get("adaptive", True),
+            hedge_percentile=telemeter_config.get("hedge_percentile"), metrics=self.metrics)
+        self.logger.info("Connected to Telemeter-LTS")
+
+        # Connect to UHC
+        uhc_options = {"session": self.session, "metrics": self.metrics,
+                       "page_size": self.config["api"]["uhc"].get("page_size"),
+                       "prefetch": self.config["api"]["uhc"].get("prefetch"), }
+        try:
+            self.uhc = UnifiedHybridClient(self.config["api"]["uhc"]["url"],
+                                           self.config["api"]["uhc"]["token"],
+                                           self.config["api"]["uhc"]["public_key"],
+                                           **uhc_options)
+            self.logger.info("Connected to UHC API")
+        except KeyError:
+            self.uhc = UnifiedHybridClient(self.config["api"]["uhc"]["url"],
+                                           self.config["api"]["uhc"]["token"],
+                                           **uhc_options)
+            self.logger.info("Connected to UHC API (unverified)")
+
+        # Setup the query cache, partial sum store and cluster index
+        try:
+            if self.config['cache'] is not None:
+                self.cache = QueryCache.from_config(self.config['cache'])
+                self.partials = PartialStore.from_config(self.config['cache'])
+                # The index can be up to full_sync_interval hours behind on deleted and renamed
+                # clusters, so it has to be asked for
+                if self.config["api"]["uhc"].get("cluster_index"):
+                    self.cluster_index = ClusterIndex.from_config(
+                        self.config['cache'], self.config["api"]["uhc"].get("full_sync_interval"))
+        except KeyError:
+            pass
+        except (OSError, sqlite3.Error) as ex:
+            self.logger.warning("Unable to open query cache, continuing without it: {}".format(
+                repr(ex)))
+
+    def get_clusters(self, search_query: str, query_time: datetime = None) -> Iterator[Cluster]:
         """
         Gets the all clusters matching a search query from the UHC CLI that have
-        external_ids
+        external_ids. Clusters are yielded as soon as their page of search results
+        arrives, so they can be reported on while later pages are still downloading.
+        If the cluster index is enabled, only clusters created since the previous
+        run are requested from UHC (see ClusterIndex)
 
         :param search_query: (str) a UHC search string (see UHC API docs)
         :param query_time: (datetime) if provided, only returns clusters that were created before
             this point in time
-        :returns: (list) a list of uhc.Cluster objects matching the query
+        :returns: (generator) the uhc.Cluster objects matching the query
         """
+        if self.cluster_index:
+            return self.cluster_index.search(self.uhc, search_query, query_time)
         cluster_list = self.uhc.search_clusters(search_query)
         if query_time:
-            return list(
-                x for x in cluster_list if x.external_id and x.creation_timestamp < query_time)
+            return (x for x in cluster_list if x.external_id and x.creation_timestamp < query_time)
         else:
-            return list(x for x in cluster_list if x.external_id)
+            return (x for x in cluster_list if x.external_id)
+
+    def search_clusters(self, search_queries: Iterable[str],
+                        query_time: datetime = None) -> Iterator[Cluster]:
+        """
+        Gets the clusters matching any of several search queries (see
+        get_clusters()). Clusters matching more than one query are only returned
+        once
+
+        :param search_queries: (iterable) UHC search strings
+        :param query_time: (datetime) see get_clusters()
+        :returns: (generator) the uhc.Cluster objects matching the queries
+        """
+        seen = set()
+        for search_query in search_queries:
+            for cluster in self.get_clusters(search_query, query_time):
+                if cluster.external_id not in seen:
+                    seen.add(cluster.external_id)
+                    yield cluster
+
+    @staticmethod
+    def shard_clusters(clusters: Iterable[Cluster], index: int, count: int) -> Iterator[Cluster]:
+        """
+        Select the clusters that belong to one of several shards of a report. Each
+        cluster is assigned to a shard by a hash of its external_id, so the shards
+        of a run don't need to coordinate, and together they cover every cluster
+        exactly once
+
+        :param clusters: (iterable) the Clusters to choose from
+        :param index: (int) the (0-based) number of the shard
+        :param count: (int) the total number of shards
+        :returns: (generator) the Clusters belonging to the shard
+        """
+        if not 0 <= index < count:
+            raise Exception("Invalid shard {}/{}".format(index, count))
+        return (x for x in clusters if int(hashlib.sha256(x.external_id.encode()).hexdigest(),
+                                           16) % count == index)
 
     @staticmethod
     def __adjust_duration(duration: int, query_time: datetime, creation_timestamp: datetime) -> int:
@@ -127,22 +307,407 @@ class SLIReporter(object):
             # New duration = floor(# of days between effective_now and cluster creation)
             return (effective_now - creation_timestamp).days
 
-    def generate_report(self, clusters: List[Cluster], query_time: datetime = None,
-                        adjust_duration: bool = True) -> Dict[str, Dict[str, Dict[str, float]]]:
+    def generate_report(self, clusters: Iterable[Cluster], query_time: datetime = None,
+                        adjust_duration: bool = True, batch: bool = False,
+                        concurrency: int = None,
+                        incremental: bool = False,
+                        on_cluster: Callable[[SLIReport, int], None] = None,
+                        journal: ReportJournal = None) -> SLIReport:
         """
         Generate a raw SLA report by running each configured query
         against the provided list of cluster IDs
 
-        :param clusters: (list) a list of Clusters to report on
+        :param clusters: (iterable) the Clusters to report on. May be a generator, such as
+            the one returned by get_clusters(), in which case queries start running as
+            soon as the first clusters arrive
         :param query_time: (datetime) if provided, tells Telemeter to query as if
             it was sometime in the past. Must be a timezone-aware datetime
         :param adjust_duration: (bool) if True, adjust the duration parameter on
             queries for clusters that were created before the start time of the
             duration. E.g., if a cluster was created 3 days ago, but a 28-day
             report is requested, adjust the duration to 3 days
-        :returns: (dict) raw report data in a nested dictionary
+        :param batch: (bool) if True, rules marked with "batch: true" are resolved
+            for many clusters at once using an _id=~'...' selector instead of one
+            query per cluster. Clusters whose duration had to be adjusted are
+            batched with the other clusters that ended up with the same duration.
+            Rules without the marker are still queried one cluster at a time
+        :param concurrency: (int) the maximum number of queries to run against
+            Telemeter at once. Defaults to api.telemeter.concurrency from the
+            config file, or 1 (i.e. run queries one after the other)
+        :param incremental: (bool) if True, rules with an "additive" section are
+            computed from daily partial sums, only querying Telemeter for days
+            that aren't in the partial sum store yet. The report is moved back to
+            the most recent (settled) midnight UTC so that days line up between runs
+        :param on_cluster: (callable) called with (report, row number) as soon as
+            every rule of a cluster has been resolved, e.g. to write the row to a
+            ReportWriter. May be called from several threads at once
+        :param journal: (ReportJournal) if provided, every result is checkpointed
+            to this journal as it arrives, and results already recorded by an
+            interrupted run (if the journal is resuming) aren't queried again.
+            The run uses the query time of the journal
+        :returns: (SLIReport) the raw report data. Can also be used like the nested
+            dictionary returned by earlier versions (see SLIReport.to_dict())
+        """
+        if incremental:
+            query_time = self.__last_day_boundary(query_time)
+            self.logger.info("Incremental mode: reporting as of {}".format(query_time))
+            if not self.partials:
+                self.logger.warning("No partial sum store available (is the cache disabled?), "
+                                    "so every day will be queried from scratch")
+
+        fingerprint = self.__settings_fingerprint(adjust_duration, incremental)
+        # A journal pins a report on "now" to the time the run started, but it's still described
+        # as a report on today
+        requested_time = query_time
+        if journal:
+            query_time = journal.begin(query_time, fingerprint)
+
+        raw_report = self.__empty_report(on_cluster)
+        raw_report.fingerprint = fingerprint
+        # Reports on "now" are still pinned to a time, so that every cluster's split windows end
+        # at the same instant (and can be batched together), and so the report can be placed in
+        # the SLI history
+        raw_report.time = query_time or datetime.now(timezone.utc)
+        if journal:
+            raw_report.on_set = lambda report, index, rule_name, sli: journal.record(
+                report.external_ids[index], rule_name, sli)
+        planner = self.__plan_queries(clusters, raw_report, requested_time, raw_report.time,
+                                      adjust_duration, batch, incremental, journal)
+        # Each query writes to its own (pre-created) cells of the report, so results can be placed
+        # as they arrive
+        with self.metrics.time("phase_seconds_total", phase="query"):
+            self.__run_queries(planner, lambda planned: self.__resolve_query(planned, raw_report,
+                                                                             query_time),
+                               concurrency)
+        self.__record_client_metrics()
+        if self.cache:
+            self.logger.info("Query cache: {} hits, {} misses".format(self.cache.hits,
+                                                                      self.cache.misses))
+        if incremental and self.partials:
+            self.logger.info("Partial sum store: {} days reused, {} days queried".format(
+                self.partials.hits, self.partials.misses))
+        self.logger.info("Telemeter: {} retries, {} hedged queries, concurrency limit {}".format(
+            self.pc.retried, self.pc.hedges, int(self.pc.limit.limit)))
+        if self.history:
+            self.history.record(raw_report, self.__rule_fingerprints(), raw_report.time)
+        return raw_report
+
+    def __empty_report(self, on_cluster: Callable[[SLIReport, int], None] = None) -> SLIReport:
+        """
+        Create an empty report with a column for each configured rule
+
+        :param on_cluster: (callable) see generate_report()
+        :returns: (SLIReport) a report without any clusters
+        """
+        return SLIReport([rule['name'] for rule in self.config["rules"]],
+                         [float(rule['goal']) * 100 for rule in self.config["rules"]],
+                         on_complete=on_cluster)
+
+    def __run_queries(self, planner: Iterable[PlannedQuery],
+                      resolve: Callable[[PlannedQuery], None], concurrency: int = None):
+        """
+        Resolve planned queries, either one after the other or using a pool of
+        worker threads
+
+        :param planner: (iterable) the PlannedQuery objects to resolve
+        :param resolve: (callable) the function resolving a single PlannedQuery
+        :param concurrency: (int) see generate_report()
+        """
+        concurrency = concurrency or self.concurrency
+        if concurrency > 1:
+            self.logger.info("Running up to {} queries concurrently".format(concurrency))
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+            futures = []
+            try:
+                for planned in planner:
+                    futures.append(executor.submit(resolve, planned))
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Don't wait for queries that haven't finished yet (e.g. when interrupted), so the
+                # caller can checkpoint what it has right away
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=False)
+                raise
+            executor.shutdown()
+        else:
+            for planned in planner:
+                resolve(planned)
+
+    def generate_backfill(self, clusters: Iterable[Cluster], start_time: datetime,
+                          end_time: datetime, step: timedelta, adjust_duration: bool = True,
+                          batch: bool = False,
+                          concurrency: int = None) -> Dict[datetime, SLIReport]:
+        """
+        Generate a series of raw SLA reports at regular intervals in the past.
+        Rather than running every query once per report, each rule is evaluated
+        over the whole time range at once with a range query. Clusters that are
+        too young for the full duration at some point in the series (see
+        adjust_duration) are reported on with instant queries at those points
+
+        :param clusters: (iterable) the Clusters to report on
+        :param start_time: (datetime) the time of the first report. Must be a
+            timezone-aware datetime
+        :param end_time: (datetime) the latest possible time of the last report.
+            Must be a timezone-aware datetime
+        :param step: (timedelta) the time between reports
+        :param adjust_duration: (bool) see generate_report()
+        :param batch: (bool) see generate_report()
+        :param concurrency: (int) see generate_report()
+        :returns: (dict) SLIReports (see generate_report()), keyed by report time
+        """
+        if step <= timedelta(0):
+            raise Exception("Invalid backfill step {}".format(step))
+        if start_time > end_time:
+            raise Exception("Invalid backfill range {} to {}".format(start_time, end_time))
+        clusters = list(clusters)
+        report_times = []
+        report_time = start_time
+        while report_time <= end_time:
+            report_times.append(report_time)
+            report_time += step
+        self.logger.info("Backfilling {} reports between {} and {}".format(len(report_times),
+                                                                           start_time, end_time))
+
+        # Evaluate every rule over the whole range for every cluster. Values at times when a
+        # cluster didn't exist yet (or was too young for the full duration) are ignored below
+        series = {}
+        planner = self.__plan_range_queries(clusters, batch)
+        with self.metrics.time("phase_seconds_total", phase="query"):
+            self.__run_queries(planner, lambda planned: self.__resolve_range_query(
+                planned, series, start_time, end_time, step), concurrency)
+        self.__record_client_metrics()
+
+        reports = {}
+        for report_time in report_times:
+            # Clusters that were created before the report time but are younger than one of the
+            # durations need instant queries with an adjusted duration, so leave them to
+            # generate_report()
+            present = [c for c in clusters if c.creation_timestamp < report_time]
+            young = [c for c in present if adjust_duration and any(
+                self.__adjust_duration(d, report_time, c.creation_timestamp) for d in
+                self.__durations())]
+            young_report = self.generate_report(young, query_time=report_time,
+                                                adjust_duration=adjust_duration, batch=batch,
+                                                concurrency=concurrency) if young else {}
+            # Young clusters are shown with the name generate_report() gave them (e.g. "name*")
+            young_names = dict(zip(young_report.external_ids, young_report.clusters)) \
+                if young else {}
+
+            raw_report = self.__empty_report()
+            raw_report.time = report_time
+            raw_report.fingerprint = self.__settings_fingerprint(adjust_duration, False)
+            timestamp = int(report_time.timestamp())
+            for cluster in present:
+                key = SLIReport.key(cluster.name, cluster.external_id)
+                if cluster.external_id in young_names:
+                    raw_report.add_cluster(young_names[cluster.external_id], cluster.external_id)
+                    for rule in self.config["rules"]:
+                        raw_report.set(key, rule['name'], young_report.get_sli(key, rule['name']))
+                    continue
+                raw_report.add_cluster(cluster.name, cluster.external_id)
+                for rule in self.config["rules"]:
+                    sli = series.get((cluster.external_id, rule['name']), {}).get(timestamp)
+                    if sli is None:
+                        self.logger.error("QueryFailure:'no result for cluster '{}' in range "
+                                          "response to '{}' at {}'".format(cluster.name,
+                                                                          rule['name'],
+                                                                          report_time))
+                    raw_report.set(key, rule['name'], sli)
+            reports[report_time] = raw_report
+            if self.history:
+                self.history.record(raw_report, self.__rule_fingerprints(), report_time)
+        return reports
+
+    def __record_client_metrics(self):
+        """
+        Copy the running totals kept by the Telemeter client, query cache and
+        partial sum store into self.metrics
+        """
+        self.metrics.set("query_retries_total", self.pc.retried)
+        self.metrics.set("query_hedges_total", self.pc.hedges)
+        self.metrics.set("query_concurrency_limit", int(self.pc.limit.limit))
+        if self.cache:
+            self.metrics.set("cache_requests_total", self.cache.hits, result="hit")
+            self.metrics.set("cache_requests_total", self.cache.misses, result="miss")
+        if self.partials:
+            self.metrics.set("partial_sum_days_total", self.partials.hits, result="reused")
+            self.metrics.set("partial_sum_days_total", self.partials.misses, result="queried")
+
+    @staticmethod
+    def __failure_reason(ex: Exception) -> str:
+        """
+        Classify a failed query for the query_failures_total metric
+
+        :param ex: (Exception) the error the query failed with
+        :returns: (str) e.g. "http_503", "timeout" or "connection"
+        """
+        if isinstance(ex, QueryError):
+            return "http_{}".format(ex.status_code)
+        if isinstance(ex, requests.exceptions.Timeout):
+            return "timeout"
+        if isinstance(ex, requests.exceptions.ConnectionError):
+            return "connection"
+        return "error"
+
+    def __durations(self) -> List[int]:
+        """
+        List every duration used by the configured rules
+
+        :returns: (list) the global duration and any rule-local durations, in days
+        """
+        durations = [int(rule['duration']) for rule in self.config["rules"] if 'duration' in rule]
+        if 'duration' in self.config.get('global_vars', {}):
+            durations.append(int(self.config['global_vars']['duration']))
+        return durations
+
+    def __settings_fingerprint(self, adjust_duration: bool, incremental: bool) -> str:
+        """
+        Fingerprint everything that affects the results of a run, so that results
+        computed with different settings (e.g. by an earlier run being resumed,
+        or another shard) are never mixed up
+
+        :param adjust_duration: (bool) see generate_report()
+        :param incremental: (bool) see generate_report()
+        :returns: (str) a fixed-length fingerprint
+        """
+        return ReportJournal.fingerprint(self.config["rules"], self.config.get("global_vars"),
+                                         adjust_duration, incremental)
+
+    def __rule_fingerprints(self) -> Dict[str, str]:
+        """
+        Fingerprint the definition of every rule (its query and variables), for
+        the SLI history
+
+        :returns: (dict) the fingerprint of each rule, by rule name
+        """
+        # None of these change how the SLI is computed
+        ignored = ('name', 'goal', 'description', 'batch', 'additive')
+        return {rule['name']: SLIHistory.fingerprint(rule['query'], {
+            k: v for k, v in self.__query_params(rule, "").items() if k not in ignored})
+                for rule in self.config["rules"]}
+
+    def __plan_range_queries(self, clusters: List[Cluster],
+                             batch: bool) -> Iterator[PlannedQuery]:
+        """
+        Build the queries needed to evaluate every rule over a range of time for
+        every cluster, using the full (unadjusted) durations
+
+        :param clusters: (list) the Clusters to report on
+        :param batch: (bool) see generate_report()
+        :returns: (generator) PlannedQuery objects
         """
-        raw_report = {}
+        for rule in self.config["rules"]:
+            if not (batch and rule.get('batch')):
+                for cluster in clusters:
+                    query_params = self.__query_params(rule, "_id='{}'".format(cluster.external_id))
+                    yield PlannedQuery(rule['name'],
+                                       Template(rule["query"]).substitute(**query_params),
+                                       {cluster.external_id: cluster.name}, False)
+                continue
+
+            query_params = self.__query_params(rule, None)
+            chunk = PlannedQuery(rule['name'], rule["query"], {}, True)
+            for cluster in clusters:
+                chunk.clusters[cluster.external_id] = cluster.name
+                if len(chunk.clusters) > 1 and len(
+                        self.__batch_selector(chunk.clusters)) > self.batch_selector_length:
+                    del chunk.clusters[cluster.external_id]
+                    yield self.__batch_query(chunk, query_params)
+                    chunk = chunk._replace(clusters={cluster.external_id: cluster.name})
+                if len(chunk.clusters) >= self.batch_size:
+                    yield self.__batch_query(chunk, query_params)
+                    chunk = chunk._replace(clusters={})
+            if chunk.clusters:
+                yield self.__batch_query(chunk, query_params)
+
+    def __resolve_range_query(self, planned: PlannedQuery, series: dict, start_time: datetime,
+                              end_time: datetime, step: timedelta):
+        """
+        Run a planned query against Telemeter as a range query and store the
+        resulting SLI series
+
+        :param planned: (PlannedQuery) the query to run
+        :param series: (dict) receives a dict of {epoch seconds: SLI} for each
+            (external_id, rule name) pair
+        :param start_time: (datetime) see generate_backfill()
+        :param end_time: (datetime) see generate_backfill()
+        :param step: (timedelta) see generate_backfill()
+        """
+        self.logger.info("Resolving '{}' for {} cluster(s) between {} and {}...".format(
+            planned.rule, len(planned.clusters), start_time, end_time))
+        # noinspection PyBroadException
+        try:
+            self.logger.debug("RANGE REQUEST: " + planned.query)
+            query_res = self.pc.custom_query_range(planned.query, int(start_time.timestamp()),
+                                                   int(end_time.timestamp()),
+                                                   int(step.total_seconds()), rule=planned.rule)
+            self.logger.debug("RESPONSE: " + str(query_res))
+        except Exception as ex:
+            self.logger.error("QueryFailure:'{}'".format(repr(ex)))
+            self.metrics.inc("query_failures_total", rule=planned.rule,
+                             reason=self.__failure_reason(ex))
+            return
+        self.metrics.observe("query_response_series", len(query_res), rule=planned.rule)
+
+        for sample in query_res[:None if planned.batched else 1]:
+            try:
+                external_id = sample["metric"]["_id"] if planned.batched else next(
+                    iter(planned.clusters))
+                series[(external_id, planned.rule)] = {int(float(t)): float(v) * 100 for t, v in
+                                                       sample["values"]}
+            except (KeyError, IndexError, TypeError, ValueError) as ex:
+                self.logger.error("QueryFailure:'{}' (unusable series in range response to "
+                                  "'{}')".format(repr(ex), planned.rule))
+                self.metrics.inc("query_failures_total", rule=planned.rule, reason="unusable")
+
+    @classmethod
+    def __last_day_boundary(cls, query_time: datetime = None) -> datetime:
+        """
+        Find the most recent midnight (UTC) at or before query_time whose data has
+        settled, i.e. is old enough that it won't change anymore
+
+        :param query_time: (datetime or None) the requested report time. If None,
+            assume datetime.now(timezone.utc)
+        :returns: (datetime) a timezone-aware datetime at midnight UTC
+        """
+        settled = datetime.now(timezone.utc) - cls.cache_settle_time
+        effective_now = min(query_time, settled) if query_time else settled
+        return effective_now.astimezone(timezone.utc).replace(hour=0, minute=0, second=0,
+                                                              microsecond=0)
+
+    def __plan_queries(self, clusters: Iterable[Cluster], raw_report: SLIReport,
+                       query_time: datetime, report_time: datetime,
+                       adjust_duration: bool, batch: bool, incremental: bool,
+                       journal: ReportJournal = None) -> Iterator[PlannedQuery]:
+        """
+        Build the PromQL queries needed to fill in a report. A row for each cluster
+        is added to raw_report as a side effect, so that results can be placed
+        into it as queries complete
+
+        :param clusters: (iterable) the Clusters to report on
+        :param raw_report: (SLIReport) the (empty) report to add clusters to
+        :param query_time: (datetime) the query time requested by the caller (see
+            generate_report()), or None for "now". Only used to describe the report
+            time in log messages
+        :param report_time: (datetime) the time the report is pinned to, i.e.
+            query_time, or the time the report was started if that's None. Cluster
+            ages and split windows are measured from it
+        :param adjust_duration: (bool) see generate_report()
+        :param batch: (bool) see generate_report()
+        :param incremental: (bool) see generate_report()
+        :param journal: (ReportJournal) see generate_report()
+        :returns: (generator) PlannedQuery objects, in the order they should be run
+        """
+        # Queries waiting to be resolved for a whole batch of clusters at once, along with their
+        # template variables. Everything but the selector is shared within a batch, so they are
+        # keyed by (rule name, evaluation time, part, duration). Grouping by duration lets young
+        # clusters (whose duration was capped at their age in days) share queries with each
+        # other, so a steady stream of new clusters costs a query per rule and distinct age
+        # rather than per rule and cluster. Their "query" is still the raw template
+        pending = {}
+
         for cluster in clusters:
             selector = "_id='{}'".format(cluster.external_id)
 
@@ -151,7 +716,7 @@ class SLIReporter(object):
             new_cluster_duration = None
             if adjust_duration and 'duration' in self.config['global_vars']:
                 new_cluster_duration = self.__adjust_duration(
-                    int(self.config['global_vars']['duration']), query_time,
+                    int(self.config['global_vars']['duration']), report_time,
                     cluster.creation_timestamp)
                 if new_cluster_duration:
                     self.logger.warning("'{0}' was created only {1} days before {2}, so capping "
@@ -160,18 +725,18 @@ class SLIReporter(object):
                     # Update cluster name
                     cluster = cluster._replace(name=cluster.name + '*')
 
-            raw_report[cluster.name] = {}
+            raw_report.add_cluster(cluster.name, cluster.external_id)
+            key = SLIReport.key(cluster.name, cluster.external_id)
             for rule in self.config["rules"]:
-                raw_report[cluster.name][rule['name']] = {}
+                # Skip anything that an interrupted run already resolved
+                if journal:
+                    known, sli = journal.get(cluster.external_id, rule['name'])
+                    if known:
+                        raw_report.set(key, rule['name'], sli)
+                        continue
 
                 # Prepare PromQL query parameters
-                try:
-                    query_params = {**self.config['global_vars'],
-                                    **{k: v for k, v in rule.items() if k != "query"},
-                                    **{"sel": selector}, }
-                except KeyError:
-                    query_params = {**{k: v for k, v in rule.items() if k != "query"},
-                                    **{"sel": selector}, }
+                query_params = self.__query_params(rule, selector)
 
                 # If cluster-level duration override is set, implement it
                 if new_cluster_duration:
@@ -179,47 +744,263 @@ class SLIReporter(object):
 
                 # Modify duration like above. This handles the case where a rule has its own local
                 # duration variable defined that overrides the global one
+                new_rule_duration = None
                 if adjust_duration and 'duration' in query_params:
                     new_rule_duration = self.__adjust_duration(int(query_params['duration']),
-                                                               query_time,
+                                                               report_time,
                                                                cluster.creation_timestamp)
                     if new_rule_duration:
                         query_params['duration'] = new_rule_duration
                         self.logger.warning(
                             "'{0}' was created only {1} days before {2}, so capping "
                             "'{3}' query duration at {1}d".format(cluster.name, new_rule_duration,
-                                                                  query_time.now if query_time else "today",
+                                                                  query_time or "today",
                                                                   rule['name']))
 
-                # Do the substitution
-                query = Template(rule["query"]).substitute(**query_params)
-                raw_report[cluster.name][rule['name']]['goal'] = float(rule['goal']) * 100
-                self.logger.info(
-                    "Resolving '{}' for cluster '{}' at time {}...".format(rule['name'],
-                                                                           cluster.name,
-                                                                           query_time or "now"))
-                # noinspection PyBroadException
-                try:
-                    self.logger.debug("REQUEST: " + query)
-                    if query_time:
-                        query_res = self.pc.custom_query(query, params={
-                            'time': str(int(query_time.timestamp()))})
-                    else:
-                        query_res = self.pc.custom_query(query)
-                    self.logger.debug("RESPONSE: " + str(query_res))
-                    raw_report[cluster.name][rule['name']]['sli'] = float(
-                        query_res[0]["value"][1]) * 100
-                except Exception as ex:
-                    raw_report[cluster.name][rule['name']]['sli'] = None
-                    self.logger.error("QueryFailure:'{}'".format(repr(ex)))
-        return raw_report
+                place = functools.partial(raw_report.set, key, rule['name'])
+                batchable = batch and rule.get('batch')
+
+                for template, params, eval_time, additive, part in self.__rule_queries(
+                        rule, cluster, query_params, place, report_time, incremental):
+                    if not batchable:
+                        # Do the substitution
+                        query = Template(template).substitute(**params)
+                        yield PlannedQuery(rule['name'], query,
+                                           {cluster.external_id: cluster.name}, False, eval_time,
+                                           {cluster.external_id: additive} if additive else None,
+                                           part)
+                        continue
+
+                    batch_key = (rule['name'], eval_time, part, str(params.get('duration')))
+                    if batch_key not in pending:
+                        pending[batch_key] = (PlannedQuery(rule['name'], template, {}, True,
+                                                           eval_time, {} if additive else None,
+                                                           part), params)
+                    chunk, chunk_params = pending[batch_key]
+                    chunk.clusters[cluster.external_id] = cluster.name
+                    if additive:
+                        chunk.sums[cluster.external_id] = additive
+                    if len(chunk.clusters) > 1 and len(
+                            self.__batch_selector(chunk.clusters)) > self.batch_selector_length:
+                        # This cluster pushed the chunk over the limit, so flush the chunk
+                        # without it and start a new one
+                        del chunk.clusters[cluster.external_id]
+                        if additive:
+                            del chunk.sums[cluster.external_id]
+                        yield self.__batch_query(chunk, chunk_params)
+                        pending[batch_key] = (chunk._replace(
+                            clusters={cluster.external_id: cluster.name},
+                            sums={cluster.external_id: additive} if additive else None),
+                                              chunk_params)
+                    if len(pending[batch_key][0].clusters) >= self.batch_size:
+                        yield self.__batch_query(*pending.pop(batch_key))
+
+        # Flush any partially-filled batches
+        for chunk, chunk_params in pending.values():
+            yield self.__batch_query(chunk, chunk_params)
+
+    def __rule_queries(self, rule: dict, cluster: Cluster, query_params: dict,
+                       place: Callable[[Union[float, None]], None],
+                       report_time: datetime, incremental: bool) -> Iterator[tuple]:
+        """
+        Work out which queries are needed to resolve a rule for a single cluster
+
+        :param rule: (dict) the rule from the config file
+        :param cluster: (Cluster) the cluster to resolve the rule for
+        :param query_params: (dict) the template variables for this cluster and rule
+        :param place: (callable) places the SLI into the report
+        :param report_time: (datetime) see __plan_queries()
+        :param incremental: (bool) see generate_report()
+        :returns: (generator) (template, template variables, evaluation time,
+            AdditiveSLI, part) tuples. The last three are None unless the rule is
+            being computed from partial sums (i.e. it's additive and either split
+            into sub-windows or computed incrementally)
+        """
+        additive = rule.get('additive')
+        split = additive.get('split') if additive else None
+        if not additive or not (incremental or split):
+            yield rule['query'], query_params, None, None, None
+            return
+        if 'duration' not in query_params:
+            self.logger.error("Rule '{}' has an 'additive' section but no 'duration' variable, so "
+                              "it can't be split up".format(rule['name']))
+            yield rule['query'], query_params, None, None, None
+            return
+
+        # A constant (numeric) denominator is the value for a single day
+        constant = additive['denominator'] if isinstance(additive['denominator'],
+                                                         (int, float)) else None
+        # Incremental mode always uses one-day windows, so that they line up from one run to
+        # the next. Otherwise, split the duration into chunks of the requested size, walking
+        # backwards from the query time (the oldest chunk may be shorter than the others)
+        chunk = 1 if incremental else int(split)
+        duration = int(query_params['duration'])
+        end = int(report_time.timestamp())
+        windows = [(end - offset * 24 * 60 * 60, min(chunk, duration - offset)) for offset in
+                   range(0, duration, chunk)]
+
+        known, store = None, None
+        if incremental and self.partials:
+            # Fingerprint the rendered one-day queries, so partial sums get recomputed whenever
+            # the rule (or any variable it uses) changes
+            day_params = {**query_params, 'duration': 1}
+            fingerprint = PartialStore.fingerprint(
+                Template(additive['numerator']).substitute(**day_params),
+                constant if constant is not None else Template(
+                    additive['denominator']).substitute(**day_params),
+                self.partial_eval_offset)
+            known = self.partials.get(cluster.external_id, fingerprint, windows)
+            store = functools.partial(self.partials.put, cluster.external_id, fingerprint)
+
+        sli = AdditiveSLI(place, windows, denominator=constant, maximum=additive.get('max'),
+                          known=known, store=store, min_exclusive=additive.get('min_exclusive'))
+        for kind, window in sli.missing_parts:
+            yield (additive[kind], {**query_params, 'duration': window[1]},
+                   datetime.fromtimestamp(window[0] - self.partial_eval_offset, timezone.utc),
+                   sli, (kind, window))
+
+    def __query_params(self, rule: dict, selector: str, by: str = "") -> Dict[str, str]:
+        """
+        Build the template variables for a rule's query
+
+        :param rule: (dict) the rule from the config file
+        :param selector: (str) the value to substitute for ${sel}
+        :param by: (str) the value to substitute for ${by}. Empty unless the query is batched
+        :returns: (dict) global vars, overridden by rule-local vars, plus sel and by
+        """
+        try:
+            return {**self.config['global_vars'],
+                    **{k: v for k, v in rule.items() if k != "query"},
+                    **{"sel": selector, "by": by}, }
+        except KeyError:
+            return {**{k: v for k, v in rule.items() if k != "query"},
+                    **{"sel": selector, "by": by}, }
+
+    @staticmethod
+    def __batch_selector(chunk: Dict[str, str]) -> str:
+        """
+        Build a selector matching every cluster in a batch
+
+        :param chunk: (dict) a mapping of external_id -> cluster name
+        :returns: (str) a PromQL label matcher like _id=~'id1|id2'
+        """
+        return "_id=~'{}'".format("|".join(chunk.keys()))
+
+    def __batch_query(self, chunk: PlannedQuery, params: dict) -> PlannedQuery:
+        """
+        Finish a batched query by substituting the template variables into it
+
+        :param chunk: (PlannedQuery) a batched query whose "query" is still the raw
+            template
+        :param params: (dict) the template variables shared by the batch
+        :returns: (PlannedQuery) the batched query, ready to run
+        """
+        params = {**params, "sel": self.__batch_selector(chunk.clusters), "by": "by (_id)"}
+        return chunk._replace(query=Template(chunk.query).substitute(**params))
+
+    def __resolve_query(self, planned: PlannedQuery, raw_report: SLIReport,
+                        query_time: datetime):
+        """
+        Run a planned query against Telemeter and place the resulting SLI(s) into
+        the report (or hand them to the AdditiveSLI they belong to). Failures are
+        recorded as an SLI of None
 
-    def generate_headers(self, html_tooltips: bool = False) -> List[str]:
+        :param planned: (PlannedQuery) the query to run
+        :param raw_report: (SLIReport) the report to place results into
+        :param query_time: (datetime) see generate_report()
+        """
+        eval_time = planned.time or query_time
+        if planned.batched:
+            self.logger.info(
+                "Resolving '{}' for {} clusters at time {}...".format(planned.rule,
+                                                                      len(planned.clusters),
+                                                                      eval_time or "now"))
+        else:
+            self.logger.info(
+                "Resolving '{}' for cluster '{}' at time {}...".format(
+                    planned.rule, next(iter(planned.clusters.values())), eval_time or "now"))
+        # noinspection PyBroadException
+        try:
+            query_res = self.__query(planned.query, eval_time, planned.rule)
+        except Exception as ex:
+            self.logger.error("QueryFailure:'{}'".format(repr(ex)))
+            self.metrics.inc("query_failures_total", rule=planned.rule,
+                             reason=self.__failure_reason(ex))
+            for external_id, cluster_name in planned.clusters.items():
+                if planned.sums:
+                    planned.sums[external_id].fail(planned.part)
+                else:
+                    raw_report.set(SLIReport.key(cluster_name, external_id), planned.rule, None)
+            return
+
+        # Split the returned vector up into per-cluster results. Unbatched queries just use the
+        # first sample
+        self.metrics.observe("query_response_series", len(query_res), rule=planned.rule)
+        results = {}
+        for sample in query_res[:None if planned.batched else 1]:
+            try:
+                external_id = sample["metric"]["_id"] if planned.batched else next(
+                    iter(planned.clusters))
+                results[external_id] = float(sample["value"][1])
+            except (KeyError, IndexError, TypeError, ValueError) as ex:
+                self.logger.error("QueryFailure:'{}' (unusable sample in response to "
+                                  "'{}')".format(repr(ex), planned.rule))
+                self.metrics.inc("query_failures_total", rule=planned.rule, reason="unusable")
+
+        for external_id, cluster_name in planned.clusters.items():
+            value = results.get(external_id)
+            if planned.sums:
+                # No samples is a legitimate result for a partial sum
+                planned.sums[external_id].add(planned.part, value)
+                continue
+            if value is None:
+                self.logger.error("QueryFailure:'no result for cluster '{}' in response to "
+                                  "'{}''".format(cluster_name, planned.rule))
+                self.metrics.inc("query_failures_total", rule=planned.rule, reason="no_result")
+                raw_report.set(SLIReport.key(cluster_name, external_id), planned.rule, None)
+            else:
+                raw_report.set(SLIReport.key(cluster_name, external_id), planned.rule,
+                               value * 100)
+
+    def __query(self, query: str, query_time: datetime = None, rule: str = None) -> list:
+        """
+        Run a query against Telemeter, going through the query cache if possible.
+        Only queries evaluated at a (settled) point in the past are cached, since
+        their results can't change anymore
+
+        :param query: (str) the PromQL query to run
+        :param query_time: (datetime) see generate_report()
+        :param rule: (str) the name of the rule the query belongs to, for metrics
+        :returns: (list) the result of the query
+        """
+        cacheable = self.cache is not None and query_time is not None and (
+                query_time < datetime.now(timezone.utc) - self.cache_settle_time)
+        if cacheable:
+            query_res = self.cache.get(query, int(query_time.timestamp()))
+            if query_res is not None:
+                self.logger.debug("CACHED RESPONSE: " + str(query_res))
+                return query_res
+
+        self.logger.debug("REQUEST: " + query)
+        if query_time:
+            query_res = self.pc.custom_query(query, params={
+                'time': str(int(query_time.timestamp()))}, rule=rule)
+        else:
+            query_res = self.pc.custom_query(query, rule=rule)
+        self.logger.debug("RESPONSE: " + str(query_res))
+
+        if cacheable:
+            self.cache.put(query, int(query_time.timestamp()), query_res)
+        return query_res
+
+    def generate_headers(self, html_tooltips: bool = False, trend_days: int = None) -> List[str]:
         """
         Generate the header row of the report based on the configured rules
 
         :param html_tooltips: (bool) if True, add HTML span tags to the output which enable CSS
             description tooltips
+        :param trend_days: (int) if provided, add the headers of the trend columns
+            (see format_report())
         :returns: a single list representing the header row
         """
         if html_tooltips:
@@ -230,12 +1011,18 @@ class SLIReporter(object):
                                        desc=(r['description'] if 'description' in r else "n/a"),
                                        t="("+str(r["goal"]*100)+"%)")) for r in self.config["rules"]]
         else:
-            head_gen = [(r["name"] + " Goal", r["name"] + str(r["goal"])) for r in self.config["rules"]]
+            head_gen = ["{} ({}%)".format(r['name'], r["goal"] * 100) for r in self.config["rules"]]
 
+        if trend_days:
+            head_gen = [x for header, r in zip(head_gen, self.config["rules"]) for x in
+                        (header, "{} change".format(r['name']),
+                         "{} {}d min".format(r['name'], trend_days))]
         return ["Cluster"] + head_gen
 
-    def format_report(self, headers: List[str], raw_report: Dict[str, Dict[str, Dict[str, float]]],
-                      fmt: str, color: bool, title: str = None, footer: str = None) -> str:
+    def format_report(self, headers: List[str],
+                      raw_report: Union[SLIReport, Dict[str, Dict[str, Dict[str, float]]]],
+                      fmt: str, color: bool, title: str = None, footer: str = None,
+                      trend_days: int = None) -> str:
         """
         Format a pre-generated report using tabulate and print to string
 
@@ -243,42 +1030,142 @@ class SLIReporter(object):
         adding colors and HTML styling (if fmt='html')
 
         :param headers: (list) the header row of the report
-        :param raw_report: (dict) the contents of the report
-        :param fmt: (str) passed to tabulate as the "tablefmt" param
+        :param raw_report: (SLIReport) the contents of the report. A legacy nested
+            dictionary is accepted as well
+        :param fmt: (str) passed to tabulate as the "tablefmt" param. Additionally,
+            "json" outputs the raw report (see SLIReport.to_json()), e.g. to merge
+            it with other reports later
         :param color: (bool) whether or not to include color styles
         :param title: (str) optional title to display on the report
         :param footer: (str) optional footer to display on the report
+        :param trend_days: (int) if provided, follow every rule's column with the
+            change since the previous report and the lowest SLI over the last
+            trend_days days. Both are read from the SLI history, so no queries are
+            run. The headers must match (see generate_headers())
+        """
+        with self.metrics.time("phase_seconds_total", phase="format"):
+            raw_report = SLIReport.from_dict(raw_report)
+            if fmt == 'json':
+                return json.dumps(raw_report.to_json())
+
+            # Both of these are computed once per report and shared by every output format
+            status = raw_report.status(self.caution_threshold)
+            rounded = raw_report.rounded()
+            if trend_days:
+                previous, minimum = self.generate_trend(raw_report, trend_days)
+                min_status = minimum.status(self.caution_threshold)
+                min_rounded = minimum.rounded()
+
+            table = []
+            width = len(raw_report.rules)
+            for index, cluster_name in enumerate(raw_report.clusters):
+                cells = slice(index * width, (index + 1) * width)
+                row = self.__format_cells(raw_report.sli[cells], status[cells], rounded[cells],
+                                          fmt, color)
+                if trend_days:
+                    changes = [self.__format_change(value, before, fmt if fmt != 'csv' else None)
+                               for value, before in zip(raw_report.sli[cells],
+                                                        previous.sli[cells])]
+                    lows = self.__format_cells(minimum.sli[cells], min_status[cells],
+                                               min_rounded[cells], fmt, color)
+                    row = [x for cell in zip(row, changes, lows) for x in cell]
+                table.append([cluster_name] + row)
+            if fmt == 'csv':
+                str_buff = io.StringIO()
+                csv_writer = csv.writer(str_buff)
+                for row in [headers] + table:
+                    csv_writer.writerow(row)
+                formatted_report = str_buff.getvalue()
+                str_buff.close()
+                return formatted_report
+            elif fmt == 'html':
+                table_html = tabulate(table, headers, tablefmt=fmt, stralign="center")
+                return Template(self.html).safe_substitute(style=self.css, table=table_html,
+                                                           title=title, footer=footer)
+            else:
+                return tabulate(table, headers, tablefmt=fmt, stralign="center")
+
+    def generate_trend(self, raw_report: SLIReport, days: int) -> tuple:
+        """
+        Look up the earlier SLIs of a report's clusters in the SLI history. These
+        are what format_report() renders in the trend columns
+
+        :param raw_report: (SLIReport) the report
+        :param days: (int) see format_report()
+        :returns: (tuple) the previous and the lowest SLIs (see SLIHistory.trend())
+        """
+        if self.history is None:
+            raise Exception("Can't add trend columns without the SLI history (is the cache "
+                            "disabled?)")
+        return self.history.trend(raw_report, self.__rule_fingerprints(),
+                                  raw_report.time or datetime.now(timezone.utc), days)
+
+    def report_writer(self, stream: TextIO, fmt: str, headers: List[str], title: str = None,
+                      minify: bool = False) -> ReportWriter:
+        """
+        Start writing a report row by row, e.g. while it is being generated (see
+        the on_cluster param of generate_report() and format_row())
+
+        :param stream: (file) a writable text stream
+        :param fmt: (str) the format of the report. Must be one of
+            streamable_formats
+        :param headers: (list) the header row of the report
+        :param title: (str) optional title to display on the report (HTML only)
+        :param minify: (bool) if True, minify the HTML as it is written
+        :returns: (ReportWriter) a writer that has already written the start of
+            the report. Call close() to finish it
         """
-        table = []
-        for cluster_name, rules in raw_report.items():
-            row = [cluster_name]
-            for _, scores in rules.items():
-                sli_f = self.__format_sli(value=scores['sli'], goal=scores['goal'],
-                                          fmt=(fmt if fmt != 'csv' else None), color=color)
-                row += [sli_f]
-            table.append(row)
         if fmt == 'csv':
-            str_buff = io.StringIO()
-            csv_writer = csv.writer(str_buff)
-            for row in [headers] + table:
-                csv_writer.writerow(row)
-            formatted_report = str_buff.getvalue()
-            str_buff.close()
-            return formatted_report
+            return CSVReportWriter(stream, headers)
         elif fmt == 'html':
-            table_html = tabulate(table, headers, tablefmt=fmt, stralign="center")
-            return Template(self.html).safe_substitute(style=self.css, table=table_html,
-                                                       title=title, footer=footer)
+            return HTMLReportWriter(stream, headers, template=self.html, style=self.css,
+                                    title=title, minify=minify)
         else:
-            return tabulate(table, headers, tablefmt=fmt, stralign="center")
+            raise Exception("Can't stream reports in the '{}' format".format(fmt))
+
+    def format_row(self, raw_report: SLIReport, index: int, fmt: str, color: bool) -> List[str]:
+        """
+        Format a single row of a report, the same way format_report() would. Meant
+        for writing rows while the rest of the report is still being generated
+
+        :param raw_report: (SLIReport) the report containing the row
+        :param index: (int) the row number of the cluster
+        :param fmt: (str) see format_report()
+        :param color: (bool) whether or not to include color styles
+        :returns: (list) the cluster name, followed by the formatted SLIs
+        """
+        width = len(raw_report.rules)
+        with self.metrics.time("phase_seconds_total", phase="format"):
+            return [raw_report.clusters[index]] + self.__format_cells(
+                raw_report.sli[index * width:(index + 1) * width],
+                raw_report.row_status(index, self.caution_threshold),
+                raw_report.row_rounded(index), fmt, color)
 
     @classmethod
-    def __check_ssl_certs(cls, url: str) -> bool:
+    def __format_cells(cls, values: Iterable[float], status: Iterable[int],
+                       rounded: Iterable[str], fmt: str, color: bool) -> List[str]:
+        """
+        Format a sequence of SLIs (see __format_sli())
+
+        :param values: (iterable) the SLIs (NaN if unknown)
+        :param status: (iterable) the compliance class of each SLI
+        :param rounded: (iterable) each SLI, rounded for display
+        :param fmt: (str) see format_report()
+        :param color: (bool) whether or not to apply coloring
+        :returns: (list) the formatted SLIs
+        """
+        return [cls.__format_sli(value, s, r, fmt=(fmt if fmt != 'csv' else None), color=color)
+                for value, s, r in zip(values, status, rounded)]
+
+    @classmethod
+    def __check_ssl_certs(cls, url: str, session: requests.Session) -> bool:
         """
         Checks if the Red Hat SSL CA certs are installed by connecting
         to a URL that uses them.
 
         :param url: (str) an HTTPS URL utilizing Red Hat-signed certificates
+        :param session: (requests.Session) the session to connect with. The
+            connection stays in its pool for later requests
         :returns: (bool) true if we could successfully connect to the URL
         """
         cls.logger.debug("Attempting secure connection to " + url)
@@ -287,7 +1174,7 @@ class SLIReporter(object):
         while not success and retries > 0:
             retries -= 1
             try:
-                response = requests.get(url)
+                response = session.get(url)
                 cls.logger.debug("Received status code " + str(response.status_code))
                 success = True
             except requests.exceptions.SSLError:
@@ -316,29 +1203,45 @@ class SLIReporter(object):
 
         return success
 
-    @classmethod
-    def __format_sli(cls, value: Union[float, None], goal: Union[float, None], fmt: str,
-                     color: bool) -> str:
+    @staticmethod
+    def __format_change(value: float, previous: float, fmt: str) -> str:
+        """
+        Format the change of an SLI since the previous report
+
+        :param value: (float) the current value of the SLI (NaN if unknown)
+        :param previous: (float) the previous value of the SLI (NaN if unknown)
+        :param fmt: (str) see __format_sli()
+        :returns: (str) the change in percentage points, e.g. "+0.125%"
+        """
+        if math.isnan(value) or math.isnan(previous):
+            return "--" if fmt is not None else ""
+        if fmt is None:
+            return str(value - previous)
+        return ('{:+0.3f}&#37;' if fmt == "html" else '{:+0.3f}%').format(value - previous)
+
+    @staticmethod
+    def __format_sli(value: float, status: int, rounded_sli: str, fmt: str, color: bool) -> str:
         """
         Adds CSS formatting to the value of an SLI based on whether
         or not it complies with SLA
 
-        :param value: (float) the current value of the SLI
-        :param goal: (float) the minimum "good" value of the SLI
+        :param value: (float) the current value of the SLI (NaN if unknown)
+        :param status: (int) the compliance class of the SLI (see SLIReport.status())
+        :param rounded_sli: (str) the SLI, rounded for display (see SLIReport.rounded())
         :param fmt: (str) What kind of formatting to apply. Options
             include "html", "plain", "simple", "grid", "fancy_grid"
         :param color: (bool) whether or not to apply coloring
         :returns: (str) a formatted HTML string
         """
-        if value is None:
+        if status == SLIReport.UNKNOWN:
             value = 0
             html_template = "--"
             shell_template = "--"
         elif color:
-            if value - goal < 0:
+            if status == SLIReport.DANGER:
                 html_template = "<span class='danger'>{}&#37;</span>"
                 shell_template = "\033[1;31m{}%\033[0m"
-            elif value - goal < cls.caution_threshold:
+            elif status == SLIReport.CAUTION:
                 html_template = "<span class='caution'>{}&#37;</span>"
                 shell_template = "\033[1;33m{}%\033[0m"
             else:
@@ -348,7 +1251,6 @@ class SLIReporter(object):
             html_template = "{}&#37;"
             shell_template = "{}%"
 
-        rounded_sli = '{:0.3f}'.format(value)[:6]
         if fmt == "html":
             return html_template.format(rounded_sli)
         elif fmt is not None:
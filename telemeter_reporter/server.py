@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple, Union
+
+from .metrics import Metrics
+from .report import SLIReport
+
+
+class ReportServer(object):
+    """
+    Keeps an SLI report up to date on a schedule and serves it over HTTP in any
+    number of formats. Each format is only rendered when it's first requested
+    after the report's data has changed
+    """
+    logger = logging.getLogger("ReportServer")
+
+    content_types = {'html': "text/html", 'csv': "text/csv", 'json': "application/json"}
+
+    # Formats that show when the report was generated (in its title, footer or data), so they're
+    # rendered again after every refresh even if the SLIs haven't changed
+    timed_formats = {'html', 'json'}
+
+    def __init__(self, refresh: Callable[[], SLIReport], render: Callable[[SLIReport, str], str],
+                 formats: List[str], interval: float, metrics: Metrics = None,
+                 version: Callable[[SLIReport], bytes] = None):
+        """
+        Instantiate a ReportServer object
+
+        :param refresh: (callable) generates a new report. Called in a background
+            thread every interval seconds
+        :param render: (callable) called with (report, format) to format a report
+        :param formats: (list) the formats to serve. The first one is served at "/"
+        :param interval: (float) the number of seconds between the start of one
+            refresh and the start of the next
+        :param metrics: (Metrics) if provided, served at "/metrics"
+        :param version: (callable) called with a report to get whatever else
+            render() depends on besides the report's data (e.g. the SLI history
+            behind trend columns), so that cached renders are discarded when it
+            changes
+        """
+        self.refresh = refresh
+        self.render = render
+        self.formats = formats
+        self.interval = interval
+        self.metrics = metrics
+        self.version = version
+        self.report = None
+        self.refreshed = None
+        self.__version = None
+        self.__renders = {}
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+
+    def update(self, report: SLIReport):
+        """
+        Replace the served report. Cached renders of formats that don't show the
+        report's time are only discarded if the data of the report (or the
+        result of self.version) changed
+
+        :param report: (SLIReport) the new report
+        """
+        digest = hashlib.sha256(repr((report.clusters, report.external_ids)).encode() +
+                                report.sli.tobytes())
+        if self.version is not None:
+            digest.update(self.version(report))
+        version = digest.hexdigest()[:16]
+        with self.__lock:
+            self.refreshed = time.time()
+            self.report = report
+            if version == self.__version:
+                self.__renders = {fmt: rendered for fmt, rendered in self.__renders.items()
+                                  if fmt not in self.timed_formats}
+                self.logger.info("Refreshed report is unchanged, keeping cached renders of "
+                                 "{}".format(", ".join(self.__renders) or "no formats"))
+                return
+            self.__version = version
+            self.__renders = {}
+        self.logger.info("Serving a new report on {} clusters".format(len(report)))
+
+    def get(self, fmt: str) -> Union[Tuple[bytes, str], None]:
+        """
+        Get the current report in a format, rendering it if necessary
+
+        :param fmt: (str) one of self.formats
+        :returns: (tuple) the rendered report and its ETag, or None if no report
+            has been generated yet
+        """
+        with self.__lock:
+            if self.report is None:
+                return None
+            if fmt not in self.__renders:
+                start = time.perf_counter()
+                self.__renders[fmt] = self.render(self.report, fmt).encode()
+                self.logger.info("Rendered the {} report in {:.2f}s".format(
+                    fmt, time.perf_counter() - start))
+            etag = '"{}-{}"'.format(self.__version, fmt)
+            if fmt in self.timed_formats and self.report.time is not None:
+                etag = '"{}-{}-{}"'.format(self.__version, fmt, int(self.report.time.timestamp()))
+            return self.__renders[fmt], etag
+
+    def run(self):
+        """
+        Refresh the report every self.interval seconds until stop() is called.
+        A failed refresh is logged, and the previous report stays in service
+        """
+        while not self.__stopped.is_set():
+            start = time.monotonic()
+            # noinspection PyBroadException
+            try:
+                self.update(self.refresh())
+            except Exception:
+                self.logger.exception("Failed to refresh the report")
+            self.__stopped.wait(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def stop(self):
+        """
+        Stop refreshing the report (after the current refresh)
+        """
+        self.__stopped.set()
+
+    def serve_forever(self, host: str, port: int):
+        """
+        Start refreshing the report in the background, and serve it over HTTP
+        until interrupted. Paths:
+            "/": the report in the first of self.formats
+            "/report.<format>": the report in any of self.formats
+            "/metrics": Prometheus metrics about the report runs
+            "/healthz": 200 once a report is available, 503 until then
+
+        :param host: (str) the address to listen on
+        :param port: (int) the port to listen on
+        """
+        refresher = threading.Thread(target=self.run, name="refresh", daemon=True)
+        refresher.start()
+        httpd = ThreadingHTTPServer((host, port), self.__handler())
+        httpd.daemon_threads = True
+        self.logger.info("Serving reports on http://{}:{}/ (refreshing every {}s)".format(
+            host, port, self.interval))
+        try:
+            httpd.serve_forever()
+        finally:
+            self.stop()
+            httpd.server_close()
+
+    def __handler(self) -> type:
+        """
+        Build the request handler class of the HTTP server
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, fmt: str, *args):
+                server.logger.debug(fmt % args)
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/healthz":
+                    ready = server.report is not None
+                    return self.send(b"ok\n" if ready else b"no report yet\n",
+                                     status=200 if ready else 503)
+                if path == "/metrics" and server.metrics is not None:
+                    return self.send(server.metrics.render().encode(),
+                                     content_type="text/plain; version=0.0.4")
+
+                fmt = server.formats[0] if path == "/" else path[len("/report."):] if \
+                    path.startswith("/report.") else None
+                if fmt not in server.formats:
+                    return self.send(b"not found\n", status=404)
+                rendered = server.get(fmt)
+                if rendered is None:
+                    return self.send(b"The first report is still being generated\n", status=503,
+                                     headers={"Retry-After": "60"})
+                body, etag = rendered
+                headers = {"ETag": etag, "Last-Modified": self.date_time_string(
+                    int(server.refreshed))}
+                if self.headers.get("If-None-Match") == etag:
+                    return self.send(b"", status=304, headers=headers)
+                self.send(body, content_type=server.content_types.get(fmt, "text/plain"),
+                          headers=headers)
+
+            def send(self, body: bytes, status: int = 200, content_type: str = "text/plain",
+                     headers: Dict[str, str] = None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type + "; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if status != 304:
+                    self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("session")
+
+default_pool_connections = 4
+default_pool_maxsize = 10
+
+
+def build_session(pool_connections: int = None, pool_maxsize: int = None,
+                  keep_alive: bool = True) -> requests.Session:
+    """
+    Create a connection-pooled HTTP session to be shared by every client that
+    talks to Telemeter, UHC or the SSO service, so TCP/TLS connections get reused
+    across requests instead of being renegotiated every time
+
+    :param pool_connections: (int) the number of hosts to keep connection pools
+        for. Default: 4
+    :param pool_maxsize: (int) the maximum number of idle connections to keep per
+        host. Should be at least as large as the number of concurrent requests,
+        otherwise connections will be thrown away after use. Default: 10
+    :param keep_alive: (bool) if False, ask servers to close each connection
+        after every request (i.e. disable connection reuse)
+    :returns: (requests.Session) a session ready for use
+    """
+    pool_connections = pool_connections or default_pool_connections
+    pool_maxsize = pool_maxsize or default_pool_maxsize
+    logger.debug("Creating HTTP session (pool_connections={}, pool_maxsize={}, "
+                 "keep_alive={})".format(pool_connections, pool_maxsize, keep_alive))
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+def session_from_config(config: dict, concurrency: int = 1) -> requests.Session:
+    """
+    Create a session using the (optional) api.session section of a config file
+
+    :param config: (dict) the full reporter config
+    :param concurrency: (int) the number of requests that may be in flight at
+        once. Used as the default pool size if api.session.pool_maxsize is unset
+    :returns: (requests.Session) a session ready for use
+    """
+    try:
+        session_config = config["api"]["session"] or {}
+    except KeyError:
+        session_config = {}
+    return build_session(
+        pool_connections=session_config.get("pool_connections"),
+        pool_maxsize=session_config.get("pool_maxsize",
+                                        max(concurrency, default_pool_maxsize)),
+        keep_alive=session_config.get("keep_alive", True))
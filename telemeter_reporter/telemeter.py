@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import requests
+
+from .metrics import Metrics
+
+
+class QueryError(Exception):
+    """
+    A query that Telemeter answered with an HTTP error
+    """
+
+    def __init__(self, status_code: int, content: bytes, retry_after: float = None):
+        """
+        Instantiate a QueryError object
+
+        :param status_code: (int) the HTTP status code of the response
+        :param content: (bytes) the body of the response
+        :param retry_after: (float) the number of seconds the server asked us to
+            wait before retrying (from the Retry-After header), if any
+        """
+        super().__init__("HTTP Status Code {} ({})".format(status_code, content))
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_response(cls, response: requests.Response) -> "QueryError":
+        """
+        Build a QueryError from an unsuccessful response
+
+        :param response: (requests.Response) the response
+        :returns: (QueryError) the matching error
+        """
+        try:
+            retry_after = float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            retry_after = None
+        return cls(response.status_code, response.content, retry_after)
+
+
+class TelemeterClient(object):
+    """
+    Minimal client for the Prometheus-compatible HTTP API exposed by Telemeter-LTS
+    """
+    logger = logging.getLogger("TelemeterClient")
+
+    def __init__(self, url: str, token: str, session: requests.Session = None,
+                 timeout: float = None, metrics: Metrics = None):
+        """
+        Instantiate a TelemeterClient object
+
+        :param url: (str) the URL of the Prometheus-compatible API
+        :param token: (str) a bearer token for the API
+        :param session: (requests.Session) a (possibly shared) HTTP session to send
+            requests through. A new one is created if not provided
+        :param timeout: (float) the number of seconds to wait for a response before
+            giving up with a requests.exceptions.Timeout. Default: wait forever
+        :param metrics: (Metrics) records the size of every response
+        """
+        self.url = url.rstrip("/")
+        self.headers = {"Authorization": "bearer " + token}
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.metrics = metrics or Metrics()
+
+    def custom_query(self, query: str, params: dict = None) -> list:
+        """
+        Evaluate a PromQL instant query
+
+        :param query: (str) the PromQL query to run
+        :param params: (dict) optional extra GET parameters, such as "time"
+        :returns: (list) the "result" section of the API's response
+        :raises: (QueryError) if the API responds with an error
+        """
+        params = params or {}
+        response = self.session.get("{}/api/v1/query".format(self.url),
+                                    params={**{"query": query}, **params},
+                                    headers=self.headers, verify=True, timeout=self.timeout)
+        self.metrics.observe("query_response_bytes", len(response.content), endpoint="query")
+        if response.status_code == 200:
+            return response.json()["data"]["result"]
+        else:
+            raise QueryError.from_response(response)
+
+    def custom_query_range(self, query: str, start_time: int, end_time: int, step: int,
+                           params: dict = None) -> list:
+        """
+        Evaluate a PromQL query at regular intervals over a range of time
+
+        :param query: (str) the PromQL query to run
+        :param start_time: (int) the first evaluation time (epoch seconds)
+        :param end_time: (int) the last possible evaluation time (epoch seconds)
+        :param step: (int) the time between evaluations, in seconds
+        :param params: (dict) optional extra GET parameters
+        :returns: (list) the "result" section of the API's response (a matrix)
+        :raises: (QueryError) if the API responds with an error
+        """
+        params = params or {}
+        response = self.session.get("{}/api/v1/query_range".format(self.url),
+                                    params={**{"query": query, "start": start_time,
+                                               "end": end_time, "step": step}, **params},
+                                    headers=self.headers, verify=True, timeout=self.timeout)
+        self.metrics.observe("query_response_bytes", len(response.content), endpoint="query_range")
+        if response.status_code == 200:
+            return response.json()["data"]["result"]
+        else:
+            raise QueryError.from_response(response)
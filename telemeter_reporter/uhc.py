@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 import datetime
 import logging
-from typing import List, NamedTuple
+import math
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, NamedTuple
 
 import dateparser
 import jwt
 import requests
 
+from .metrics import Metrics
+
 
 class Cluster(NamedTuple):
     id: str
@@ -21,7 +28,19 @@ class UnifiedHybridClient(object):
     """
     logger = logging.getLogger("UnifiedHybridClient")
 
-    def __init__(self, api_url: str, offline_token: str, public_key: str = None):
+    # Access tokens are refreshed this many seconds before they actually expire
+    token_expiry_margin = 60
+
+    default_page_size = 100
+    default_prefetch = 4
+
+    # RFC3339 timestamps as returned by the API, e.g. "2019-06-01T12:34:56.123456789Z"
+    rfc3339_pattern = re.compile(r"^(\d{4}-\d\d-\d\d)[Tt ](\d\d:\d\d:\d\d)(?:\.(\d+))?"
+                                 r"([Zz]|[+-]\d\d:\d\d)$")
+
+    def __init__(self, api_url: str, offline_token: str, public_key: str = None,
+                 session: requests.Session = None, page_size: int = None, prefetch: int = None,
+                 metrics: Metrics = None):
         """
         Instantiate a UnifiedHybrid client object
 
@@ -32,11 +51,27 @@ class UnifiedHybridClient(object):
         :param public_key: (str) the RSA public key that corresponds
             to the JSON Web Token you provide. Hint: https://jwt.io/
             can extract this from a JWT for you
+        :param session: (requests.Session) a (possibly shared) HTTP session to send
+            requests through. A new one is created if not provided
+        :param page_size: (int) the number of clusters to request per page of search
+            results. Default: 100
+        :param prefetch: (int) the maximum number of pages of search results to
+            download at once. Default: 4
+        :param metrics: (Metrics) records the latency of every request
         """
 
         self.api_url = api_url
+        self.page_size = page_size or self.default_page_size
+        self.prefetch = prefetch or self.default_prefetch
         self.offline_token = offline_token.strip()
         self.public_key = public_key.strip() if public_key is not None else public_key
+        self.session = session or requests.Session()
+        self.metrics = metrics or Metrics()
+
+        # Cached short-lived access token, and the (epoch) time after which it must be refreshed
+        self.__access_token = None
+        self.__access_token_expiry = 0
+        self.__access_token_lock = threading.Lock()
 
         # Extract info from the offline token
         if self.public_key is None:
@@ -51,55 +86,169 @@ class UnifiedHybridClient(object):
 
     def __get_access_token(self) -> str:
         """
-        Obtain a short-lived access token from the SSO service
+        Obtain a short-lived access token from the SSO service. Tokens are cached
+        and reused until shortly before they expire
 
         :returns: (str) a short-lived access token
         """
-        response = requests.post("{}/protocol/openid-connect/token".format(self.iss_url),
-                                 data={"grant_type": "refresh_token",
-                                       "client_id": self.client_id,
-                                       "refresh_token": self.offline_token, },
-                                 headers={"accept": "application/json"}, )
+        with self.__access_token_lock:
+            if self.__access_token and time.time() < self.__access_token_expiry:
+                return self.__access_token
+
+            with self.metrics.time("uhc_request_duration_seconds", endpoint="token"):
+                response = self.session.post(
+                    "{}/protocol/openid-connect/token".format(self.iss_url),
+                    data={"grant_type": "refresh_token",
+                          "client_id": self.client_id,
+                          "refresh_token": self.offline_token, },
+                    headers={"accept": "application/json"}, )
+            try:
+                data = response.json()
+                access_token = data["access_token"]
+            except (KeyError, ValueError):
+                self.logger.critical(
+                    "Unable to obtain OpenID access token from {}. Response: {}".format(
+                        self.iss_url, str(response)))
+                return None
+
+            self.__access_token = access_token
+            self.__access_token_expiry = self.__token_expiry(access_token, data.get(
+                "expires_in")) - self.token_expiry_margin
+            self.logger.debug("Obtained new access token (valid until {})".format(
+                datetime.datetime.fromtimestamp(self.__access_token_expiry,
+                                                datetime.timezone.utc)))
+            return access_token
+
+    @staticmethod
+    def __token_expiry(access_token: str, expires_in: int = None) -> float:
+        """
+        Work out when an access token expires
+
+        :param access_token: (str) the access token (a JSON Web Token)
+        :param expires_in: (int) the "expires_in" field of the SSO response, if any
+        :returns: (float) the expiry time of the token, in seconds since the epoch
+        """
+        # The token itself is only used to read its "exp" claim. It's not our job to verify
+        # it, since the API we pass it to will do that
         try:
-            return response.json()["access_token"]
-        except KeyError:
-            self.logger.critical(
-                "Unable to obtain OpenID access token from {}. Response: {}".format(self.iss_url,
-                                                                                    str(response)))
+            return float(jwt.decode(access_token, verify=False)["exp"])
+        except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+            pass
+        try:
+            return time.time() + float(expires_in)
+        except (TypeError, ValueError):
+            # Unknown lifetime: don't cache the token for long
+            return time.time()
 
-    def search_clusters(self, query: str) -> List[Cluster]:
+    def search_clusters(self, query: str) -> Iterator[Cluster]:
         """
         Query a list of clusters from the UHC HTTP API.
 
+        Results are fetched one page at a time. Once the first page reveals the total
+        number of matching clusters, the remaining pages are downloaded concurrently
+        in the background while earlier pages are being consumed. The number of
+        pages is based on the number of clusters the API actually returned in the
+        first page, which may be less than page_size if the API caps it.
+
         :param query: (str) Specifies the search criteria. This syntax of
             this parameter is similar to the syntax of the WHERE clause of
             an SQL statement, but using the names of the attributes of the
             cluster instead of the names of the columns of a table.
-        :returns: (list) a list of Cluster objects returned from the API
+        :returns: (generator) the Cluster objects returned from the API
         """
         self.logger.info("Querying UHC API for clusters matching \"{}\"".format(query))
-        response = requests.get("{}/api/clusters_mgmt/v1/clusters".format(self.api_url),
-                                headers={"accept": "application/json",
-                                         "Authorization": "Bearer " + self.__get_access_token(), },
-                                params={"search": query}, verify=True, )
+        data = self.__get_clusters_page(query, 1)
+        total = data.get('total', len(data['items']))
+        fetched = len(data['items'])
+        page_size = data.get('size', fetched) or self.page_size
+        if page_size < min(self.page_size, total):
+            self.logger.warning("UHC API returned {} clusters per page instead of the requested "
+                                "{}".format(page_size, self.page_size))
+        pages = max(1, math.ceil(total / page_size))
+        self.logger.info("UHC API reports {} matching clusters ({} pages)".format(total, pages))
+        yield from self.__parse_clusters(data['items'])
+
+        if pages > 1:
+            with ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+                futures = [executor.submit(self.__get_clusters_page, query, page)
+                           for page in range(2, pages + 1)]
+                try:
+                    for future in futures:
+                        items = future.result()['items']
+                        fetched += len(items)
+                        yield from self.__parse_clusters(items)
+                finally:
+                    # Don't bother downloading the rest if the consumer gave up early
+                    for future in futures:
+                        future.cancel()
+
+        # Pages may have come back shorter than the first one: keep going until every cluster
+        # the API reported has been fetched
+        while fetched < total:
+            pages += 1
+            items = self.__get_clusters_page(query, pages)['items']
+            if not items:
+                break
+            fetched += len(items)
+            yield from self.__parse_clusters(items)
+        if fetched != total:
+            self.logger.warning("UHC API reported {} matching clusters, but returned {}".format(
+                total, fetched))
+
+    def __get_clusters_page(self, query: str, page: int) -> dict:
+        """
+        Fetch a single page of cluster search results from the UHC HTTP API
+
+        :param query: (str) the search criteria (see search_clusters())
+        :param page: (int) the (1-based) number of the page to fetch
+        :returns: (dict) the decoded JSON response
+        """
+        access_token = self.__get_access_token()
+        with self.metrics.time("uhc_request_duration_seconds", endpoint="clusters"):
+            response = self.session.get("{}/api/clusters_mgmt/v1/clusters".format(self.api_url),
+                                        headers={"accept": "application/json",
+                                                 "Authorization": "Bearer " + access_token, },
+                                        params={"search": query, "page": page,
+                                                "size": self.page_size, }, verify=True, )
         if response.status_code == 200:
             data = response.json()
-            self.logger.info("UHC API returned {} clusters".format(len(data['items'])))
+            self.logger.info("UHC API returned {} clusters (page {})".format(len(data['items']),
+                                                                             page))
+            return data
         else:
             raise Exception(
                 "HTTP Status Code {} ({})".format(response.status_code, response.content))
 
-        cluster_list = []
-        for c in data['items']:
+    @classmethod
+    def parse_timestamp(cls, timestamp: str) -> datetime.datetime:
+        """
+        Parse a timestamp returned by the API into a timezone-aware datetime
+
+        :param timestamp: (str) an RFC3339 timestamp
+        :returns: (datetime) the parsed timestamp
+        """
+        # datetime.fromisoformat() can't handle RFC3339 timestamps directly (a "Z" suffix, or
+        # nanoseconds), but is far faster than dateparser once they're converted. Anything
+        # unexpected still goes through dateparser
+        match = cls.rfc3339_pattern.match(timestamp)
+        if match:
+            date, time_of_day, fraction, offset = match.groups()
+            return datetime.datetime.fromisoformat("{}T{}.{:0<6.6}{}".format(
+                date, time_of_day, fraction or "", "+00:00" if offset in "Zz" else offset))
+        return dateparser.parse(timestamp, settings={'RETURN_AS_TIMEZONE_AWARE': True})
+
+    def __parse_clusters(self, items: list) -> Iterator[Cluster]:
+        """
+        Convert cluster records returned by the UHC HTTP API into Cluster objects
+
+        :param items: (list) the "items" section of a cluster search response
+        :returns: (generator) a Cluster for each usable record
+        """
+        for c in items:
             try:
-                # The API returns RFC3339 timestamps. Python can't handle RFC3339 timestamps natively,
-                # so we have to use dateparser to produce a timezone-aware datetime object
-                creation_timestamp = dateparser.parse(c['creation_timestamp'],
-                                                    settings={'RETURN_AS_TIMEZONE_AWARE': True})
+                creation_timestamp = self.parse_timestamp(c['creation_timestamp'])
+
+                yield Cluster(c['id'], c['name'], c['external_id'], creation_timestamp)
 
-                cluster_list.append(Cluster(c['id'], c['name'], c['external_id'], creation_timestamp))
-            
             except KeyError as e:
                 self.logger.info("ExternalIDFailure:{}.".format(str(e)))
-
-        return cluster_list
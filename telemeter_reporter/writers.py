@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import csv
+import threading
+from abc import ABC, abstractmethod
+from string import Template
+from typing import List, TextIO
+
+import htmlmin
+
+
+class ReportWriter(ABC):
+    """
+    Writes a report to a text stream one row at a time, so that rows can be
+    written as soon as their cluster is done and a partial report is on disk
+    even if a run is interrupted. Subclasses implement the _write_*() methods
+    for their format
+    """
+
+    def __init__(self, stream: TextIO, headers: List[str]):
+        """
+        Instantiate a ReportWriter object and write the start of the report
+
+        :param stream: (file) a writable text stream
+        :param headers: (list) the header row of the report
+        """
+        self.stream = stream
+        self.headers = headers
+        self.rows = 0
+        self.__lock = threading.Lock()
+        with self.__lock:
+            self._write_start()
+            self.stream.flush()
+
+    def write_row(self, row: List[str]):
+        """
+        Write a row of the report. Safe to call from several threads at once
+
+        :param row: (list) the cluster name, followed by the formatted SLIs (see
+            SLIReporter.format_row())
+        """
+        with self.__lock:
+            self._write_row(row)
+            self.rows += 1
+            self.stream.flush()
+
+    def close(self, footer: str = None):
+        """
+        Write the end of the report. The stream itself is left open
+
+        :param footer: (str) optional footer to display on the report
+        """
+        with self.__lock:
+            self._write_end(footer)
+            self.stream.flush()
+
+    def _write_start(self):
+        """
+        Write everything that comes before the first row, e.g. the header row.
+        Does nothing unless overridden
+        """
+        pass
+
+    @abstractmethod
+    def _write_row(self, row: List[str]):
+        """
+        Write a single row
+
+        :param row: (list) see write_row()
+        """
+
+    def _write_end(self, footer: str = None):
+        """
+        Write everything that comes after the last row. Does nothing unless
+        overridden
+
+        :param footer: (str) see close()
+        """
+        pass
+
+
+class CSVReportWriter(ReportWriter):
+    """
+    Writes a report as CSV, one row at a time
+    """
+
+    def _write_start(self):
+        self.__writer = csv.writer(self.stream)
+        self.__writer.writerow(self.headers)
+
+    def _write_row(self, row: List[str]):
+        self.__writer.writerow(row)
+
+
+class HTMLReportWriter(ReportWriter):
+    """
+    Writes a report as an HTML page, one table row at a time. The page is
+    built from the same template as SLIReporter.format_report(), with rows
+    streamed in place of the ${table} placeholder
+    """
+
+    def __init__(self, stream: TextIO, headers: List[str], template: str, style: str,
+                 title: str = None, minify: bool = False):
+        """
+        Instantiate an HTMLReportWriter object and write the start of the page
+
+        :param stream: (file) a writable text stream
+        :param headers: (list) the header row of the report (may contain HTML)
+        :param template: (str) the HTML template of the page (see SLIReporter.html)
+        :param style: (str) the CSS to embed in the page
+        :param title: (str) optional title to display on the report
+        :param minify: (bool) if True, minify the HTML as it is written
+        :raises: (Exception) if the template has no ${table} (or $table)
+            placeholder
+        """
+        self.__parts = self.__split(template)
+        self.template = template
+        self.style = style
+        self.title = title
+        self.minify = minify
+        super().__init__(stream, headers)
+
+    @staticmethod
+    def __split(template: str) -> List[str]:
+        """
+        Split a template around its table placeholder. Placeholders are found
+        the same way string.Template would find them, so "${table}" and "$table"
+        both work, and an escaped "$$table" is left alone
+
+        :param template: (str) the HTML template of the page
+        :returns: (list) the template text before and after the placeholder
+        :raises: (Exception) if the template has no table placeholder
+        """
+        for match in Template.pattern.finditer(template):
+            if "table" in (match.group("named"), match.group("braced")):
+                return [template[:match.start()], template[match.end():]]
+        raise Exception("The HTML template has no ${table} placeholder, so there's nowhere to "
+                        "write the report to")
+
+    def __emit(self, markup: str):
+        """
+        Write (and optionally minify) a chunk of HTML
+
+        :param markup: (str) a self-contained chunk of HTML
+        """
+        if self.minify:
+            markup = htmlmin.minify(markup, remove_comments=True, remove_empty_space=True)
+        self.stream.write(markup)
+
+    def __render(self, part: str, footer: str = None) -> str:
+        """
+        Fill in the placeholders of part of the template
+
+        :param part: (str) the template text before or after the table placeholder
+        :param footer: (str) the footer, if known yet
+        :returns: (str) the rendered HTML
+        """
+        return Template(part).safe_substitute(style=self.style, title=self.title, footer=footer)
+
+    def _write_start(self):
+        cells = "".join("<th style=\"text-align: center;\">{}</th>".format(h)
+                        for h in self.headers)
+        self.__emit(self.__render(self.__parts[0]) +
+                    "<table>\n<thead>\n<tr>{}</tr>\n</thead>\n<tbody>\n".format(cells))
+
+    def _write_row(self, row: List[str]):
+        self.__emit("<tr>{}</tr>\n".format(
+            "".join("<td style=\"text-align: center;\">{}</td>".format(c) for c in row)))
+
+    def _write_end(self, footer: str = None):
+        self.__emit("</tbody>\n</table>" + self.__render(self.__parts[1], footer))
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import re
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from telemeter_reporter.adaptive import AdaptiveTelemeterClient
+from telemeter_reporter.cache import PartialStore
+from telemeter_reporter.reporter import SLIReporter
+from telemeter_reporter.uhc import Cluster
+
+
+class SubqueryTelemeter(object):
+    """
+    Stands in for TelemeterClient. Every query is treated as
+    sum_over_time((<expression>)[<N>d:10m]) and evaluated the way Prometheus 2.x
+    does: the subquery covers the closed range [time - N days, time], so a
+    step-aligned sample at either end of the range is included
+    """
+    step = 600
+
+    def __init__(self, expression=lambda t: 1):
+        """
+        :param expression: (callable) the value of the inner expression at a
+            point in time (epoch seconds). Default: always 1, e.g. a target that
+            is always up
+        """
+        self.expression = expression
+        self.queries = []
+        # The external_ids that batched queries return no series for
+        self.missing = set()
+
+    def custom_query(self, query: str, params: dict = None) -> list:
+        self.queries.append((query, params))
+        days = int(re.search(r"\[(\d+)d:10m\]", query).group(1))
+        end = int(params["time"])
+        start = end - days * 24 * 60 * 60
+        first = -(-start // self.step) * self.step
+        value = sum(self.expression(t) for t in range(first, end + 1, self.step))
+        batched = re.search(r"_id=~'([^']*)'", query)
+        ids = batched.group(1).split("|") if batched else [None]
+        return [{"metric": {"_id": i} if i else {}, "value": [end, str(value)]} for i in ids
+                if i not in self.missing]
+
+    def custom_query_range(self, query: str, start_time: int, end_time: int, step: int,
+                           params: dict = None) -> list:
+        """
+        Evaluates the query at every step as if it was an instant query, but
+        records it as a single range query
+        """
+        series = {}
+        for t in range(start_time, end_time + 1, step):
+            for sample in self.custom_query(query, {"time": str(t)}):
+                series.setdefault(sample["metric"].get("_id"), (sample["metric"], []))[1].append(
+                    sample["value"])
+            self.queries.pop()
+        self.queries.append((query, {"start": start_time, "end": end_time, "step": step}))
+        return [{"metric": metric, "values": values} for metric, values in series.values()]
+
+
+@pytest.fixture
+def make_reporter(tmp_path):
+    """
+    Build an SLIReporter that resolves its queries with a SubqueryTelemeter and
+    keeps its partial sums in a temporary directory
+    """
+
+    def make(rules: list, expression=lambda t: 1, duration: int = 7) -> SLIReporter:
+        config = {"api": {"telemeter": {}, "uhc": {}}, "cache": None,
+                  "global_vars": {"duration": duration}, "rules": rules}
+        reporter = SLIReporter(config, connect=False)
+        reporter.telemeter = SubqueryTelemeter(expression)
+        reporter.pc = AdaptiveTelemeterClient(reporter.telemeter, 1, metrics=reporter.metrics)
+        reporter.partials = PartialStore(str(tmp_path / "partials.sqlite"))
+        return reporter
+
+    return make
+
+
+@pytest.fixture
+def clusters():
+    created = datetime.now(timezone.utc) - timedelta(days=365)
+    return [Cluster("1", "cluster-1", "external-1", created),
+            Cluster("2", "cluster-2", "external-2", created)]
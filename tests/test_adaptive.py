@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+import time
+
+from telemeter_reporter.adaptive import AdaptiveTelemeterClient, AIMDLimit
+from telemeter_reporter.metrics import Metrics
+from telemeter_reporter.telemeter import QueryError
+
+
+class FlakyTelemeter(object):
+    """
+    Stands in for TelemeterClient, failing the first queries with a 503
+    """
+
+    def __init__(self, failures: int = 0, retry_after: float = None):
+        self.failures = failures
+        self.retry_after = retry_after
+
+    def custom_query(self, query: str, params: dict = None) -> list:
+        if self.failures:
+            self.failures -= 1
+            raise QueryError(503, b"overloaded", retry_after=self.retry_after)
+        return []
+
+
+def sample(metrics: Metrics, series: str) -> float:
+    return float(re.search(r"^telemeter_reporter_{} (\S+)$".format(re.escape(series)),
+                           metrics.render(), re.MULTILINE).group(1))
+
+
+def test_query_duration_excludes_backoff():
+    metrics = Metrics()
+    client = AdaptiveTelemeterClient(FlakyTelemeter(failures=1, retry_after=0.2), 1,
+                                     backoff=0, metrics=metrics)
+    assert client.custom_query("up", rule="api") == []
+    assert sample(metrics, 'query_duration_seconds_count{rule="api"}') == 2
+    assert sample(metrics, 'query_duration_seconds_sum{rule="api"}') < 0.1
+    assert sample(metrics, 'query_backoff_seconds_total{rule="api"}') == 0.2
+
+
+def test_query_duration_excludes_queueing():
+    metrics = Metrics()
+    client = AdaptiveTelemeterClient(FlakyTelemeter(), 1, metrics=metrics)
+    # Another query holds the only slot for a while
+    client.limit.acquire()
+    threading.Timer(0.2, client.limit.release).start()
+    client.custom_query("up", rule="api")
+    assert sample(metrics, 'query_queue_seconds_sum{rule="api"}') >= 0.15
+    assert sample(metrics, 'query_duration_seconds_sum{rule="api"}') < 0.1
+
+
+def test_limit_blocks_when_full():
+    limit = AIMDLimit(2)
+    limit.acquire()
+    assert limit.try_acquire()
+    assert not limit.try_acquire()
+    limit.release()
+    assert limit.try_acquire()
+
+
+def test_multiplicative_decrease():
+    limit = AIMDLimit(16, minimum=3, cooldown=60)
+    for _ in range(16):
+        limit.acquire()
+    limit.release(overloaded=True)
+    assert limit.limit == 8
+    # The rest of the same burst of failures doesn't count again within the cooldown
+    limit.release(overloaded=True)
+    assert limit.limit == 8
+    # Until the queries sent before the decrease have finished, no more can be sent
+    assert limit.in_flight == 14 and not limit.try_acquire()
+
+    limit.cooldown = 0
+    for _ in range(3):
+        limit.release(overloaded=True)
+    assert limit.limit == 3
+
+
+def test_additive_increase():
+    limit = AIMDLimit(16, cooldown=0)
+    limit.acquire()
+    limit.release(overloaded=True)
+    assert limit.limit == 8
+    # About one more slot for each round of (limit) successful queries
+    for _ in range(8):
+        limit.acquire()
+        limit.release()
+    assert int(limit.limit) == 8 and limit.limit > 8.9
+    for _ in range(9):
+        limit.acquire()
+        limit.release()
+    assert int(limit.limit) == 9
+
+    # But never beyond the initial limit
+    for _ in range(1000):
+        limit.acquire()
+        limit.release()
+    assert limit.limit == 16
+
+
+def test_client_backs_off_when_overloaded():
+    client = AdaptiveTelemeterClient(FlakyTelemeter(failures=1), 4, backoff=0)
+    client.custom_query("up")
+    assert client.retried == 1
+    # Halved by the 503, then grown a little by the successful retry
+    assert client.limit.limit == 2.5
+
+
+class SlowPrimaryTelemeter(object):
+    """
+    Stands in for TelemeterClient. Once armed, the next query blocks until
+    released, while any copy of it sent in the meantime answers right away
+    """
+
+    def __init__(self):
+        self.armed = False
+        self.release = threading.Event()
+        self.calls = 0
+
+    def custom_query(self, query: str, params: dict = None) -> list:
+        self.calls += 1
+        if self.armed:
+            self.armed = False
+            self.release.wait(5)
+            return ["primary"]
+        return ["hedge"]
+
+
+def test_slow_query_is_overtaken_by_its_hedge():
+    telemeter = SlowPrimaryTelemeter()
+    client = AdaptiveTelemeterClient(telemeter, 4, hedge_percentile=50)
+    client.min_latency_samples = 3
+    for _ in range(3):
+        client.custom_query("up")
+    assert client.hedges == 0
+
+    telemeter.armed = True
+    try:
+        assert client.custom_query("up") == ["hedge"]
+        assert client.hedges == 1 and telemeter.calls == 5
+        # The primary is still running, and holds its slot until it finishes, but it can't hold
+        # up the exit of the interpreter
+        assert client.limit.in_flight == 1
+        running = [t for t in threading.enumerate() if t.name == "hedge"]
+        assert running and all(t.daemon for t in running)
+    finally:
+        telemeter.release.set()
+    deadline = time.monotonic() + 5
+    while client.limit.in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Its late answer is thrown away
+    assert client.limit.in_flight == 0
+
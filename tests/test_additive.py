@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from telemeter_reporter.additive import AdditiveSLI
+from telemeter_reporter.cache import PartialStore
+
+MIDNIGHT = datetime(2026, 9, 1, tzinfo=timezone.utc)
+DAY = 24 * 60 * 60
+
+# Without "max", an overcount shows up as an SLI above 100%
+ADDITIVE_RULE = {"name": "etcd", "goal": 0.999,
+                 "query": "sum_over_time((up{${sel}})[${duration}d:10m]) / (${duration} * 144)",
+                 "additive": {"numerator": "sum_over_time((up{${sel}})[${duration}d:10m])",
+                              "denominator": 144}}
+
+
+def test_composes_windows():
+    placed = []
+    windows = [(1000, 1), (900, 1), (800, 2)]
+    sli = AdditiveSLI(placed.append, windows, denominator=144)
+    assert sli.missing_parts == [("numerator", w) for w in windows]
+    for (kind, window), value in zip(sli.missing_parts, (144, 72, None)):
+        sli.add((kind, window), value)
+    # The denominator is per day, so the two-day window counts twice, and a window without
+    # samples counts as zero
+    assert placed == [(144 + 72) / (144 * 4) * 100]
+
+
+def test_known_windows_and_store():
+    placed, stored = [], []
+    sli = AdditiveSLI(placed.append, [(1000, 1), (900, 1)], denominator=144,
+                      known={(900, 1): (144, 144)},
+                      store=lambda window, n, d: stored.append((window, n, d)))
+    assert sli.missing_parts == [("numerator", (1000, 1))]
+    sli.add(("numerator", (1000, 1)), 288)
+    assert placed == [(144 + 288) / 288 * 100]
+    # Only the newly resolved window is stored
+    assert stored == [((1000, 1), 288, 144)]
+
+
+def test_maximum_and_failure():
+    placed = []
+    AdditiveSLI(placed.append, [(1000, 1)], denominator=144, maximum=1,
+                known={(1000, 1): (150, 144)})
+    failed = AdditiveSLI(placed.append, [(1000, 1), (900, 1)], denominator=144)
+    failed.fail(("numerator", (1000, 1)))
+    failed.add(("numerator", (900, 1)), 144)
+    assert placed == [100, None]
+
+
+def test_min_exclusive():
+    placed = []
+    for known in ({(1000, 1): (0, 144)}, {(1000, 1): (None, 144)}, {(1000, 1): (72, 144)}):
+        AdditiveSLI(placed.append, [(1000, 1)], denominator=144, min_exclusive=0, known=known)
+    assert placed == [None, None, 50]
+
+
+def test_all_down_cluster_matches_filtered_query(make_reporter, clusters):
+    # The rule's query ends in "> 0", so a cluster that was never up has no SLI
+    rule = {**ADDITIVE_RULE, "additive": {**ADDITIVE_RULE["additive"], "min_exclusive": 0}}
+    for incremental, split in ((True, None), (False, 3)):
+        reporter = make_reporter([{**rule, "additive": {**rule["additive"], "split": split}}],
+                                 lambda t: 0)
+        report = reporter.generate_report(clusters[:1], query_time=MIDNIGHT,
+                                          incremental=incremental)
+        assert report.get_sli("external-1", "etcd") is None
+
+    # Without it, the cluster is reported as 0%
+    reporter = make_reporter([ADDITIVE_RULE], lambda t: 0)
+    report = reporter.generate_report(clusters[:1], query_time=MIDNIGHT, incremental=True)
+    assert report.get_sli("external-1", "etcd") == 0
+
+
+def test_queried_denominator():
+    placed = []
+    sli = AdditiveSLI(placed.append, [(1000, 1)])
+    assert sli.missing_parts == [("numerator", (1000, 1)), ("denominator", (1000, 1))]
+    sli.add(("numerator", (1000, 1)), None)
+    sli.add(("denominator", (1000, 1)), 0)
+    assert placed == [None]
+
+
+def test_partial_store_evicts_old_windows(tmp_path):
+    path = str(tmp_path / "partials.sqlite")
+    today = int(time.time()) // DAY * DAY
+    store = PartialStore(path, ttl=30)
+    for day in (0, 1, 29, 31, 60):
+        store.put("external-1", "fingerprint", (today - day * DAY, 1), 144, 144)
+    store.close()
+
+    store = PartialStore(path, ttl=30)
+    windows = [(today - day * DAY, 1) for day in range(61)]
+    assert sorted(store.get("external-1", "fingerprint", windows)) == \
+        [(today - 29 * DAY, 1), (today - DAY, 1), (today, 1)]
+    # Only the requested windows are returned
+    assert list(store.get("external-1", "fingerprint", windows[1:2])) == [(today - DAY, 1)]
+    assert store.get("external-1", "fingerprint", []) == {}
+
+
+def test_incremental_days_dont_share_boundary_samples(make_reporter, clusters):
+    reporter = make_reporter([ADDITIVE_RULE])
+    report = reporter.generate_report(clusters[:1], query_time=MIDNIGHT, incremental=True)
+    assert report.get_sli("external-1", "etcd") == 100
+
+    # Seven daily partial sums of an always-up series add up to exactly one sample per 10 minutes
+    windows = [(int(MIDNIGHT.timestamp()) - day * DAY, 1) for day in range(7)]
+    fingerprints = {row[0] for row in reporter.partials._db.execute(
+        "SELECT fingerprint FROM partials")}
+    assert len(fingerprints) == 1
+    known = reporter.partials.get("external-1", fingerprints.pop(), windows)
+    assert sum(numerator for numerator, _ in known.values()) == 1008
+    assert sum(denominator for _, denominator in known.values()) == 1008
+
+
+def test_incremental_matches_half_open_range(make_reporter, clusters):
+    # Down for 10 minutes of every hour (but up at midnight), and for all of one day
+    def up(t):
+        return 0 if 600 <= t % 3600 < 1200 or MIDNIGHT.timestamp() - 3 * DAY <= t < \
+                    MIDNIGHT.timestamp() - 2 * DAY else 1
+
+    reporter = make_reporter([ADDITIVE_RULE], up)
+    report = reporter.generate_report(clusters[:1], query_time=MIDNIGHT + timedelta(hours=5),
+                                      incremental=True)
+    end = int(MIDNIGHT.timestamp())
+    expected = sum(up(t) for t in range(end - 7 * DAY, end, 600)) / 1008 * 100
+    assert report.get_sli("external-1", "etcd") == expected
+
+    # A second run is answered from the partial sums alone
+    queries = len(reporter.telemeter.queries)
+    again = reporter.generate_report(clusters[:1], query_time=MIDNIGHT, incremental=True)
+    assert again.get_sli("external-1", "etcd") == expected
+    assert len(reporter.telemeter.queries) == queries
+
+
+def test_split_windows_dont_share_boundary_samples(make_reporter, clusters):
+    def up(t):
+        return 0 if 600 <= t % 3600 < 1200 else 1
+
+    split_rule = {**ADDITIVE_RULE, "additive": {**ADDITIVE_RULE["additive"], "split": 3}}
+    reporter = make_reporter([split_rule], up)
+    # A 10-minute-aligned report time, like a cron run at midnight or a backfill date
+    report = reporter.generate_report(clusters[:1], query_time=MIDNIGHT)
+    end = int(MIDNIGHT.timestamp())
+    assert report.get_sli("external-1", "etcd") == \
+        sum(up(t) for t in range(end - 7 * DAY, end, 600)) / 1008 * 100
+
+    # Windows of 3, 3 and 1 days, each evaluated just before it ends
+    assert sorted((re.search(r"\[(\d+)d", query).group(1), int(params["time"])) for query, params
+                  in reporter.telemeter.queries) == [("1", end - 6 * DAY - 1),
+                                                     ("3", end - 3 * DAY - 1), ("3", end - 1)]
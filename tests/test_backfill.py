@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from telemeter_reporter.uhc import Cluster
+
+START = datetime(2026, 9, 1, tzinfo=timezone.utc)
+DAY = 24 * 60 * 60
+RULE = {"name": "api", "goal": 0.99,
+        "query": "sum ${by} (sum_over_time((up{${sel}})[${duration}d:10m])) / 1008"}
+
+
+def up(t):
+    # Down for the first hour of every day
+    return 0 if t % DAY < 3600 else 1
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_backfill_matches_instant_reports(make_reporter, clusters, batch):
+    rule = {**RULE, "batch": batch}
+    reporter = make_reporter([rule], up)
+    reports = reporter.generate_backfill(clusters, START, START + timedelta(days=2, hours=12),
+                                         timedelta(days=1), batch=batch)
+    assert sorted(reports) == [START, START + timedelta(days=1), START + timedelta(days=2)]
+    # A range query per cluster (or one for the whole batch), covering every report time
+    assert [params for _, params in reporter.telemeter.queries] == \
+        [{"start": int(START.timestamp()), "end": int(START.timestamp()) + 2 * DAY + 12 * 3600,
+          "step": DAY}] * (1 if batch else 2)
+
+    for report_time, report in reports.items():
+        expected = make_reporter([rule], up).generate_report(clusters, query_time=report_time)
+        assert report.time == report_time
+        assert report.row(0) == expected.row(0) and report.row(1) == expected.row(1)
+
+
+def test_backfill_young_and_future_clusters(make_reporter, clusters):
+    young = Cluster("3", "young", "young-1", START - timedelta(days=2, hours=1))
+    future = Cluster("4", "future", "future-1", START + timedelta(hours=12))
+    reporter = make_reporter([RULE], up)
+    reports = reporter.generate_backfill(clusters + [young, future], START,
+                                         START + timedelta(days=1), timedelta(days=1))
+
+    # Not reported on before it was created
+    assert "future-1" not in reports[START].external_ids
+    assert "future-1" in reports[START + timedelta(days=1)].external_ids
+    # Too young for the full duration, so queried with an adjusted duration at each report time
+    for report_time, days in ((START, 2), (START + timedelta(days=1), 3)):
+        assert reports[report_time].clusters[reports[report_time].external_ids.index(
+            "young-1")] == "young*"
+        assert any("young-1" in query and "[{}d:10m]".format(days) in query and
+                   params.get("time") == str(int(report_time.timestamp()))
+                   for query, params in reporter.telemeter.queries)
+
+
+@pytest.mark.parametrize("start, end, step", [
+    (START, START + timedelta(days=1), timedelta(0)),
+    (START + timedelta(days=1), START, timedelta(days=1))])
+def test_backfill_rejects_invalid_ranges(make_reporter, clusters, start, end, step):
+    with pytest.raises(Exception, match="Invalid backfill"):
+        make_reporter([RULE]).generate_backfill(clusters, start, end, step)
+
+
+def test_duration_warnings_show_the_report_time(make_reporter, caplog):
+    young = Cluster("3", "young", "young-1", START - timedelta(days=2, hours=1))
+    reporter = make_reporter([{**RULE, "duration": 7}], up)
+    reporter.config["global_vars"] = {}
+    reporter.generate_backfill([young], START, START, timedelta(days=1))
+    assert "'young' was created only 2 days before {}, so capping 'api' query duration " \
+           "at 2d".format(START) in caplog.text
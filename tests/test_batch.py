@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import re
+from datetime import datetime, timedelta, timezone
+
+from telemeter_reporter.journal import ReportJournal
+from telemeter_reporter.uhc import Cluster
+
+QUERY_TIME = datetime(2026, 9, 1, tzinfo=timezone.utc)
+RULE = {"name": "api", "goal": 0.99, "batch": True,
+        "query": "sum ${by} (sum_over_time((up{${sel}})[${duration}d:10m])) / 1008"}
+ADDITIVE_RULE = {"name": "etcd", "goal": 0.999, "batch": True,
+                 "query": "sum ${by} (sum_over_time((up{${sel}})[${duration}d:10m])) / "
+                          "(${duration} * 144)",
+                 "additive": {"numerator": "sum ${by} (sum_over_time((up{${sel}})"
+                                           "[${duration}d:10m]))",
+                              "denominator": 144}}
+
+
+def selected(query: str) -> list:
+    return re.search(r"_id=~'([^']*)'", query).group(1).split("|")
+
+
+def test_batched_query_is_split_per_cluster(make_reporter, clusters):
+    unbatched = make_reporter([RULE]).generate_report(clusters, query_time=QUERY_TIME)
+    reporter = make_reporter([RULE])
+    report = reporter.generate_report(clusters, query_time=QUERY_TIME, batch=True)
+
+    [(query, params)] = reporter.telemeter.queries
+    assert "_id=~'external-1|external-2'" in query and "sum by (_id) (" in query
+    assert params["time"] == str(int(QUERY_TIME.timestamp()))
+    assert report.row(0) == unbatched.row(0) and report.row(1) == unbatched.row(1)
+
+
+def test_missing_series_fails_only_its_cluster(make_reporter, clusters):
+    reporter = make_reporter([RULE])
+    reporter.telemeter.missing = {"external-2"}
+    report = reporter.generate_report(clusters, query_time=QUERY_TIME, batch=True)
+    assert report.get_sli("external-1", "api") is not None
+    assert report.get_sli("external-2", "api") is None
+    assert 'query_failures_total{reason="no_result",rule="api"} 1' in reporter.metrics.render()
+
+
+def test_young_clusters_share_queries_by_adjusted_duration(make_reporter, clusters):
+    young = [Cluster(str(i), "young-{}".format(i), "young-{}".format(i),
+                     QUERY_TIME - timedelta(days=days, hours=1))
+             for i, days in enumerate((3, 5, 3))]
+    reporter = make_reporter([RULE])
+    report = reporter.generate_report(clusters + young, query_time=QUERY_TIME, batch=True)
+
+    batches = sorted((re.search(r"\[(\d+)d", query).group(1), selected(query))
+                     for query, _ in reporter.telemeter.queries)
+    assert batches == [("3", ["young-0", "young-2"]), ("5", ["young-1"]),
+                       ("7", ["external-1", "external-2"])]
+    assert report.clusters[2:] == ["young-0*", "young-1*", "young-2*"]
+    # A capped duration covers fewer samples
+    assert report.get_sli("young-0", "api") < report.get_sli("young-1", "api") < \
+        report.get_sli("external-1", "api")
+
+
+def test_batched_incremental_report(make_reporter, clusters):
+    reporter = make_reporter([RULE, ADDITIVE_RULE])
+    report = reporter.generate_report(clusters, query_time=QUERY_TIME, batch=True,
+                                      incremental=True)
+    # One query for the plain rule, and one per day for the additive one
+    assert len(reporter.telemeter.queries) == 1 + 7
+    assert all(selected(query) == ["external-1", "external-2"]
+               for query, _ in reporter.telemeter.queries)
+    assert report.get_sli("external-1", "etcd") == report.get_sli("external-2", "etcd") == 100
+    assert report.row(0) == report.row(1)
+
+
+def test_batched_report_skips_journaled_results(make_reporter, clusters, tmp_path):
+    path = str(tmp_path / "run.journal")
+    journal = ReportJournal(path)
+    journal.begin(QUERY_TIME, make_reporter([RULE]).generate_report(
+        [], query_time=QUERY_TIME).fingerprint)
+    journal.record("external-1", "api", 99.5)
+    journal.close()
+
+    reporter = make_reporter([RULE])
+    report = reporter.generate_report(clusters, query_time=QUERY_TIME, batch=True,
+                                      journal=ReportJournal(path, resume=True))
+    [(query, _)] = reporter.telemeter.queries
+    assert selected(query) == ["external-2"]
+    assert report.get_sli("external-1", "api") == 99.5
+    assert report.get_sli("external-2", "api") is not None
+
+
+def test_long_selectors_are_chunked(make_reporter):
+    created = QUERY_TIME - timedelta(days=365)
+    fleet = [Cluster(str(i), "cluster-{}".format(i), "external-{}".format(i), created)
+             for i in range(25)] + \
+        [Cluster("y{}".format(i), "young-{}".format(i), "young-{}".format(i),
+                 QUERY_TIME - timedelta(days=3, hours=1)) for i in range(5)]
+    unbatched = make_reporter([RULE]).generate_report(fleet, query_time=QUERY_TIME)
+    reporter = make_reporter([RULE])
+    reporter.batch_selector_length = 60
+    report = reporter.generate_report(fleet, query_time=QUERY_TIME, batch=True)
+
+    chunks = [selected(query) for query, _ in reporter.telemeter.queries]
+    assert len(chunks) > 2
+    assert all(len("_id=~'{}'".format("|".join(chunk))) <= 60 for chunk in chunks)
+    assert sorted(i for chunk in chunks for i in chunk) == sorted(c.external_id for c in fleet)
+    for index in range(len(fleet)):
+        assert report.row(index) == unbatched.row(index)
+
+
+def test_full_batches_are_sent_while_clusters_stream_in(make_reporter):
+    created = QUERY_TIME - timedelta(days=365)
+    reporter = make_reporter([RULE])
+    reporter.batch_size = 3
+    sent = []
+
+    def streamed():
+        for i in range(7):
+            # The number of queries sent before each cluster arrived
+            sent.append(len(reporter.telemeter.queries))
+            yield Cluster(str(i), "cluster-{}".format(i), "external-{}".format(i), created)
+
+    reporter.generate_report(streamed(), query_time=QUERY_TIME, batch=True)
+    assert sent == [0, 0, 0, 1, 1, 1, 2]
+    assert [len(selected(query)) for query, _ in reporter.telemeter.queries] == [3, 3, 1]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import time
+from datetime import datetime, timedelta, timezone
+
+from telemeter_reporter.cache import QueryCache, fingerprint
+
+QUERY_TIME = datetime(2026, 9, 1, tzinfo=timezone.utc)
+RULE = {"name": "api", "goal": 0.99,
+        "query": "sum_over_time((up{${sel}})[${duration}d:10m]) / 1008"}
+RESULT = [{"metric": {"_id": "external-1"}, "value": [0, "1008"]}]
+
+
+def test_hit_and_miss(tmp_path):
+    cache = QueryCache(str(tmp_path / "queries.sqlite"))
+    assert cache.get("up", 100) is None
+    cache.put("up", 100, RESULT)
+    assert cache.get("up", 100) == RESULT
+    # The evaluation time is part of the key
+    assert cache.get("up", 101) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    cache.close()
+    assert QueryCache(str(tmp_path / "queries.sqlite")).get("up", 100) == RESULT
+
+
+def test_expired_entries_are_evicted(tmp_path, monkeypatch):
+    path = str(tmp_path / "queries.sqlite")
+    cache = QueryCache(path, ttl=1)
+    cache.put("old", 100, RESULT)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 2 * 24 * 60 * 60)
+    cache.put("new", 100, RESULT)
+    assert cache.get("old", 100) is None
+    cache.close()
+
+    cache = QueryCache(path, ttl=1)
+    assert cache._db.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 1
+    assert cache.get("new", 100) == RESULT
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    path = str(tmp_path / "queries.sqlite")
+    clock = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    cache = QueryCache(path, max_entries=2)
+    for query in ("a", "b", "c"):
+        clock[0] += 1
+        cache.put(query, 100, RESULT)
+    clock[0] += 1
+    assert cache.get("a", 100) == RESULT
+    cache.evict()
+    assert cache.get("b", 100) is None
+    assert cache.get("a", 100) == cache.get("c", 100) == RESULT
+
+
+def test_reports_reuse_settled_results(make_reporter, clusters, tmp_path):
+    reporter = make_reporter([RULE])
+    reporter.cache = QueryCache(str(tmp_path / "queries.sqlite"))
+    first = reporter.generate_report(clusters, query_time=QUERY_TIME)
+    second = reporter.generate_report(clusters, query_time=QUERY_TIME)
+    assert len(reporter.telemeter.queries) == 2
+    assert second.row(0) == first.row(0) and second.row(1) == first.row(1)
+
+    # Recent results may still change, so they aren't cached
+    recent = datetime.now(timezone.utc) - timedelta(minutes=10)
+    reporter.generate_report(clusters, query_time=recent)
+    reporter.generate_report(clusters, query_time=recent)
+    assert len(reporter.telemeter.queries) == 6
+
+
+def test_fingerprint_is_stable():
+    rules = [{"name": "api", "goal": 0.99, "query": "up{${sel}}"}]
+    # Independent of dict ordering, but not of values
+    assert fingerprint(rules, {"duration": 7, "x": 1}, QUERY_TIME) == \
+        fingerprint([{"query": "up{${sel}}", "goal": 0.99, "name": "api"}],
+                    {"x": 1, "duration": 7}, QUERY_TIME)
+    assert fingerprint(rules, {"duration": 7}) != fingerprint(rules, {"duration": 28})
+    assert fingerprint(rules, QUERY_TIME) != fingerprint(rules, QUERY_TIME + timedelta(days=1))
+    # Fingerprints are stored on disk, so they mustn't change between versions
+    assert fingerprint("up", 144, 1) == \
+        "05573ed90f9c48decff6db44555ff9254c83f9f84caea2fe06b6e88d08b7fc0c"
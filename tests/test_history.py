@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from telemeter_reporter.history import SLIHistory
+from telemeter_reporter.report import SLIReport
+
+FINGERPRINTS = {"api": "settings"}
+# Recent enough to be kept, and at the start of a (24-hour) snapshot period
+MIDNIGHT = (datetime.now(timezone.utc) - timedelta(days=10)).replace(hour=0, minute=0, second=0,
+                                                                      microsecond=0)
+
+
+def report(*slis):
+    result = SLIReport(["api"], [99.0])
+    for index, sli in enumerate(slis):
+        result.add_cluster("cluster-{}".format(index), "external-{}".format(index))
+        result.set("external-{}".format(index), "api", sli)
+    return result
+
+
+@pytest.fixture
+def history(tmp_path):
+    return SLIHistory(str(tmp_path / "history.sqlite"))
+
+
+def snapshots(history):
+    return history._db.execute("SELECT external_id, time, sli FROM slis ORDER BY "
+                               "external_id, time").fetchall()
+
+
+def test_latest_report_of_a_period_is_kept(history):
+    history.record(report(99.0, 99.0), FINGERPRINTS, MIDNIGHT + timedelta(hours=8))
+    history.record(report(98.0, None), FINGERPRINTS, MIDNIGHT + timedelta(hours=16))
+    # An older report of the same period (e.g. a late backfill) doesn't replace a newer one
+    history.record(report(97.0, 97.0), FINGERPRINTS, MIDNIGHT + timedelta(hours=12))
+    # external-1 was unknown in the latest report, so it keeps its latest known SLI
+    assert snapshots(history) == [
+        ("external-0", int((MIDNIGHT + timedelta(hours=16)).timestamp()), 98.0),
+        ("external-1", int((MIDNIGHT + timedelta(hours=12)).timestamp()), 97.0)]
+
+    # Reports of the next period are kept separately
+    history.record(report(96.0, 96.0), FINGERPRINTS, MIDNIGHT + timedelta(days=1))
+    assert len(snapshots(history)) == 4
+
+
+def test_trend(history):
+    noon = MIDNIGHT + timedelta(hours=12)
+    for days, sli in ((3, 95.0), (2, 97.0), (1, 99.0)):
+        history.record(report(sli, sli), FINGERPRINTS, noon - timedelta(days=days))
+    # Part of the same run as the report (e.g. another shard), not an earlier report
+    history.record(report(90.0, 90.0), FINGERPRINTS, noon - timedelta(minutes=5))
+    # A changed rule isn't compared to its old definition
+    history.record(report(50.0, 50.0), {"api": "other settings"}, noon - timedelta(days=1))
+
+    current = report(98.0, 100.0)
+    current.add_cluster("cluster-2", "external-2")
+    current.set("external-2", "api", 99.9)
+    previous, minimum = history.trend(current, FINGERPRINTS, noon, 7)
+    assert previous.column("api") == [99.0, 99.0]
+    assert previous.get_sli("external-2", "api") is None
+    assert minimum.column("api") == [90.0, 90.0, 99.9]
+
+    # Only the last days are looked at
+    previous, minimum = history.trend(current, FINGERPRINTS, noon - timedelta(hours=23), 1)
+    assert previous.column("api") == [99.0, 99.0]
+    assert minimum.column("api") == [98.0, 99.0, 99.9]
+
+
+def test_evict(tmp_path):
+    history = SLIHistory(str(tmp_path / "history.sqlite"), ttl=5)
+    history.record(report(99.0), FINGERPRINTS, datetime.now(timezone.utc) - timedelta(days=6))
+    history.record(report(98.0), FINGERPRINTS, datetime.now(timezone.utc) - timedelta(days=4))
+    history.evict()
+    assert [sli for _, _, sli in snapshots(history)] == [98.0]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import re
+from datetime import datetime, timedelta, timezone
+
+from telemeter_reporter.inventory import ClusterIndex
+from telemeter_reporter.uhc import Cluster
+
+NOW = datetime.now(timezone.utc)
+
+
+class FakeUHC(object):
+    """
+    Stands in for UnifiedHybridClient, searching a mutable list of clusters.
+    Understands the "creation_timestamp >= '...'" condition of incremental syncs
+    """
+
+    def __init__(self, clusters: list):
+        self.clusters = clusters
+        self.queries = []
+
+    def search_clusters(self, query: str) -> list:
+        self.queries.append(query)
+        since = re.search(r"creation_timestamp >= '([^']+)'", query)
+        if since is None:
+            return list(self.clusters)
+        since = datetime.strptime(since.group(1), "%Y-%m-%dT%H:%M:%SZ").replace(
+            tzinfo=timezone.utc)
+        return [c for c in self.clusters if c.creation_timestamp >= since]
+
+
+def cluster(i: int, age: timedelta, external_id: str = None) -> Cluster:
+    return Cluster(str(i), "cluster-{}".format(i),
+                   "external-{}".format(i) if external_id is None else external_id, NOW - age)
+
+
+def test_incremental_sync(tmp_path):
+    uhc = FakeUHC([cluster(1, timedelta(days=30)), cluster(2, timedelta(days=10)),
+                   cluster(3, timedelta(hours=1), external_id="")])
+    index = ClusterIndex(str(tmp_path / "clusters.sqlite"))
+    assert [c.id for c in index.search(uhc, "managed = 't'")] == ["1", "2"]
+    assert uhc.queries == ["managed = 't'"]
+
+    # A new cluster, and one that has been installed since the last sync
+    uhc.clusters[2] = cluster(3, timedelta(hours=1))
+    uhc.clusters.append(cluster(4, timedelta(minutes=5)))
+    found = list(index.search(uhc, "managed = 't'",
+                              created_before=NOW - timedelta(minutes=30)))
+    assert [c.id for c in found] == ["1", "2", "3"]
+    assert found[0] == uhc.clusters[0]
+    # Only clusters created since the last sync (less the lookback) were asked for
+    assert uhc.queries[1].startswith("(managed = 't') and creation_timestamp >= '")
+    assert [c.id for c in index.search(uhc, "managed = 't'")] == ["1", "2", "3", "4"]
+
+
+def test_full_sync_prunes_deleted_clusters(tmp_path):
+    uhc = FakeUHC([cluster(1, timedelta(days=30)), cluster(2, timedelta(days=10))])
+    path = str(tmp_path / "clusters.sqlite")
+    index = ClusterIndex(path)
+    list(index.search(uhc, "managed = 't'"))
+    list(index.search(uhc, "managed = 'f'"))
+
+    # Deletions and renames aren't noticed by incremental syncs
+    del uhc.clusters[0]
+    uhc.clusters[0] = uhc.clusters[0]._replace(name="renamed")
+    assert [c.name for c in index.search(uhc, "managed = 't'")] == ["cluster-1", "cluster-2"]
+
+    index.full_sync_interval = 0
+    assert [c.name for c in index.search(uhc, "managed = 't'")] == ["renamed"]
+    # The deleted cluster is still matched by the other query until its next full sync
+    assert index._db.execute("SELECT COUNT(*) FROM clusters").fetchone()[0] == 2
+    list(index.search(uhc, "managed = 'f'"))
+    assert index._db.execute("SELECT COUNT(*) FROM clusters").fetchone()[0] == 1
+
+    index.close()
+    index = ClusterIndex(path)
+    assert [c.name for c in index.search(uhc, "managed = 't'")] == ["renamed"]
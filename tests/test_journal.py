@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+from telemeter_reporter.journal import ReportJournal
+
+QUERY_TIME = datetime(2026, 9, 1, tzinfo=timezone.utc)
+RULE = {"name": "api", "goal": 0.99,
+        "query": "sum_over_time((up{${sel}})[${duration}d:10m]) / 1008"}
+ADDITIVE_RULE = {"name": "etcd", "goal": 0.999,
+                 "query": "sum_over_time((up{${sel}})[${duration}d:10m]) / (${duration} * 144)",
+                 "additive": {"numerator": "sum_over_time((up{${sel}})[${duration}d:10m])",
+                              "denominator": 144}}
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "run.journal")
+    journal = ReportJournal(path)
+    started = journal.begin(None, "settings")
+    journal.record("external-1", "api", 99.5)
+    journal.record("external-2", "api", None)
+    journal.close()
+    # A line cut off by a killed run is skipped
+    with open(path, "a") as f:
+        f.write('{"e": "external-3", "r": "ap')
+
+    resumed = ReportJournal(path, resume=True)
+    assert resumed.begin(None, "settings") == started
+    assert resumed.get("external-1", "api") == (True, 99.5)
+    # A failed result is retried
+    assert resumed.get("external-2", "api") == (False, None)
+    assert resumed.get("external-3", "api") == (False, None)
+
+    # Results recorded after resuming are kept too
+    resumed.record("external-3", "api", 98.0)
+    resumed.close()
+    again = ReportJournal(path, resume=True)
+    assert again.begin(started, "settings") == started
+    assert again.get("external-3", "api") == (True, 98.0)
+
+
+@pytest.mark.parametrize("query_time, fingerprint", [
+    (QUERY_TIME, "other settings"),
+    (datetime(2026, 9, 2, tzinfo=timezone.utc), "settings")])
+def test_no_resume_on_mismatch(tmp_path, query_time, fingerprint):
+    path = str(tmp_path / "run.journal")
+    journal = ReportJournal(path)
+    journal.begin(QUERY_TIME, "settings")
+    journal.record("external-1", "api", 99.5)
+    journal.close()
+
+    resumed = ReportJournal(path, resume=True)
+    assert resumed.begin(query_time, fingerprint) == query_time
+    assert resumed.get("external-1", "api") == (False, None)
+    resumed.close()
+    # The mismatched journal was replaced by a new one
+    assert ReportJournal(path, resume=True).begin(None, fingerprint) == query_time
+
+
+def test_resumed_report_skips_known_results(make_reporter, clusters, tmp_path):
+    path = str(tmp_path / "run.journal")
+    reporter = make_reporter([RULE])
+    journal = ReportJournal(path)
+    first = reporter.generate_report(clusters, query_time=QUERY_TIME, journal=journal)
+    journal.close()
+    assert len(reporter.telemeter.queries) == 2
+
+    # Forget one cluster's result, as if the run was interrupted before it arrived
+    with open(path) as f:
+        lines = [line for line in f if "external-2" not in line]
+    with open(path, "w") as f:
+        f.writelines(lines)
+
+    reporter = make_reporter([RULE])
+    journal = ReportJournal(path, resume=True)
+    second = reporter.generate_report(clusters, query_time=None, journal=journal)
+    assert second.time == QUERY_TIME
+    assert [params["time"] for _, params in reporter.telemeter.queries] == \
+        [str(int(QUERY_TIME.timestamp()))]
+    assert second.row(0) == first.row(0) and second.row(1) == first.row(1)
+
+
+def test_resumed_report_retries_failed_results(make_reporter, clusters, tmp_path):
+    path = str(tmp_path / "run.journal")
+    reporter = make_reporter([RULE])
+    journal = ReportJournal(path)
+    journal.begin(QUERY_TIME, reporter.generate_report([], query_time=QUERY_TIME).fingerprint)
+    journal.record("external-1", "api", 99.5)
+    journal.record("external-2", "api", None)
+    journal.close()
+
+    journal = ReportJournal(path, resume=True)
+    report = reporter.generate_report(clusters, query_time=QUERY_TIME, journal=journal)
+    journal.close()
+    assert [query for query, _ in reporter.telemeter.queries] == [
+        RULE["query"].replace("${sel}", "_id='external-2'").replace("${duration}", "7")]
+    assert report.get_sli("external-2", "api") is not None
+    # The retried result replaces the failure in the journal
+    again = ReportJournal(path, resume=True)
+    again.begin(QUERY_TIME, report.fingerprint)
+    assert again.get("external-2", "api") == (True, report.get_sli("external-2", "api"))
+
+
+def test_interrupted_report_keeps_the_original_error(make_reporter, clusters):
+    reporter = make_reporter([RULE])
+    reporter.concurrency = 4
+    release = threading.Event()
+    expression = reporter.telemeter.expression
+    reporter.telemeter.expression = lambda t: release.wait() and expression(t)
+
+    def interrupted():
+        yield from clusters
+        raise KeyboardInterrupt
+
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            reporter.generate_report(interrupted(), query_time=QUERY_TIME)
+    finally:
+        release.set()
+
+
+def test_resumed_batch_report_with_additive_rule(make_reporter, clusters, tmp_path):
+    path = str(tmp_path / "run.journal")
+    rules = [{**RULE, "batch": True}, {**ADDITIVE_RULE, "batch": True}]
+    reporter = make_reporter(rules)
+    journal = ReportJournal(path)
+    first = reporter.generate_report(clusters, query_time=QUERY_TIME, batch=True,
+                                     incremental=True, journal=journal)
+    journal.close()
+    assert first.row(0) == first.row(1) and first.get_sli("external-2", "etcd") == 100
+
+    # Forget the second rule of one cluster, so its first rule comes from the journal
+    with open(path) as f:
+        lines = [line for line in f if not ("external-2" in line and "etcd" in line)]
+    with open(path, "w") as f:
+        f.writelines(lines)
+
+    # Without the partial sums of the first run
+    reporter = make_reporter(rules)
+    reporter.partials = None
+    journal = ReportJournal(path, resume=True)
+    second = reporter.generate_report(clusters, query_time=QUERY_TIME, batch=True,
+                                      incremental=True, journal=journal)
+    assert second.row(0) == first.row(0) and second.row(1) == first.row(1)
+    # Only the forgotten days of the additive rule are queried again
+    assert len(reporter.telemeter.queries) == 7
+    assert all("_id=~'external-2'" in query for query, _ in reporter.telemeter.queries)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import math
+
+from telemeter_reporter.report import SLIReport
+
+
+def test_clusters_sharing_a_name_keep_their_own_rows():
+    recorded = []
+    report = SLIReport(["a", "b"], [99.0, 99.5],
+                       on_set=lambda r, index, rule, sli: recorded.append(
+                           (r.external_ids[index], rule, sli)))
+    assert report.add_cluster("prod", "external-1") == 0
+    assert report.add_cluster("prod", "external-2") == 1
+    assert report.add_cluster("prod", "external-1") == 0
+    report.set("external-1", "a", 99.9)
+    report.set("external-2", "a", 42.0)
+    report.set("external-2", "b", None)
+
+    assert report.clusters == ["prod", "prod"]
+    assert report.get_sli("external-1", "a") == 99.9
+    assert report.get_sli("external-2", "a") == 42.0
+    assert report.get_sli("external-2", "b") is None
+    assert recorded == [("external-1", "a", 99.9), ("external-2", "a", 42.0),
+                        ("external-2", "b", None)]
+    assert list(report.to_dict()) == ["prod", "prod (external-2)"]
+
+
+def test_json_round_trip():
+    report = SLIReport(["a", "b"], [99.0, 99.5])
+    report.add_cluster("one", "external-1")
+    report.add_cluster("one", "external-2")
+    report.set("external-1", "a", 100.0)
+    report.set("external-2", "b", 98.0)
+
+    loaded = SLIReport.from_json(report.to_json())
+    assert loaded.clusters == ["one", "one"]
+    assert loaded.external_ids == ["external-1", "external-2"]
+    assert loaded.row(0) == [100.0, None]
+    assert loaded.row(1) == [None, 98.0]
+
+
+def test_status_and_summary():
+    report = SLIReport(["a"], [99.0])
+    for i, sli in enumerate([98.0, 99.005, 99.5, None]):
+        report.add_cluster("c{}".format(i), "e{}".format(i))
+        report.set("e{}".format(i), "a", sli)
+    assert list(report.status(0.01)) == [SLIReport.DANGER, SLIReport.CAUTION, SLIReport.SUCCESS,
+                                         SLIReport.UNKNOWN]
+    summary = report.summary(percentiles=(50,))["a"]
+    assert (summary["clusters"], summary["missing"], summary["min"]) == (3, 1, 98.0)
+    assert math.isclose(summary["compliant"], 200 / 3)
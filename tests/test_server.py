@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer
+
+import pytest
+import requests
+
+from telemeter_reporter.metrics import Metrics
+from telemeter_reporter.report import SLIReport
+from telemeter_reporter.server import ReportServer
+
+REPORT_TIME = datetime(2026, 9, 1, tzinfo=timezone.utc)
+
+
+def report(sli: float, time: datetime = REPORT_TIME) -> SLIReport:
+    report = SLIReport(["api"], [99.0])
+    report.time = time
+    report.add_cluster("cluster-1", "external-1")
+    report.set("external-1", "api", sli)
+    return report
+
+
+@pytest.fixture
+def served():
+    """
+    Serve a ReportServer (without its refresh loop) on a free local port
+    """
+    renders = []
+
+    def render(r: SLIReport, fmt: str) -> str:
+        renders.append(fmt)
+        return "{}: {} at {}".format(fmt, r.get_sli("external-1", "api"), r.time.date())
+
+    metrics = Metrics()
+    metrics.set("clusters", 1)
+    server = ReportServer(lambda: None, render, ["html", "csv"], 60, metrics=metrics)
+    # noinspection PyProtectedMember
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), server._ReportServer__handler())
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    url = "http://127.0.0.1:{}".format(httpd.server_address[1])
+    try:
+        yield server, url, renders
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_unavailable_until_the_first_report(served):
+    server, url, _ = served
+    assert requests.get(url + "/healthz").status_code == 503
+    response = requests.get(url + "/")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "60"
+
+    server.update(report(99.5))
+    assert requests.get(url + "/healthz").status_code == 200
+
+
+def test_formats_and_metrics(served):
+    server, url, renders = served
+    server.update(report(99.5))
+    response = requests.get(url + "/")
+    assert response.text == "html: 99.5 at 2026-09-01"
+    assert response.headers["Content-Type"] == "text/html; charset=utf-8"
+    assert requests.get(url + "/report.csv").text == "csv: 99.5 at 2026-09-01"
+    assert requests.get(url + "/report.json").status_code == 404
+    assert "telemeter_reporter_clusters 1" in requests.get(url + "/metrics").text
+    # Each format is rendered once
+    requests.get(url + "/report.html")
+    assert renders == ["html", "csv"]
+
+
+def test_etag(served):
+    server, url, renders = served
+    server.update(report(99.5))
+    etag = requests.get(url + "/").headers["ETag"]
+    assert requests.get(url + "/report.csv").headers["ETag"] != etag
+    cached = requests.get(url + "/", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+
+    # A refresh with the same data and time keeps the ETag
+    server.update(report(99.5))
+    assert requests.get(url + "/", headers={"If-None-Match": etag}).status_code == 304
+    assert renders == ["html", "csv", "html"]
+
+    server.update(report(98.0))
+    response = requests.get(url + "/", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.text == "html: 98.0 at 2026-09-01"
+    assert response.headers["ETag"] != etag
+
+
+def test_failed_refresh_keeps_the_report():
+    def refresh():
+        server.stop()
+        raise Exception("Telemeter is down")
+
+    server = ReportServer(refresh, lambda r, fmt: fmt, ["html"], 0)
+    server.update(report(99.5))
+    server.run()
+    assert server.get("html")[0] == b"html"
+    assert server.report.get_sli("external-1", "api") == 99.5
+
+
+def test_unchanged_refresh_updates_the_time(served):
+    server, url, renders = served
+    server.update(report(99.5))
+    html, csv = (requests.get(url + path) for path in ("/", "/report.csv"))
+
+    # The SLIs are the same, but the HTML shows the time of the new report
+    later = REPORT_TIME + timedelta(days=1)
+    server.update(report(99.5, later))
+    assert server.report.time == later
+    response = requests.get(url + "/", headers={"If-None-Match": html.headers["ETag"]})
+    assert response.status_code == 200 and response.text == "html: 99.5 at 2026-09-02"
+    assert response.headers["ETag"] != html.headers["ETag"]
+    # Formats without the time are kept
+    assert requests.get(url + "/report.csv", headers={
+        "If-None-Match": csv.headers["ETag"]}).status_code == 304
+    assert renders == ["html", "csv", "html"]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from telemeter_reporter.report import SLIReport
+from telemeter_reporter.reporter import SLIReporter
+from telemeter_reporter.uhc import Cluster
+
+QUERY_TIME = datetime(2026, 9, 1, tzinfo=timezone.utc)
+RULE = {"name": "api", "goal": 0.99,
+        "query": "sum_over_time((up{${sel}})[${duration}d:10m]) / 1008"}
+
+
+def shard(index, count, time=QUERY_TIME, fingerprint="settings"):
+    report = SLIReport(["api"], [99.0])
+    report.time = time
+    report.fingerprint = fingerprint
+    report.shard = (index, count)
+    report.add_cluster("cluster-{}".format(index), "external-{}".format(index))
+    report.set("external-{}".format(index), "api", 99.5)
+    # Partial reports are handed over as JSON
+    return SLIReport.from_json(json.loads(json.dumps(report.to_json())))
+
+
+def test_merge_shards():
+    merged = SLIReport.merge_shards([shard(2, 3), shard(0, 3), shard(1, 3)])
+    assert merged.external_ids == ["external-2", "external-0", "external-1"]
+    assert merged.time == QUERY_TIME and merged.fingerprint == "settings"
+    assert merged.shard is None
+
+
+@pytest.mark.parametrize("shards, error", [
+    ([shard(0, 3), shard(1, 3)], r"no shard \[2\]"),
+    ([shard(0, 2), shard(1, 2), shard(1, 2)], r"shard \[1\] more than once"),
+    ([shard(0, 2), shard(1, 3)], "split 2 and 3 ways"),
+    ([shard(0, 2), shard(1, 2, time=QUERY_TIME + timedelta(seconds=1))], "different times"),
+    ([shard(0, 2), shard(1, 2, fingerprint="other settings")], "different rules"),
+    ([shard(0, 1), SLIReport(["api"], [99.0])], "don't belong to a shard")])
+def test_merge_incomplete_or_mismatched_shards(shards, error):
+    with pytest.raises(Exception, match=error):
+        SLIReport.merge_shards(shards)
+
+
+def test_shard_fingerprints(make_reporter, clusters):
+    first = make_reporter([RULE]).generate_report(clusters[:1], query_time=QUERY_TIME)
+    second = make_reporter([RULE]).generate_report(clusters[1:], query_time=QUERY_TIME)
+    other = make_reporter([{**RULE, "goal": 0.999}]).generate_report(clusters[1:],
+                                                                      query_time=QUERY_TIME)
+    assert first.fingerprint == second.fingerprint != other.fingerprint
+
+
+def test_shard_clusters_partition():
+    created = datetime.now(timezone.utc) - timedelta(days=365)
+    clusters = [Cluster(str(i), "cluster-{}".format(i), "external-{}".format(i), created)
+                for i in range(100)]
+    shards = [list(SLIReporter.shard_clusters(clusters, index, 4)) for index in range(4)]
+    assert sorted(c.external_id for s in shards for c in s) == \
+        sorted(c.external_id for c in clusters)
+    assert all(shards)
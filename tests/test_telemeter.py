@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from telemeter_reporter.session import build_session, session_from_config
+from telemeter_reporter.telemeter import QueryError, TelemeterClient
+
+
+class FakeResponse(object):
+    def __init__(self, status_code: int, data: dict = None, headers: dict = None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.content = b"{}"
+
+    def json(self) -> dict:
+        return self.data
+
+
+class RecordingSession(object):
+    """
+    Stands in for a requests.Session, answering every request with the next of
+    a list of responses
+    """
+
+    def __init__(self, *responses: FakeResponse):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url: str, **kwargs) -> FakeResponse:
+        self.requests.append((url, kwargs))
+        return self.responses.pop(0)
+
+
+def test_queries_share_the_session_and_token():
+    result = [{"metric": {}, "value": [0, "1"]}]
+    session = RecordingSession(FakeResponse(200, {"data": {"result": result}}),
+                               FakeResponse(200, {"data": {"result": []}}))
+    client = TelemeterClient("https://telemeter.example.com/", "token", session=session,
+                             timeout=30)
+    assert client.custom_query("up", params={"time": "100"}) == result
+    assert client.custom_query_range("up", 0, 600, 60) == []
+
+    (url, first), (range_url, second) = session.requests
+    assert url == "https://telemeter.example.com/api/v1/query"
+    assert range_url == "https://telemeter.example.com/api/v1/query_range"
+    assert first["params"] == {"query": "up", "time": "100"}
+    assert second["params"] == {"query": "up", "start": 0, "end": 600, "step": 60}
+    assert first["headers"] == second["headers"] == {"Authorization": "bearer token"}
+    assert first["timeout"] == second["timeout"] == 30
+
+
+def test_errors_carry_retry_after():
+    session = RecordingSession(FakeResponse(503, headers={"Retry-After": "7"}))
+    client = TelemeterClient("https://telemeter.example.com", "token", session=session)
+    with pytest.raises(QueryError) as error:
+        client.custom_query("up")
+    assert (error.value.status_code, error.value.retry_after) == (503, 7)
+
+
+def test_session_pool_size():
+    adapter = build_session(pool_maxsize=32).get_adapter("https://telemeter.example.com")
+    assert adapter._pool_maxsize == 32
+    config = {"api": {"telemeter": {}}}
+    assert session_from_config(config, 4).get_adapter("https://x")._pool_maxsize == 10
+    assert session_from_config(config, 16).get_adapter("https://x")._pool_maxsize == 16
+    config["api"]["session"] = {"pool_maxsize": 8, "keep_alive": False}
+    session = session_from_config(config, 16)
+    assert session.get_adapter("https://x")._pool_maxsize == 8
+    assert session.headers["Connection"] == "close"
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import time
+
+import jwt
+
+from telemeter_reporter.uhc import UnifiedHybridClient
+
+OFFLINE_TOKEN = jwt.encode({"iss": "https://sso.example.com", "aud": "cloud-services"},
+                           "secret").decode()
+
+
+class FakeResponse(object):
+    def __init__(self, data: dict, status_code: int = 200):
+        self.data = data
+        self.status_code = status_code
+        self.content = b""
+
+    def json(self) -> dict:
+        return self.data
+
+
+class FakeUHCSession(object):
+    """
+    Stands in for the requests.Session of a UnifiedHybridClient, answering token
+    requests and cluster searches for a fleet of made-up clusters
+    """
+
+    def __init__(self, clusters: int, max_size: int = 100, short_pages: tuple = (),
+                 token_lifetime: float = 900):
+        """
+        :param clusters: (int) the number of clusters in the fleet
+        :param max_size: (int) the API returns at most this many clusters per
+            page, whatever page size was requested
+        :param short_pages: (tuple) the numbers of pages that come back with one
+            cluster less than they should, as if it was deleted while paging
+        :param token_lifetime: (float) the number of seconds access tokens are
+            valid for
+        """
+        self.clusters = [{"id": str(i), "name": "cluster-{}".format(i),
+                          "external_id": "external-{}".format(i),
+                          "creation_timestamp": "2026-01-01T00:00:00.123456789Z"}
+                         for i in range(clusters)]
+        self.max_size = max_size
+        self.short_pages = short_pages
+        self.token_lifetime = token_lifetime
+        self.tokens = 0
+        self.pages = []
+
+    def post(self, url: str, data: dict = None, headers: dict = None) -> FakeResponse:
+        self.tokens += 1
+        return FakeResponse({"access_token": jwt.encode({"exp": time.time() + self.token_lifetime},
+                                                        "secret").decode()})
+
+    def get(self, url: str, headers: dict = None, params: dict = None,
+            verify: bool = True) -> FakeResponse:
+        assert headers["Authorization"].startswith("Bearer ")
+        page, size = params["page"], min(params["size"], self.max_size)
+        self.pages.append(page)
+        items = self.clusters[(page - 1) * size:page * size]
+        if page in self.short_pages:
+            items = items[1:]
+        return FakeResponse({"kind": "ClusterList", "page": page, "size": len(items),
+                             "total": len(self.clusters), "items": items})
+
+
+def client(session: FakeUHCSession, page_size: int) -> UnifiedHybridClient:
+    return UnifiedHybridClient("https://uhc.example.com", OFFLINE_TOKEN, session=session,
+                               page_size=page_size, prefetch=2)
+
+
+def test_search_pages_through_every_cluster():
+    session = FakeUHCSession(25)
+    clusters = list(client(session, 10).search_clusters("managed = 't'"))
+    assert [c.external_id for c in clusters] == ["external-{}".format(i) for i in range(25)]
+    assert sorted(session.pages) == [1, 2, 3]
+    # One access token is reused for every page
+    assert session.tokens == 1
+    assert clusters[0].creation_timestamp.microsecond == 123456
+
+
+def test_search_follows_the_page_size_the_api_returned():
+    session = FakeUHCSession(25, max_size=4)
+    clusters = list(client(session, 10).search_clusters("managed = 't'"))
+    assert len(clusters) == 25
+    assert sorted(session.pages) == list(range(1, 8))
+
+
+def test_search_looks_past_short_pages():
+    # A page came back short, so one more page is asked for (which comes back empty)
+    session = FakeUHCSession(20, short_pages=(2,))
+    clusters = list(client(session, 10).search_clusters("managed = 't'"))
+    assert len(clusters) == 19 and sorted(session.pages) == [1, 2, 3]
+
+
+def test_search_stops_early_for_an_empty_page():
+    session = FakeUHCSession(0)
+    assert list(client(session, 10).search_clusters("managed = 't'")) == []
+    assert session.pages == [1]
+
+
+def test_access_token_is_refreshed_before_it_expires(monkeypatch):
+    session = FakeUHCSession(5, token_lifetime=600)
+    uhc = client(session, 10)
+    list(uhc.search_clusters("managed = 't'"))
+    list(uhc.search_clusters("managed = 'f'"))
+    assert session.tokens == 1
+
+    # Within token_expiry_margin of the token's expiry, a new one is fetched
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 600 - uhc.token_expiry_margin + 1)
+    list(uhc.search_clusters("managed = 't'"))
+    assert session.tokens == 2
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import io
+
+import pytest
+
+from telemeter_reporter.writers import CSVReportWriter, HTMLReportWriter, ReportWriter
+
+
+def test_csv_writer():
+    stream = io.StringIO()
+    writer = CSVReportWriter(stream, ["Cluster", "a"])
+    writer.write_row(["one", "99.9"])
+    writer.close()
+    assert stream.getvalue().splitlines() == ["Cluster,a", "one,99.9"]
+    assert writer.rows == 1
+
+
+@pytest.mark.parametrize("placeholder", ["${table}", "$table"])
+def test_html_writer_placeholders(placeholder):
+    stream = io.StringIO()
+    template = "<h1>${title}</h1>$$table " + placeholder + "<p>${footer}</p>"
+    writer = HTMLReportWriter(stream, ["Cluster"], template, style="", title="T")
+    writer.write_row(["one"])
+    writer.close(footer="F")
+    html = stream.getvalue()
+    assert html.startswith("<h1>T</h1>$table <table>")
+    assert html.endswith("</table><p>F</p>")
+    assert "<td style=\"text-align: center;\">one</td>" in html
+
+
+def test_html_writer_without_placeholder():
+    stream = io.StringIO()
+    with pytest.raises(Exception, match="placeholder"):
+        HTMLReportWriter(stream, ["Cluster"], "<h1>${title}</h1>", style="")
+    assert stream.getvalue() == ""
+
+
+def test_writers_must_write_rows():
+    with pytest.raises(TypeError):
+        ReportWriter(io.StringIO(), ["Cluster"])